@@ -0,0 +1,140 @@
+"""
+admission control for the routes that use the database pool
+
+a request either runs right away, waits in a bounded queue for a limited time, or is rejected
+with a 503 at once, instead of waiting for a pool connection until pool_timeout and failing
+together with everything queued behind it. waiting transfers are admitted before waiting
+enquiries, and a transfer arriving at a full queue takes the place of the last enquiry in it.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import AsyncIterator, Callable
+
+from fastapi import HTTPException
+
+import metrics
+
+from . import config
+
+__ALL__ = ["AdmissionController", "AdmissionRejected", "admit", "controller"]
+
+# lower goes first
+PRIORITIES = {"transfer": 0, "enquiry": 1}
+
+rejected_counter = metrics.counter("casa_admission_rejected_total", "requests rejected by admission control")
+wait_seconds = metrics.histogram("casa_admission_wait_seconds", "time requests waited to be admitted")
+
+
+class AdmissionRejected(Exception):
+    """the request was not admitted, reason is queue_full, timeout or shed"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionController:
+    def __init__(self, limit: int, queue_size: int, timeout: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.inflight = 0
+        # (priority, arrival, future) of the waiting requests
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._arrivals = itertools.count()
+
+    @property
+    def depth(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, route_class: str) -> None:
+        """wait for a slot, raises AdmissionRejected if none is available in time"""
+        if self.inflight < self.limit and not self._waiters:
+            self.inflight += 1
+            return
+
+        priority = PRIORITIES[route_class]
+        if len(self._waiters) >= self.queue_size:
+            lowest = max(self._waiters, default=None)
+            if lowest is None or lowest[0] <= priority:
+                raise AdmissionRejected("queue_full")
+            self._remove_(lowest)
+            lowest[2].set_exception(AdmissionRejected("shed"))
+
+        waiter = (priority, next(self._arrivals), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        try:
+            # release() hands its slot over by setting the result, inflight is not changed
+            await asyncio.wait_for(waiter[2], self.timeout)
+        except asyncio.TimeoutError:
+            self._remove_(waiter)
+            if self._handed_over_(waiter):
+                # the slot arrived in the same iteration of the loop as the deadline
+                return
+            raise AdmissionRejected("timeout")
+        except asyncio.CancelledError:
+            self._remove_(waiter)
+            if self._handed_over_(waiter):
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.inflight -= 1
+
+    @staticmethod
+    def _handed_over_(waiter: tuple[int, int, asyncio.Future]) -> bool:
+        return waiter[2].done() and not waiter[2].cancelled() and waiter[2].exception() is None
+
+    def _remove_(self, waiter: tuple[int, int, asyncio.Future]) -> None:
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+
+
+controller = (
+    AdmissionController(config.ADMISSION_LIMIT, config.ADMISSION_QUEUE_SIZE, config.ADMISSION_TIMEOUT)
+    if config.ADMISSION_CONTROL_ENABLED
+    else None
+)
+
+metrics.callback(
+    "casa_admission_queue_depth", "requests waiting to be admitted", lambda: controller.depth if controller else 0
+)
+metrics.callback(
+    "casa_admission_inflight", "admitted requests in progress", lambda: controller.inflight if controller else 0
+)
+
+
+def admit(route_class: str) -> Callable[[], AsyncIterator[None]]:
+    """route dependency that holds an admission slot while the request is handled"""
+
+    async def dependency() -> AsyncIterator[None]:
+        if controller is None:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            await controller.acquire(route_class)
+        except AdmissionRejected as e:
+            rejected_counter.inc(route=route_class, reason=e.reason)
+            raise HTTPException(
+                status_code=503,
+                detail="Service overloaded, try again later",
+                headers={"Retry-After": str(config.ADMISSION_RETRY_AFTER)},
+            )
+        wait_seconds.observe(time.perf_counter() - start, route=route_class)
+        try:
+            yield
+        finally:
+            controller.release()
+
+    return dependency
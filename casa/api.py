@@ -1,12 +1,14 @@
 import logging
 from typing import AsyncIterator
 
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from database import SessionLocal
+from database import SessionLocal, read_router
 
-from . import schemas, service
+from . import admission, export, group_commit, holds, ledger, outbox, schemas, service
+from .responses import FastJSONResponse
 
 logger = logging.getLogger(__name__)
 
@@ -19,32 +21,246 @@ async def db_session() -> AsyncIterator[AsyncSession]:
         yield session
 
 
-@router.get("/accounts/{account_num}", response_model=schemas.AccountSchema)
+# Dependency, for responses that outlive the request handler and need their own session
+def db_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    return SessionLocal
+
+
+# Dependency, same as db_sessionmaker for read only queries, served by the read replica when one is configured
+async def db_read_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    return await read_router.sessionmaker()
+
+
+# Dependency, for read only queries. fastapi resolves db_read_sessionmaker once per request,
+# so a route that uses both reads from the same database
+async def db_read_session(
+    sessionmaker: async_sessionmaker[AsyncSession] = Depends(db_read_sessionmaker),
+) -> AsyncIterator[AsyncSession]:
+    async with sessionmaker() as session:
+        yield session
+
+
+# Dependencies, run before the others so that a rejected request does not open a session
+admit_transfer = Depends(admission.admit("transfer"))
+admit_enquiry = Depends(admission.admit("enquiry"))
+
+
+@router.get("/accounts/{account_num}", response_model=schemas.AccountSchema, dependencies=[admit_enquiry])
 async def get_account_details(
     account_num: str,
-    db_session: AsyncSession = Depends(db_session),
+    db_session: AsyncSession = Depends(db_read_session),
+):
+    if ledger.engine:
+        account = await ledger.get_account_details(db_session, account_num)
+        payload, cache_hit = account.model_dump() if account else None, False
+    else:
+        payload, cache_hit = await service.lookup_account_payload(db_session, account_num)
+
+    if payload:
+        # payload already has the fields of AccountSchema, skip the response_model round trip
+        return FastJSONResponse(
+            payload, headers={"Cache-Status": "core-sim; hit" if cache_hit else "core-sim; fwd=miss"}
+        )
+
+    raise HTTPException(status_code=404, detail="Account not found or inactive")
+
+
+@router.get("/accounts/{account_num}/balance", response_model=schemas.BalanceSchema, dependencies=[admit_enquiry])
+async def get_balance_as_of(
+    account_num: str,
+    as_of: str = Query(..., pattern=r"^\d{4}-\d{2}-\d{2}$"),
+    db_session: AsyncSession = Depends(db_read_session),
 ):
-    account = await service.get_account_details(db_session, account_num)
-    if account:
-        return account
+    balance = await service.get_balance_as_of(db_session, account_num, as_of)
+    if balance:
+        return balance
 
     raise HTTPException(status_code=404, detail="Account not found or inactive")
 
 
-@router.post("/transfers", response_model=schemas.TransferSchema, status_code=201)
+@router.get(
+    "/accounts/{account_num}/transactions", response_model=schemas.TransactionPage, dependencies=[admit_enquiry]
+)
+async def get_transactions(
+    account_num: str,
+    from_date: str | None = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+    to_date: str | None = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: str | None = None,
+    db_session: AsyncSession = Depends(db_read_session),
+):
+    try:
+        page = await service.get_transactions(db_session, account_num, from_date, to_date, limit, cursor)
+    except service.ValidationError as e:
+        service.validation_failures_counter.inc(endpoint="transactions", reason=e.reason)
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if page:
+        return page
+
+    raise HTTPException(status_code=404, detail="Account not found or inactive")
+
+
+@router.get("/transactions/export")
+async def export_transactions(
+    account_num: str | None = None,
+    from_date: str | None = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+    to_date: str | None = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    db_session: AsyncSession = Depends(db_read_session),
+    sessionmaker: async_sessionmaker[AsyncSession] = Depends(db_read_sessionmaker),
+):
+    if not (account_num or from_date or to_date):
+        raise HTTPException(status_code=422, detail="account_num or a date range is required")
+
+    if account_num and not await service.get_account_details(db_session, account_num):
+        raise HTTPException(status_code=404, detail="Account not found or inactive")
+
+    media_type, _ = export.FORMATS[fmt]
+    return StreamingResponse(
+        export.export_transactions(sessionmaker, fmt, account_num, from_date, to_date),
+        media_type=media_type,
+    )
+
+
+@router.post("/transfers", response_model=schemas.TransferSchema, status_code=201, dependencies=[admit_transfer])
 async def transfer(
     transfer_req: schemas.TransferSchema,
-    background_tasks: BackgroundTasks,
     session: AsyncSession = Depends(db_session),
 ):
     try:
-        result, transactions = await service.transfer(session, transfer_req)
-        background_tasks.add_task(service.publish_events, transactions)
+        if ledger.engine:
+            result, transactions = await ledger.transfer(session, transfer_req)
+        elif group_commit.committer:
+            result, transactions = await group_commit.committer.submit(transfer_req)
+        else:
+            result, transactions = await service.transfer(session, transfer_req)
+
+        if not transactions:
+            # a retry of a transfer that was already processed, nothing new to publish
+            logger.info(f"replayed request: {result.ref_id}")
+            return FastJSONResponse(result.model_dump(), status_code=201, headers={"Idempotent-Replayed": "true"})
+
+        # the outbox relay publishes from casa_transaction when it is running
+        if not outbox.relay:
+            await service.publish_events(transactions)
         logger.info(f"processed request: {result.ref_id}")
-        return result
+        return FastJSONResponse(result.model_dump(), status_code=201)
     except service.ValidationError as e:
         logger.info(f"request failed validation: {transfer_req.ref_id}")
+        service.validation_failures_counter.inc(endpoint="transfer", reason=e.reason)
         raise HTTPException(status_code=422, detail=str(e))
+    except service.TransientError as e:
+        logger.warning(f"request failed after retries: {transfer_req.ref_id}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         logger.exception(f"An error occured: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/transfers/batch", response_model=schemas.BatchTransferResponse, dependencies=[admit_transfer])
+async def transfer_batch(
+    batch_req: schemas.BatchTransferRequest,
+    session: AsyncSession = Depends(db_session),
+):
+    if ledger.engine:
+        raise HTTPException(status_code=501, detail="Batch transfers are not supported by the memory backend")
+
+    try:
+        results = await service.transfer_batch(session, batch_req.transfers, atomic=batch_req.mode == "atomic")
+    except service.TransientError as e:
+        logger.warning(f"batch failed after retries: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        logger.exception(f"An error occured: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    items = []
+    transactions = []
+    for transfer_req, result in zip(batch_req.transfers, results):
+        if isinstance(result, service.ValidationError):
+            service.validation_failures_counter.inc(endpoint="batch", reason=result.reason)
+            items.append(
+                schemas.BatchTransferItemResult(ref_id=transfer_req.ref_id, status="rejected", error=str(result))
+            )
+        else:
+            items.append(schemas.BatchTransferItemResult(ref_id=transfer_req.ref_id, status="ok", transfer=result[0]))
+            transactions.extend(result[1])
+
+    committed = sum(1 for item in items if item.status == "ok")
+    if transactions and not outbox.relay:
+        await service.publish_events(transactions)
+    logger.info(f"processed batch of {len(items)} requests, {committed} committed")
+
+    return schemas.BatchTransferResponse(
+        mode=batch_req.mode,
+        committed=committed,
+        rejected=len(items) - committed,
+        results=items,
+    )
+
+
+@router.post("/holds", response_model=schemas.HoldSchema, status_code=201, dependencies=[admit_transfer])
+async def place_hold(
+    hold_req: schemas.HoldRequest,
+    session: AsyncSession = Depends(db_session),
+):
+    if ledger.engine:
+        raise HTTPException(status_code=501, detail="Holds are not supported by the memory backend")
+
+    try:
+        result, replayed = await holds.place_hold(session, hold_req)
+    except service.ValidationError as e:
+        logger.info(f"hold failed validation: {hold_req.ref_id}")
+        service.validation_failures_counter.inc(endpoint="hold", reason=e.reason)
+        raise HTTPException(status_code=422, detail=str(e))
+
+    headers = {"Idempotent-Replayed": "true"} if replayed else None
+    return FastJSONResponse(result.model_dump(), status_code=201, headers=headers)
+
+
+@router.get("/holds/{hold_id}", response_model=schemas.HoldSchema, dependencies=[admit_enquiry])
+async def get_hold(
+    hold_id: str,
+    session: AsyncSession = Depends(db_session),
+):
+    result = await holds.get_hold(session, hold_id)
+    if result:
+        return FastJSONResponse(result.model_dump())
+
+    raise HTTPException(status_code=404, detail="Hold not found")
+
+
+@router.post("/holds/{hold_id}/capture", response_model=schemas.HoldSchema, dependencies=[admit_transfer])
+async def capture_hold(
+    hold_id: str,
+    capture_req: schemas.CaptureRequest | None = None,
+    session: AsyncSession = Depends(db_session),
+):
+    try:
+        result = await holds.capture_hold(session, hold_id, capture_req.amount if capture_req else None)
+    except service.ValidationError as e:
+        service.validation_failures_counter.inc(endpoint="capture", reason=e.reason)
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if result:
+        return FastJSONResponse(result.model_dump())
+
+    raise HTTPException(status_code=404, detail="Hold not found")
+
+
+@router.post("/holds/{hold_id}/release", response_model=schemas.HoldSchema, dependencies=[admit_transfer])
+async def release_hold(
+    hold_id: str,
+    session: AsyncSession = Depends(db_session),
+):
+    try:
+        result = await holds.release_hold(session, hold_id)
+    except service.ValidationError as e:
+        service.validation_failures_counter.inc(endpoint="release", reason=e.reason)
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if result:
+        return FastJSONResponse(result.model_dump())
+
+    raise HTTPException(status_code=404, detail="Hold not found")
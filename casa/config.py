@@ -0,0 +1,130 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def env_bool(var_name: str, default: bool = False) -> bool:
+    value = os.environ.get(var_name)
+    if value is None:
+        return default
+    return value.upper() in ["1", "Y", "YES", "TRUE"]
+
+
+def env_int(var_name: str, default: int) -> int:
+    return int(os.environ.get(var_name, default))
+
+
+def env_float(var_name: str, default: float) -> float:
+    return float(os.environ.get(var_name, default))
+
+
+# group commit mode for POST /transfers
+# concurrent requests are collected for up to GROUP_COMMIT_WINDOW_MS milliseconds
+# or GROUP_COMMIT_MAX_SIZE requests, whichever comes first, and committed together
+GROUP_COMMIT_ENABLED = env_bool("GROUP_COMMIT")
+GROUP_COMMIT_WINDOW_MS = env_float("GROUP_COMMIT_WINDOW_MS", 2.0)
+GROUP_COMMIT_MAX_SIZE = env_int("GROUP_COMMIT_MAX_SIZE", 100)
+
+# engine used by service.transfer
+# orm: lock both accounts with SELECT ... FOR UPDATE and flush the modified ORM objects
+# core: conditional UPDATE ... RETURNING statements, no separate locking read
+TRANSFER_ENGINE = os.environ.get("TRANSFER_ENGINE", "orm")
+
+# number of recently completed transfers kept in memory by ref_id,
+# so that client retries can be answered without touching the database
+IDEMPOTENCY_CACHE_SIZE = env_int("IDEMPOTENCY_CACHE_SIZE", 10000)
+
+# outbox relay, publishes unpublished casa_transaction rows in the background
+# see events.create_sink for the supported OUTBOX_SINK values
+OUTBOX_RELAY_ENABLED = env_bool("OUTBOX_RELAY")
+OUTBOX_SINK = os.environ.get("OUTBOX_SINK", "log:")
+OUTBOX_BATCH_SIZE = env_int("OUTBOX_BATCH_SIZE", 500)
+OUTBOX_POLL_INTERVAL = env_float("OUTBOX_POLL_INTERVAL", 1.0)
+
+# read-through cache of active accounts for GET /accounts/{account_num}
+# a size of 0 disables the cache. transfers invalidate the cached accounts after commit,
+# the ttl bounds how stale an entry can get when updated by another worker process
+ACCOUNT_CACHE_SIZE = env_int("ACCOUNT_CACHE_SIZE", 0)
+ACCOUNT_CACHE_TTL = env_float("ACCOUNT_CACHE_TTL", 5.0)
+
+# transactions failing with a deadlock or serialization failure are retried up to DB_RETRY_LIMIT times,
+# with a jittered exponential backoff between DB_RETRY_BASE_MS and DB_RETRY_MAX_MS.
+# retries across all requests are limited to DB_RETRY_BUDGET_RATIO per request, with a burst of DB_RETRY_BUDGET_MAX
+DB_RETRY_LIMIT = env_int("DB_RETRY_LIMIT", 3)
+DB_RETRY_BASE_MS = env_float("DB_RETRY_BASE_MS", 5.0)
+DB_RETRY_MAX_MS = env_float("DB_RETRY_MAX_MS", 200.0)
+DB_RETRY_BUDGET_RATIO = env_float("DB_RETRY_BUDGET_RATIO", 0.2)
+DB_RETRY_BUDGET_MAX = env_float("DB_RETRY_BUDGET_MAX", 20.0)
+
+# db: accounts are locked and updated in the database by every transfer
+# memory: balances are held by the in-memory ledger and written to the database in the background,
+#         for simulation and load testing with a single worker process only
+CASA_BACKEND = os.environ.get("CASA_BACKEND", "db")
+LEDGER_DIR = os.environ.get("LEDGER_DIR", "ledger")
+LEDGER_SHARDS = env_int("LEDGER_SHARDS", 8)
+LEDGER_PERSIST_BATCH_SIZE = env_int("LEDGER_PERSIST_BATCH_SIZE", 5000)
+LEDGER_PERSIST_INTERVAL = env_float("LEDGER_PERSIST_INTERVAL", 1.0)
+LEDGER_SNAPSHOT_INTERVAL = env_float("LEDGER_SNAPSHOT_INTERVAL", 300.0)
+LEDGER_FSYNC = env_bool("LEDGER_FSYNC")
+
+# request profiling with cProfile, a request is profiled when it has the PROFILING_HEADER header
+# or once every PROFILING_SAMPLE_N requests (0 disables sampling). the last PROFILING_KEEP profiles
+# are kept in PROFILING_DIR, GET /admin/profiles lists the functions with the most time across them.
+# the route is only added when PROFILING_ADMIN_TOKEN is set, and requires it in the X-Admin-Token header
+PROFILING_ENABLED = env_bool("PROFILING")
+PROFILING_DIR = os.environ.get("PROFILING_DIR", "profiles")
+PROFILING_HEADER = os.environ.get("PROFILING_HEADER", "X-Profile")
+PROFILING_SAMPLE_N = env_int("PROFILING_SAMPLE_N", 0)
+PROFILING_KEEP = env_int("PROFILING_KEEP", 200)
+PROFILING_ADMIN_TOKEN = os.environ.get("PROFILING_ADMIN_TOKEN")
+
+# monthly partitions of casa_transaction on postgresql, see casa/partitions.py
+# the partitions of the current month and the next PARTITION_MONTHS_AHEAD months are created every
+# PARTITION_CHECK_INTERVAL seconds. retention.py archives partitions older than RETENTION_MONTHS to ARCHIVE_DIR
+PARTITION_MAINTENANCE_ENABLED = env_bool("PARTITION_MAINTENANCE")
+PARTITION_MONTHS_AHEAD = env_int("PARTITION_MONTHS_AHEAD", 3)
+PARTITION_CHECK_INTERVAL = env_float("PARTITION_CHECK_INTERVAL", 3600.0)
+RETENTION_MONTHS = env_int("RETENTION_MONTHS", 24)
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+
+# admission control in front of the database pool for the transfer and account routes
+# at most ADMISSION_LIMIT requests run at once, up to ADMISSION_QUEUE_SIZE more wait for up to
+# ADMISSION_TIMEOUT seconds, transfers ahead of enquiries. requests beyond that get a 503 right away
+# with a Retry-After of ADMISSION_RETRY_AFTER seconds. the limit should not exceed the pool size
+ADMISSION_CONTROL_ENABLED = env_bool("ADMISSION_CONTROL")
+ADMISSION_LIMIT = env_int("ADMISSION_LIMIT", 20)
+ADMISSION_QUEUE_SIZE = env_int("ADMISSION_QUEUE_SIZE", 100)
+ADMISSION_TIMEOUT = env_float("ADMISSION_TIMEOUT", 1.0)
+ADMISSION_RETRY_AFTER = env_int("ADMISSION_RETRY_AFTER", 1)
+
+# warm-up of every worker before it reports ready on GET /ready, see casa/warmup.py
+# WARMUP_CONNECTIONS connections are opened, pool_size in database.py by default.
+# the time to the first request faster than WARMUP_FAST_REQUEST_MS is reported in the metrics
+WARMUP_ENABLED = env_bool("WARMUP")
+WARMUP_CONNECTIONS = env_int("WARMUP_CONNECTIONS", 20)
+WARMUP_FAST_REQUEST_MS = env_float("WARMUP_FAST_REQUEST_MS", 50.0)
+
+# two phase holds on avail_balance, see casa/holds.py. a hold expires HOLD_TTL seconds after it is
+# placed unless its request says otherwise. with HOLD_SETTLEMENT enabled, captured holds are posted
+# and expired ones released every HOLD_SETTLE_INTERVAL seconds, HOLD_SETTLE_BATCH_SIZE per transaction.
+# holds are not supported by the memory backend, the worker refuses to start with it
+HOLD_TTL = env_int("HOLD_TTL", 7 * 24 * 3600)
+HOLD_SETTLEMENT_ENABLED = env_bool("HOLD_SETTLEMENT")
+HOLD_SETTLE_BATCH_SIZE = env_int("HOLD_SETTLE_BATCH_SIZE", 500)
+HOLD_SETTLE_INTERVAL = env_float("HOLD_SETTLE_INTERVAL", 1.0)
+
+# event pipeline for the events of transfers, when the outbox relay is not running. see casa/pipeline.py
+# events are queued, up to EVENT_QUEUE_SIZE, and sent to EVENT_SINK (see events.create_sink) in batches
+# of EVENT_BATCH_SIZE or every EVENT_FLUSH_MS milliseconds. requests wait up to EVENT_PUT_TIMEOUT seconds
+# for room in a full queue before their events are dropped. the queue is flushed for up to
+# EVENT_FLUSH_TIMEOUT seconds on shutdown. requests only queue the ids of their postings,
+# the publisher loads each batch of them with one query, outside of the requests
+EVENT_PIPELINE_ENABLED = env_bool("EVENT_PIPELINE")
+EVENT_SINK = os.environ.get("EVENT_SINK", "log:")
+EVENT_QUEUE_SIZE = env_int("EVENT_QUEUE_SIZE", 10000)
+EVENT_BATCH_SIZE = env_int("EVENT_BATCH_SIZE", 500)
+EVENT_FLUSH_MS = env_float("EVENT_FLUSH_MS", 50.0)
+EVENT_PUT_TIMEOUT = env_float("EVENT_PUT_TIMEOUT", 1.0)
+EVENT_FLUSH_TIMEOUT = env_float("EVENT_FLUSH_TIMEOUT", 10.0)
@@ -0,0 +1,81 @@
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, func, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from . import models
+
+__ALL__ = ["snapshot_balances"]
+
+logger = logging.getLogger(__name__)
+
+
+async def snapshot_balances(
+    sessionmaker: async_sessionmaker[AsyncSession],
+    balance_date: str,
+    chunk_size: int = 10000,
+    stats: dict[str, float] | None = None,
+) -> int:
+    """
+    write the balance of every account at the end of balance_date to casa_daily_balance.
+    the balance is the current balance less the postings dated after balance_date, computed
+    with one INSERT ... SELECT per chunk_size account ids, each chunk in its own transaction.
+    existing snapshots of the same date are replaced, so the job can be run again.
+    returns the number of snapshots written.
+    """
+    start = time.perf_counter()
+    async with sessionmaker() as session:
+        ids = select(func.min(models.Account.id), func.max(models.Account.id))
+        lowest, highest = (await session.execute(ids)).one()
+
+    count = 0
+    for lo in range(lowest or 0, (highest or -1) + 1, chunk_size):
+        hi = lo + chunk_size
+        async with sessionmaker() as session:
+            count += await _snapshot_chunk_(session, balance_date, lo, hi)
+            await session.commit()
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"wrote {count} balance snapshots for {balance_date} in {elapsed:.3f}s")
+    if stats is not None:
+        stats.update({"rows": count, "seconds": elapsed})
+    return count
+
+
+async def _snapshot_chunk_(session: AsyncSession, balance_date: str, lo: int, hi: int) -> int:
+    later_postings = (
+        select(models.Transaction.account_id, func.sum(models.Transaction.amount).label("amount"))
+        .filter(
+            models.Transaction.account_id >= lo,
+            models.Transaction.account_id < hi,
+            models.Transaction.trx_date > balance_date,
+        )
+        .group_by(models.Transaction.account_id)
+        .subquery()
+    )
+    balances = (
+        select(
+            models.Account.id,
+            literal(balance_date),
+            models.Account.balance - func.coalesce(later_postings.c.amount, 0),
+            literal(datetime.now()),
+        )
+        .outerjoin(later_postings, later_postings.c.account_id == models.Account.id)
+        .filter(models.Account.id >= lo, models.Account.id < hi)
+    )
+
+    await session.execute(
+        delete(models.DailyBalance).filter(
+            models.DailyBalance.balance_date == balance_date,
+            models.DailyBalance.account_id >= lo,
+            models.DailyBalance.account_id < hi,
+        )
+    )
+    result = await session.execute(
+        models.DailyBalance.__table__.insert().from_select(
+            ["account_id", "balance_date", "balance", "created_at"], balances
+        )
+    )
+    return result.rowcount
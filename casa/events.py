@@ -0,0 +1,104 @@
+import asyncio
+import json
+import logging
+from typing import Any, Protocol
+
+__ALL__ = ["EventSink", "LogSink", "FileSink", "SocketSink", "MemorySink", "create_sink"]
+
+logger = logging.getLogger(__name__)
+
+
+class EventSink(Protocol):
+    """destination for published events, each event is a json serializable dict"""
+
+    async def publish(self, events: list[dict[str, Any]]) -> None: ...
+
+    async def close(self) -> None: ...
+
+
+class LogSink:
+    async def publish(self, events: list[dict[str, Any]]) -> None:
+        for event in events:
+            logger.debug(f"publishing event {json.dumps(event, default=str)}")
+
+    async def close(self) -> None:
+        pass
+
+
+class FileSink:
+    """append events to a local file, one json document per line"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a")
+
+    def _write(self, lines: str) -> None:
+        self._file.write(lines)
+        self._file.flush()
+
+    async def publish(self, events: list[dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(event, default=str) + "\n" for event in events)
+        await asyncio.to_thread(self._write, lines)
+
+    async def close(self) -> None:
+        self._file.close()
+
+
+class SocketSink:
+    """send events to a unix domain socket, one json document per line"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def publish(self, events: list[dict[str, Any]]) -> None:
+        if self._writer is None:
+            _, self._writer = await asyncio.open_unix_connection(self.path)
+
+        try:
+            self._writer.write("".join(json.dumps(event, default=str) + "\n" for event in events).encode())
+            await self._writer.drain()
+        except (ConnectionError, OSError):
+            # reconnect on the next publish, the caller will retry the batch
+            self._writer = None
+            raise
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+
+class MemorySink:
+    """keep events in memory, for testing"""
+
+    def __init__(self):
+        self.events: list[dict[str, Any]] = []
+
+    async def publish(self, events: list[dict[str, Any]]) -> None:
+        self.events.extend(events)
+
+    async def close(self) -> None:
+        pass
+
+
+def create_sink(sink_url: str) -> EventSink:
+    """
+    create a sink from a url like string:
+        log:              log events at debug level
+        file:/path        append to a ndjson file
+        unix:/path        write to a unix domain socket
+        memory:           keep events in memory
+    """
+    scheme, _, path = sink_url.partition(":")
+    if scheme == "log":
+        return LogSink()
+    elif scheme == "file":
+        return FileSink(path)
+    elif scheme == "unix":
+        return SocketSink(path)
+    elif scheme == "memory":
+        return MemorySink()
+
+    raise ValueError(f"unsupported event sink {sink_url}")
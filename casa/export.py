@@ -0,0 +1,103 @@
+import csv
+import io
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Callable, Sequence
+
+from sqlalchemy import Row, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from . import models
+
+__ALL__ = ["FORMATS", "export_transactions"]
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = [
+    "id",
+    "account_num",
+    "trx_id",
+    "ref_id",
+    "trx_date",
+    "currency",
+    "amount",
+    "running_balance",
+    "memo",
+    "created_at",
+]
+
+
+def _format_ndjson_(rows: Sequence[Row[Any]], header: bool) -> str:
+    return "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str) + "\n" for row in rows)
+
+
+def _format_csv_(rows: Sequence[Row[Any]], header: bool) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+# format name -> (media type, formatter)
+FORMATS: dict[str, tuple[str, Callable[[Sequence[Row[Any]], bool], str]]] = {
+    "ndjson": ("application/x-ndjson", _format_ndjson_),
+    "csv": ("text/csv", _format_csv_),
+}
+
+
+async def export_transactions(
+    sessionmaker: async_sessionmaker[AsyncSession],
+    fmt: str,
+    account_num: str | None = None,
+    from_date: str | None = None,
+    to_date: str | None = None,
+    batch_size: int = 1000,
+    stats: dict[str, float] | None = None,
+) -> AsyncIterator[str]:
+    """
+    stream transactions of an account and/or a date range as chunks of text in the given format.
+    rows are fetched from a server side cursor batch_size at a time, so memory usage does not grow
+    with the number of rows exported. the generator opens its own session because it outlives the
+    request handler that creates it.
+    """
+    _, formatter = FORMATS[fmt]
+
+    stmt = select(
+        models.Transaction.id,
+        models.Account.account_num,
+        models.Transaction.trx_id,
+        models.Transaction.ref_id,
+        models.Transaction.trx_date,
+        models.Transaction.currency,
+        models.Transaction.amount,
+        models.Transaction.running_balance,
+        models.Transaction.memo,
+        models.Transaction.created_at,
+    ).join(models.Transaction.account)
+    if account_num:
+        stmt = stmt.filter(models.Account.account_num == account_num)
+    if from_date:
+        stmt = stmt.filter(models.Transaction.trx_date >= from_date)
+    if to_date:
+        stmt = stmt.filter(models.Transaction.trx_date <= to_date)
+    stmt = stmt.order_by(models.Transaction.trx_date, models.Transaction.id).execution_options(yield_per=batch_size)
+
+    count = 0
+    start = time.perf_counter()
+    async with sessionmaker() as session:
+        result = await session.stream(stmt)
+        async for rows in result.partitions():
+            yield formatter(rows, count == 0)
+            count += len(rows)
+
+    if count == 0 and fmt == "csv":
+        yield formatter([], True)
+
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    logger.info(f"exported {count} transactions in {elapsed:.3f}s, {rate:.0f} rows/s")
+    if stats is not None:
+        stats.update({"rows": count, "seconds": elapsed, "rows_per_second": rate})
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from typing import Type
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from . import models, schemas, service
+
+__ALL__ = ["GroupCommitter", "committer", "start", "stop"]
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitter:
+    """
+    collects concurrent transfer requests and applies them in one database transaction,
+    so that many transfers share the cost of a single commit.
+
+    a batch is closed when window_ms has passed since its first request
+    or when it reaches max_size requests, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        sessionmaker: async_sessionmaker[AsyncSession],
+        window_ms: float,
+        max_size: int,
+    ):
+        self._sessionmaker = sessionmaker
+        self._window = window_ms / 1000.0
+        self._max_size = max_size
+        self._queue: asyncio.Queue[tuple[schemas.TransferSchema, asyncio.Future]] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """stop accepting new batches after the pending requests are committed"""
+        if self._task is None:
+            return
+
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def submit(
+        self, transfer: schemas.TransferSchema
+    ) -> tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]]:
+        """queue a transfer and wait for the batch it belongs to be committed"""
+        if self._task is None:
+            raise RuntimeError("GroupCommitter is not running")
+
+        # a retry of a transfer completed recently is answered without waiting for a batch
+        replay = service.completed_transfers.get(transfer.ref_id)
+        if replay:
+            return service._check_replay_(transfer, replay), []
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((transfer, future))
+        return await future
+
+    async def _next_batch(self) -> list[tuple[schemas.TransferSchema, asyncio.Future]]:
+        batch = [await self._queue.get()]
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._window
+        while len(batch) < self._max_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._commit_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _commit_one(
+        self, transfer: schemas.TransferSchema
+    ) -> tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]] | Exception:
+        try:
+            async with self._sessionmaker() as session:
+                return await service.transfer(session, transfer)
+        except Exception as e:
+            return e
+
+    async def _commit_batch(self, batch: list[tuple[schemas.TransferSchema, asyncio.Future]]) -> None:
+        results: list[tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]] | Exception]
+        try:
+            async with self._sessionmaker() as session:
+                results = await service.transfer_batch(session, [transfer for transfer, _ in batch])
+        except IntegrityError as e:
+            # most likely a ref_id committed by another worker or /transfers/batch after the batch looked
+            # for replays. the transfers are committed one at a time, so only that one becomes a replay
+            # instead of failing every transfer in the batch
+            logger.warning(f"group commit of {len(batch)} transfers failed, committing them one by one: {str(e)}")
+            results = [await self._commit_one(transfer) for transfer, _ in batch]
+        except Exception as e:
+            logger.exception(f"group commit of {len(batch)} transfers failed: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        logger.debug(f"group committed {len(batch)} transfers")
+        for (_, future), result in zip(batch, results):
+            # the caller may have gone away while the batch was being committed
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+committer: GroupCommitter | None = None
+
+
+async def start(sessionmaker: async_sessionmaker[AsyncSession], window_ms: float, max_size: int) -> GroupCommitter:
+    global committer
+    committer = GroupCommitter(sessionmaker, window_ms, max_size)
+    await committer.start()
+    return committer
+
+
+async def stop() -> None:
+    global committer
+    if committer is not None:
+        await committer.stop()
+        committer = None
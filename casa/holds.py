@@ -0,0 +1,455 @@
+"""
+two phase holds on avail_balance
+
+a hold reserves funds with a single conditional UPDATE of avail_balance, without locking the account
+for the rest of the request or writing any posting. it is then either captured, in full or in part,
+or released. captured holds are posted to balance and casa_transaction as transfers, in batches,
+by the settlement worker, which also expires the holds that were not captured in time.
+while a hold is active, avail_balance is balance less the amount of the active holds of the account.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Type
+
+import ulid
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+import metrics
+
+from . import config, models, outbox, schemas, service
+from .service import ValidationError
+
+__ALL__ = [
+    "HoldSettler",
+    "capture_hold",
+    "expire_holds",
+    "get_hold",
+    "place_hold",
+    "release_hold",
+    "settle_captured",
+    "settler",
+    "start",
+    "stop",
+]
+
+logger = logging.getLogger(__name__)
+
+CENTS = Decimal("0.01")
+
+holds_counter = metrics.counter("casa_holds_total", "changes of the status of holds")
+
+
+def _amount_(value: float) -> Decimal:
+    # amounts are floats in the schemas, they are compared with the stored DECIMAL(14, 2) values
+    return Decimal(value).quantize(CENTS)
+
+
+def _hold_payload_(hold: models.Hold, **changes: Any) -> dict[str, Any]:
+    payload = {
+        "hold_id": hold.hold_id,
+        "ref_id": hold.ref_id,
+        "debit_account_num": hold.debit_account_num,
+        "credit_account_num": hold.credit_account_num,
+        "currency": hold.currency,
+        "amount": float(hold.amount),
+        "captured_amount": None if hold.captured_amount is None else float(hold.captured_amount),
+        "memo": hold.memo,
+        "status": hold.status.value,
+        "expires_at": hold.expires_at,
+        "trx_id": hold.trx_id,
+        "created_at": hold.created_at,
+    }
+    payload.update(changes)
+    return payload
+
+
+async def _find_hold_(session: AsyncSession, **criteria: str) -> models.Hold | None:
+    return (await session.execute(select(models.Hold).filter_by(**criteria))).scalars().first()
+
+
+async def get_hold(session: AsyncSession, hold_id: str) -> schemas.HoldSchema | None:
+    hold = await _find_hold_(session, hold_id=hold_id)
+    return schemas.HoldSchema.model_construct(**_hold_payload_(hold)) if hold else None
+
+
+def _check_hold_replay_(req: schemas.HoldRequest, hold: models.Hold) -> schemas.HoldSchema:
+    """make sure a retried request is the same hold as the one it replays"""
+    if (
+        req.debit_account_num != hold.debit_account_num
+        or req.credit_account_num != hold.credit_account_num
+        or req.currency != hold.currency
+        or _amount_(req.amount) != hold.amount
+    ):
+        raise ValidationError(f"ref_id {req.ref_id} has already been used by a different hold", reason="ref_id_reused")
+    return schemas.HoldSchema.model_construct(**_hold_payload_(hold))
+
+
+async def place_hold(session: AsyncSession, req: schemas.HoldRequest) -> tuple[schemas.HoldSchema, bool]:
+    """
+    reserve the amount of the hold on the debit account, returns the hold and
+    whether it is a replay of a hold already placed with the same ref_id
+    """
+    replay = await _find_hold_(session, ref_id=req.ref_id)
+    if replay:
+        return _check_hold_replay_(req, replay), True
+
+    if req.debit_account_num == req.credit_account_num or not await service._get_account_(
+        session, req.credit_account_num
+    ):
+        raise ValidationError("Invalid debit or credit account number", reason="invalid_account")
+
+    now_dt = datetime.now()
+    amount = _amount_(req.amount)
+    debit_stmt = (
+        update(models.Account)
+        .where(
+            models.Account.account_num == req.debit_account_num,
+            models.Account.status == models.StatusEnum.ACTIVE,
+            models.Account.avail_balance >= amount,
+        )
+        .values(avail_balance=models.Account.avail_balance - amount, updated_at=now_dt)
+        .returning(models.Account.id)
+        .execution_options(synchronize_session=False)
+    )
+    account_id = (await session.execute(debit_stmt)).scalar()
+    if account_id is None:
+        await session.rollback()
+        if await service._get_account_(session, req.debit_account_num):
+            raise ValidationError("Insufficient funds in debit account", reason="insufficient_funds")
+        raise ValidationError("Invalid debit or credit account number", reason="invalid_account")
+
+    hold = models.Hold(
+        hold_id=str(ulid.new()),
+        ref_id=req.ref_id,
+        account_id=account_id,
+        debit_account_num=req.debit_account_num,
+        credit_account_num=req.credit_account_num,
+        currency=req.currency,
+        amount=amount,
+        memo=req.memo,
+        status=models.HoldStatusEnum.HELD,
+        expires_at=now_dt + timedelta(seconds=req.expires_in or config.HOLD_TTL),
+        created_at=now_dt,
+        updated_at=now_dt,
+    )
+    session.add(hold)
+    try:
+        await session.commit()
+    except IntegrityError:
+        # a concurrent request with the same ref_id, the reservation is rolled back with it
+        await session.rollback()
+        replay = await _find_hold_(session, ref_id=req.ref_id)
+        if replay is None:
+            raise
+        return _check_hold_replay_(req, replay), True
+
+    service._invalidate_accounts_([req.debit_account_num])
+    holds_counter.inc(event="placed")
+    return schemas.HoldSchema.model_construct(**_hold_payload_(hold)), False
+
+
+async def _return_funds_(session: AsyncSession, amounts: dict[int, Decimal], now_dt: datetime) -> None:
+    """add the amounts back to the avail_balance of the accounts, by account id"""
+    for account_id in sorted(amounts):
+        await session.execute(
+            update(models.Account)
+            .where(models.Account.id == account_id)
+            .values(avail_balance=models.Account.avail_balance + amounts[account_id], updated_at=now_dt)
+            .execution_options(synchronize_session=False)
+        )
+
+
+async def _change_status_(
+    session: AsyncSession,
+    hold: models.Hold,
+    now_dt: datetime,
+    status: models.HoldStatusEnum,
+    *criteria: Any,
+    **values: Any,
+) -> None:
+    """move an active hold to status, raises ValidationError if it is no longer active"""
+    stmt = (
+        update(models.Hold)
+        .where(models.Hold.id == hold.id, models.Hold.status == models.HoldStatusEnum.HELD, *criteria)
+        .values(status=status, updated_at=now_dt, **values)
+        .returning(models.Hold.id)
+        .execution_options(synchronize_session=False)
+    )
+    if (await session.execute(stmt)).scalar() is None:
+        # the rollback expires hold
+        message = f"Hold {hold.hold_id} is not active"
+        await session.rollback()
+        raise ValidationError(message, reason="hold_not_active")
+
+
+async def capture_hold(session: AsyncSession, hold_id: str, amount: float | None = None) -> schemas.HoldSchema | None:
+    """
+    capture amount of a hold, all of it by default, returns None if the hold is not found.
+    the rest of a partial capture is given back to avail_balance right away,
+    the captured amount is posted by the settlement worker.
+    """
+    hold = await _find_hold_(session, hold_id=hold_id)
+    if hold is None:
+        return None
+
+    captured = hold.amount if amount is None else _amount_(amount)
+    if hold.status in (models.HoldStatusEnum.CAPTURED, models.HoldStatusEnum.SETTLED):
+        if hold.captured_amount == captured:
+            # a retry of the capture
+            return schemas.HoldSchema.model_construct(**_hold_payload_(hold))
+        raise ValidationError(f"Hold {hold_id} has already been captured", reason="hold_not_active")
+    if captured > hold.amount:
+        raise ValidationError("Capture amount exceeds the amount held", reason="invalid_amount")
+
+    now_dt = datetime.now()
+    await _change_status_(
+        session,
+        hold,
+        now_dt,
+        models.HoldStatusEnum.CAPTURED,
+        # an expired hold can no longer be captured, even before the sweeper gets to it
+        models.Hold.expires_at > now_dt,
+        captured_amount=captured,
+    )
+    if captured < hold.amount:
+        await _return_funds_(session, {hold.account_id: hold.amount - captured}, now_dt)
+    await session.commit()
+
+    service._invalidate_accounts_([hold.debit_account_num])
+    holds_counter.inc(event="captured")
+    return schemas.HoldSchema.model_construct(
+        **_hold_payload_(hold, status=models.HoldStatusEnum.CAPTURED.value, captured_amount=float(captured))
+    )
+
+
+async def release_hold(session: AsyncSession, hold_id: str) -> schemas.HoldSchema | None:
+    """give the amount of an active hold back to avail_balance, returns None if the hold is not found"""
+    hold = await _find_hold_(session, hold_id=hold_id)
+    if hold is None:
+        return None
+    if hold.status == models.HoldStatusEnum.RELEASED:
+        return schemas.HoldSchema.model_construct(**_hold_payload_(hold))
+
+    now_dt = datetime.now()
+    await _change_status_(session, hold, now_dt, models.HoldStatusEnum.RELEASED)
+    await _return_funds_(session, {hold.account_id: hold.amount}, now_dt)
+    await session.commit()
+
+    service._invalidate_accounts_([hold.debit_account_num])
+    holds_counter.inc(event="released")
+    return schemas.HoldSchema.model_construct(**_hold_payload_(hold, status=models.HoldStatusEnum.RELEASED.value))
+
+
+async def settle_captured(session: AsyncSession, batch_size: int) -> int:
+    """
+    post up to batch_size captured holds as transfers in one transaction, returns the number settled.
+    the accounts of the whole batch are locked with a single query, so a busy account is locked
+    and updated once per batch instead of once per hold.
+    """
+    holds = (
+        (
+            await session.execute(
+                select(models.Hold)
+                .filter(models.Hold.status == models.HoldStatusEnum.CAPTURED)
+                .order_by(models.Hold.id)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+        )
+        .scalars()
+        .all()
+    )
+    if not holds:
+        await session.rollback()
+        return 0
+
+    accounts = await service._lock_accounts_(
+        session, [hold.debit_account_num for hold in holds] + [hold.credit_account_num for hold in holds]
+    )
+    now_dt = datetime.now()
+    trx_date = now_dt.strftime("%Y-%m-%d")
+    returned: dict[int, Decimal] = defaultdict(Decimal)
+    transactions: list[models.Transaction] = []
+    settled = 0
+    for hold in holds:
+        debit_account = accounts.get(hold.debit_account_num)
+        credit_account = accounts.get(hold.credit_account_num)
+        captured = hold.captured_amount or Decimal(0)
+        if debit_account is None or credit_account is None:
+            # an account was closed after the capture, the funds go back to the debit account
+            logger.warning(f"hold {hold.hold_id} released at settlement, account no longer active")
+            hold.status = models.HoldStatusEnum.RELEASED
+            returned[hold.account_id] += captured
+            continue
+
+        trx_id = str(ulid.new())
+        # the debit side was already taken off avail_balance by the hold
+        debit_account.balance -= captured
+        credit_account.balance += captured
+        credit_account.avail_balance += captured
+        transactions.append(
+            models.Transaction(
+                ref_id=hold.ref_id,
+                trx_date=trx_date,
+                currency=hold.currency,
+                amount=-captured,
+                memo=hold.memo,
+                account=debit_account,
+                created_at=now_dt,
+                running_balance=debit_account.balance,
+                trx_id=trx_id,
+            )
+        )
+        transactions.append(
+            models.Transaction(
+                ref_id=hold.ref_id,
+                trx_date=trx_date,
+                currency=hold.currency,
+                amount=captured,
+                memo=f"from {hold.debit_account_num}: {hold.memo}",
+                account=credit_account,
+                created_at=now_dt,
+                running_balance=credit_account.balance,
+                trx_id=trx_id,
+            )
+        )
+        session.add(
+            models.Transfer(
+                trx_id=trx_id,
+                # ref_id is unique across transfers, the hold_id keeps it apart from the ref_ids of clients
+                ref_id=hold.hold_id,
+                trx_date=trx_date,
+                currency=hold.currency,
+                amount=captured,
+                memo=hold.memo,
+                debit_account_num=hold.debit_account_num,
+                credit_account_num=hold.credit_account_num,
+                created_at=now_dt,
+            )
+        )
+        hold.status = models.HoldStatusEnum.SETTLED
+        hold.trx_id = trx_id
+        settled += 1
+
+    session.add_all(transactions)
+    await session.flush()
+    await _return_funds_(session, returned, now_dt)
+    await session.commit()
+
+    service._invalidate_accounts_(accounts)
+    holds_counter.inc(settled, event="settled")
+    if transactions and not outbox.relay:
+        events: list[tuple[Type[models.Transaction], int]] = [(models.Transaction, trx.id) for trx in transactions]
+        await service.publish_events(events)
+    return len(holds)
+
+
+async def expire_holds(session: AsyncSession, batch_size: int, now_dt: datetime | None = None) -> int:
+    """release up to batch_size active holds past their expiry, returns the number expired"""
+    now_dt = now_dt or datetime.now()
+    expired_ids = (
+        await session.scalars(
+            select(models.Hold.id)
+            .filter(models.Hold.status == models.HoldStatusEnum.HELD, models.Hold.expires_at <= now_dt)
+            .order_by(models.Hold.expires_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+    ).all()
+    if not expired_ids:
+        await session.rollback()
+        return 0
+
+    rows = await session.execute(
+        update(models.Hold)
+        .where(models.Hold.id.in_(expired_ids), models.Hold.status == models.HoldStatusEnum.HELD)
+        .values(status=models.HoldStatusEnum.EXPIRED, updated_at=now_dt)
+        .returning(models.Hold.account_id, models.Hold.amount, models.Hold.debit_account_num)
+        .execution_options(synchronize_session=False)
+    )
+    returned: dict[int, Decimal] = defaultdict(Decimal)
+    account_nums = set()
+    for account_id, amount, account_num in rows:
+        returned[account_id] += amount
+        account_nums.add(account_num)
+    await _return_funds_(session, returned, now_dt)
+    await session.commit()
+
+    service._invalidate_accounts_(account_nums)
+    holds_counter.inc(len(expired_ids), event="expired")
+    return len(expired_ids)
+
+
+class HoldSettler:
+    """settles the captured holds and expires the stale ones every interval seconds"""
+
+    def __init__(self, sessionmaker: async_sessionmaker[AsyncSession], batch_size: int, interval: float):
+        self._sessionmaker = sessionmaker
+        self._batch_size = batch_size
+        self._interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _drain_(self, fn: Callable[[AsyncSession, int], Awaitable[int]]) -> int:
+        """run fn one batch per transaction until there is less than a batch left"""
+        total = 0
+        while True:
+            async with self._sessionmaker() as session:
+                count = await fn(session, self._batch_size)
+            total += count
+            if count < self._batch_size:
+                return total
+
+    async def settle_once(self) -> tuple[int, int]:
+        """returns the number of holds settled and expired"""
+        settled = await self._drain_(settle_captured)
+        expired = await self._drain_(expire_holds)
+        if settled or expired:
+            logger.info(f"settled {settled} holds, expired {expired}")
+        return settled, expired
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.settle_once()
+            except Exception as e:
+                logger.exception(f"hold settlement failed: {str(e)}")
+            await asyncio.sleep(self._interval)
+
+
+settler: HoldSettler | None = None
+
+
+async def start(sessionmaker: async_sessionmaker[AsyncSession], batch_size: int, interval: float) -> None:
+    global settler
+    if config.CASA_BACKEND == "memory":
+        # the ledger owns the balances, it would overwrite the postings of settled holds
+        # and reset avail_balance to balance, dropping the reservations of active holds
+        raise RuntimeError("HOLD_SETTLEMENT is not supported by the memory backend")
+    settler = HoldSettler(sessionmaker, batch_size, interval)
+    await settler.start()
+
+
+async def stop() -> None:
+    global settler
+    if settler is not None:
+        await settler.stop()
+        settler = None
@@ -0,0 +1,792 @@
+"""
+in-memory ledger backend for simulation and load testing
+
+account balances are kept in memory and partitioned into shards, every shard is owned by a
+single asyncio task that applies the operations sent to it one at a time, so no locks are needed.
+completed transfers are appended to a journal file before the caller gets a response,
+and written to casa_transaction, casa_transfer and casa_account in large batches in the background.
+on startup the balances are recovered from the last snapshot plus the journal.
+
+the ledger owns the balances of all accounts, so only one process may run it against a database.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import zlib
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Callable, Type, TypeVar
+
+import ulid
+from sqlalchemy import func, insert, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from . import models, outbox, schemas, service
+from .cache import LRUCache
+from .service import ValidationError, _check_replay_, _find_transfer_by_ref_id_
+
+__ALL__ = ["Ledger", "engine", "get_account_details", "start", "stop", "transaction_events", "transfer"]
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CENTS = Decimal("0.01")
+
+
+@dataclass
+class LedgerAccount:
+    id: int
+    account_num: str
+    currency: str
+    balance: Decimal
+    status: models.StatusEnum
+    updated_at: datetime
+    # incremented on every posting, orders the postings of an account independent of the journal order
+    version: int = 0
+
+
+@dataclass
+class Posting:
+    id: int
+    account_id: int
+    account_num: str
+    amount: Decimal
+    running_balance: Decimal
+    memo: str
+    version: int
+
+
+class Shard:
+    """a partition of the accounts, only ever modified by its own task"""
+
+    def __init__(self):
+        self.accounts: dict[str, LedgerAccount] = {}
+        self._queue: asyncio.Queue[tuple[Callable[["Shard"], Any], asyncio.Future]] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def call(self, op: Callable[["Shard"], T]) -> T:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, future))
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            op, future = await self._queue.get()
+            try:
+                result = op(self)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    def active_account(self, account_num: str) -> LedgerAccount:
+        account = self.accounts.get(account_num)
+        if account is None or account.status != models.StatusEnum.ACTIVE:
+            raise ValidationError("Invalid debit or credit account number", reason="invalid_account")
+        return account
+
+    def post(self, account_num: str, amount: Decimal, now_dt: datetime) -> LedgerAccount:
+        """apply a posting and return a copy of the account after it"""
+        account = self.active_account(account_num)
+        if amount < 0 and account.balance + amount < 0:
+            raise ValidationError("Insufficient funds in debit account", reason="insufficient_funds")
+
+        account.balance += amount
+        account.updated_at = now_dt
+        account.version += 1
+        return LedgerAccount(**asdict(account))
+
+    def reverse(self, account_num: str, amount: Decimal, now_dt: datetime) -> None:
+        """undo a posting that was never journaled, without checking the funds of the account"""
+        account = self.accounts[account_num]
+        account.balance -= amount
+        account.updated_at = now_dt
+        account.version += 1
+
+
+class Journal:
+    """
+    append-only files of completed transfers, one json document per line.
+    the journal is split into numbered segments, so that segments whose records
+    are all persisted to the database can be deleted while new records are appended.
+    """
+
+    def __init__(self, data_dir: str, fsync: bool, recovered_seq: int = 0):
+        self._data_dir = data_dir
+        self._fsync = fsync
+        segments = self.segments(data_dir)
+        # highest seq written to each segment that is no longer written to,
+        # the segments left by an earlier run only contain records up to recovered_seq
+        self._closed_segments: dict[int, int] = {segment: recovered_seq for segment, _ in segments}
+        self._segment = segments[-1][0] + 1 if segments else 1
+        self._file = open(self._segment_path_(self._segment), "a")
+        self._last_seq = recovered_seq
+        self._rotate = False
+        self._queue: asyncio.Queue[tuple[dict[str, Any], asyncio.Future]] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    def _segment_path_(self, segment: int) -> str:
+        return os.path.join(self._data_dir, f"ledger.journal.{segment:06d}")
+
+    @staticmethod
+    def segments(data_dir: str) -> list[tuple[int, str]]:
+        segments = []
+        for name in os.listdir(data_dir):
+            if name.startswith("ledger.journal."):
+                segments.append((int(name.rsplit(".", 1)[1]), os.path.join(data_dir, name)))
+        return sorted(segments)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            await self._queue.join()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._file.close()
+
+    async def append(self, record: dict[str, Any]) -> None:
+        """returns when the record has been written to the journal file"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((record, future))
+        await future
+
+    def rotate(self) -> None:
+        """start a new segment before the next write"""
+        self._rotate = True
+
+    def remove_persisted(self, persisted_seq: int) -> None:
+        """delete the segments that only contain records up to persisted_seq"""
+        for segment, last_seq in list(self._closed_segments.items()):
+            if last_seq <= persisted_seq:
+                os.remove(self._segment_path_(segment))
+                del self._closed_segments[segment]
+
+    def _write(self, lines: str) -> None:
+        self._file.write(lines)
+        self._file.flush()
+        if self._fsync:
+            os.fsync(self._file.fileno())
+
+    def _rotate_(self) -> None:
+        self._file.close()
+        self._closed_segments[self._segment] = self._last_seq
+        self._segment += 1
+        self._file = open(self._segment_path_(self._segment), "a")
+        self._rotate = False
+
+    async def _run(self) -> None:
+        while True:
+            # every record queued while the previous write was in progress is written together
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            error = None
+            try:
+                if self._rotate:
+                    self._rotate_()
+                await asyncio.to_thread(self._write, "".join(json.dumps(r, default=str) + "\n" for r, _ in batch))
+                self._last_seq = max(self._last_seq, max(r["seq"] for r, _ in batch))
+            except Exception as e:
+                error = e
+
+            for _, future in batch:
+                if not future.done():
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+                self._queue.task_done()
+
+    @staticmethod
+    def read(data_dir: str) -> list[dict[str, Any]]:
+        records = []
+        for _, path in Journal.segments(data_dir):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # a torn write at the end of the file, the transfer was never acknowledged
+                        logger.warning(f"ignoring incomplete journal record in {path}")
+        return records
+
+
+class Ledger:
+    def __init__(
+        self,
+        sessionmaker: async_sessionmaker[AsyncSession],
+        data_dir: str,
+        shards: int = 8,
+        persist_batch_size: int = 5000,
+        persist_interval: float = 1.0,
+        snapshot_interval: float = 300.0,
+        fsync: bool = False,
+        idempotency_cache_size: int = 10000,
+    ):
+        self._sessionmaker = sessionmaker
+        self._data_dir = data_dir
+        self._shards = [Shard() for _ in range(shards)]
+        self._persist_batch_size = persist_batch_size
+        self._persist_interval = persist_interval
+        self._snapshot_interval = snapshot_interval
+        self._fsync = fsync
+        self._completed: LRUCache[str, schemas.TransferSchema] = LRUCache(idempotency_cache_size)
+
+        self._seq = 0
+        self._journaled_seq = 0
+        self._persisted_seq = 0
+        self._next_trx_pk = 1
+        # (version, balance, updated_at) of every account as of the last journaled posting.
+        # the live balances in the shards can be ahead of it while a transfer is being journaled,
+        # so snapshots and the persister use this instead
+        self._journaled: dict[int, tuple[int, Decimal, datetime]] = {}
+        self._pending: list[dict[str, Any]] = []
+        # journaled records that are not in the database yet by ref_id, they are the replays
+        # the idempotency cache may have evicted and a lookup of casa_transfer cannot find
+        self._unpersisted: dict[str, dict[str, Any]] = {}
+        # lowest seq of a record that could not be written, the checkpoint never moves past it
+        self._unwritten_seq: int | None = None
+        # transfers being applied by ref_id, so a concurrent retry waits for the first request
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._journal: Journal | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self._data_dir, "ledger.snapshot.json")
+
+    @property
+    def checkpoint_path(self) -> str:
+        return os.path.join(self._data_dir, "ledger.persisted")
+
+    def _shard_(self, account_num: str) -> Shard:
+        return self._shards[zlib.crc32(account_num.encode()) % len(self._shards)]
+
+    def _accounts_(self) -> list[LedgerAccount]:
+        return [account for shard in self._shards for account in shard.accounts.values()]
+
+    async def start(self) -> None:
+        os.makedirs(self._data_dir, exist_ok=True)
+        await self._recover()
+
+        self._journal = Journal(self._data_dir, self._fsync, self._seq)
+        self._journal.start()
+        for shard in self._shards:
+            shard.start()
+        self._tasks = [asyncio.create_task(self._persist_loop()), asyncio.create_task(self._snapshot_loop())]
+
+    async def stop(self) -> None:
+        """stop the background tasks, then persist everything that was journaled and take a snapshot"""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+        if self._journal is not None:
+            await self._journal.stop()
+        for shard in self._shards:
+            await shard.stop()
+
+        while await self.persist_once():
+            pass
+        self.snapshot()
+
+        if not self._pending and self._unwritten_seq is None:
+            for _, path in Journal.segments(self._data_dir):
+                os.remove(path)
+        self._journal = None
+
+    async def get_account_details(self, account_num: str) -> schemas.AccountSchema | None:
+        account = self._shard_(account_num).accounts.get(account_num)
+        if account is None or account.status != models.StatusEnum.ACTIVE:
+            return None
+
+        return schemas.AccountSchema(
+            account_num=account.account_num,
+            currency=account.currency,
+            balance=float(account.balance),
+            avail_balance=float(account.balance),
+            status=account.status.value,
+            updated_at=account.updated_at,
+        )
+
+    async def transfer(
+        self, transfer: schemas.TransferSchema
+    ) -> tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]]:
+        replay = self._find_replay_(transfer.ref_id)
+        if replay is None and transfer.ref_id not in self._inflight:
+            # completed before the ledger started or evicted from the cache
+            async with self._sessionmaker() as session:
+                replay = await _find_transfer_by_ref_id_(session, transfer.ref_id)
+            if replay is not None:
+                self._completed.put(transfer.ref_id, replay)
+            else:
+                # may have completed while the database was read
+                replay = self._find_replay_(transfer.ref_id)
+        if replay:
+            return _check_replay_(transfer, replay), []
+
+        inflight = self._inflight.get(transfer.ref_id)
+        if inflight is not None:
+            result, _ = await asyncio.shield(inflight)
+            return _check_replay_(transfer, result), []
+
+        if transfer.debit_account_num == transfer.credit_account_num:
+            raise ValidationError("Invalid debit or credit account number", reason="invalid_account")
+
+        # once the debit is applied the transfer must run to the end,
+        # even if the request that started it is cancelled
+        task = asyncio.ensure_future(self._transfer_(transfer))
+        self._inflight[transfer.ref_id] = task
+        task.add_done_callback(lambda _: self._inflight.pop(transfer.ref_id, None))
+        return await asyncio.shield(task)
+
+    def _find_replay_(self, ref_id: str) -> schemas.TransferSchema | None:
+        replay = self._completed.get(ref_id)
+        if replay is None and ref_id in self._unpersisted:
+            replay = self._transfer_schema_(self._unpersisted[ref_id])
+        return replay
+
+    async def _transfer_(
+        self, transfer: schemas.TransferSchema
+    ) -> tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]]:
+        now_dt = datetime.now()
+        # amounts are floats in the schemas, balances are never rounded by a round trip to the database
+        amount = Decimal(transfer.amount).quantize(CENTS)
+        debit_shard = self._shard_(transfer.debit_account_num)
+        credit_shard = self._shard_(transfer.credit_account_num)
+
+        # accounts are never removed from a shard, so once the credit account is known to be active
+        # the credit leg cannot fail and the debit leg never needs to be undone
+        await credit_shard.call(lambda shard: shard.active_account(transfer.credit_account_num))
+        debit_account = await debit_shard.call(lambda shard: shard.post(transfer.debit_account_num, -amount, now_dt))
+        credit_account = await credit_shard.call(lambda shard: shard.post(transfer.credit_account_num, amount, now_dt))
+
+        record = self._journal_record_(transfer, amount, debit_account, credit_account, now_dt)
+        assert self._journal is not None
+        try:
+            await self._journal.append(record)
+        except Exception:
+            # the transfer was not made durable, give the money back before anyone else can spend it
+            await debit_shard.call(lambda shard: shard.reverse(transfer.debit_account_num, -amount, now_dt))
+            await credit_shard.call(lambda shard: shard.reverse(transfer.credit_account_num, amount, now_dt))
+            raise
+        self._track_(record)
+
+        result = transfer.model_copy(update={"trx_id": record["trx_id"], "created_at": now_dt})
+        self._completed.put(transfer.ref_id, result)
+        return result, [(models.Transaction, posting["id"]) for posting in record["postings"]]
+
+    def _journal_record_(
+        self,
+        transfer: schemas.TransferSchema,
+        amount: Decimal,
+        debit_account: LedgerAccount,
+        credit_account: LedgerAccount,
+        now_dt: datetime,
+    ) -> dict[str, Any]:
+        self._seq += 1
+        debit_posting = Posting(
+            id=self._next_trx_pk,
+            account_id=debit_account.id,
+            account_num=debit_account.account_num,
+            amount=-amount,
+            running_balance=debit_account.balance,
+            memo=transfer.memo,
+            version=debit_account.version,
+        )
+        credit_posting = Posting(
+            id=self._next_trx_pk + 1,
+            account_id=credit_account.id,
+            account_num=credit_account.account_num,
+            amount=amount,
+            running_balance=credit_account.balance,
+            memo=f"from {transfer.debit_account_num}: {transfer.memo}",
+            version=credit_account.version,
+        )
+        self._next_trx_pk += 2
+
+        return {
+            "seq": self._seq,
+            "trx_id": str(ulid.new()),
+            "ref_id": transfer.ref_id,
+            "trx_date": transfer.trx_date,
+            "currency": transfer.currency,
+            "amount": str(amount),
+            "memo": transfer.memo,
+            "debit_account_num": transfer.debit_account_num,
+            "credit_account_num": transfer.credit_account_num,
+            "created_at": now_dt.isoformat(),
+            "postings": [asdict(debit_posting), asdict(credit_posting)],
+        }
+
+    def _apply_journaled_(self, record: dict[str, Any]) -> None:
+        created_at = datetime.fromisoformat(record["created_at"])
+        for posting in record["postings"]:
+            # running balances are absolute, so a posting applied twice or out of order is harmless
+            version, _, _ = self._journaled.get(posting["account_id"], (0, None, None))
+            if posting["version"] > version:
+                self._journaled[posting["account_id"]] = (
+                    posting["version"],
+                    Decimal(posting["running_balance"]),
+                    created_at,
+                )
+        self._journaled_seq = max(self._journaled_seq, record["seq"])
+
+    def _track_(self, record: dict[str, Any]) -> None:
+        """record a journaled transfer and queue it for the persister"""
+        self._apply_journaled_(record)
+        self._pending.append(record)
+        self._unpersisted[record["ref_id"]] = record
+
+    async def _recover(self) -> None:
+        """load the balances from the snapshot, or the database if there is none, then replay the journal"""
+        snapshot: dict[str, Any] = {"seq": 0, "persisted_seq": 0, "next_trx_pk": 0, "accounts": None}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r") as f:
+                snapshot = json.load(f)
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r") as f:
+                snapshot["persisted_seq"] = max(snapshot["persisted_seq"], int(f.read().strip() or 0))
+
+        async with self._sessionmaker() as session:
+            if snapshot["accounts"] is None:
+                result = await session.stream(select(models.Account).execution_options(yield_per=10000))
+                async for account in result.scalars():
+                    self._add_account_(
+                        LedgerAccount(
+                            id=account.id,
+                            account_num=account.account_num,
+                            currency=account.currency,
+                            balance=account.balance,
+                            status=account.status,
+                            updated_at=account.updated_at,
+                        )
+                    )
+            else:
+                for item in snapshot["accounts"]:
+                    self._add_account_(
+                        LedgerAccount(
+                            id=item["id"],
+                            account_num=item["account_num"],
+                            currency=item["currency"],
+                            balance=Decimal(item["balance"]),
+                            status=models.StatusEnum(item["status"]),
+                            updated_at=datetime.fromisoformat(item["updated_at"]),
+                            version=item["version"],
+                        )
+                    )
+
+            max_trx_pk = await session.scalar(select(func.max(models.Transaction.id))) or 0
+            self._seq = self._journaled_seq = snapshot["seq"]
+            self._persisted_seq = snapshot["persisted_seq"]
+            self._next_trx_pk = max(snapshot["next_trx_pk"], max_trx_pk + 1)
+
+            for account in self._accounts_():
+                self._journaled[account.id] = (account.version, account.balance, account.updated_at)
+
+            records = Journal.read(self._data_dir)
+            for record in records:
+                self._replay_(record)
+            self._seq = self._journaled_seq
+
+            await self._requeue_unpersisted_(session, [r for r in records if r["seq"] > self._persisted_seq])
+
+        logger.info(f"ledger recovered at seq {self._seq}, {len(records)} journal records replayed")
+
+    def _add_account_(self, account: LedgerAccount) -> None:
+        # closed accounts can share the account_num of an active one, the active account wins
+        shard = self._shard_(account.account_num)
+        existing = shard.accounts.get(account.account_num)
+        if existing is None or account.status == models.StatusEnum.ACTIVE:
+            shard.accounts[account.account_num] = account
+
+    def _replay_(self, record: dict[str, Any]) -> None:
+        self._apply_journaled_(record)
+        for posting in record["postings"]:
+            account = self._shard_(posting["account_num"]).accounts[posting["account_num"]]
+            version, balance, updated_at = self._journaled[account.id]
+            account.version, account.balance, account.updated_at = version, balance, updated_at
+            self._next_trx_pk = max(self._next_trx_pk, posting["id"] + 1)
+
+        self._completed.put(record["ref_id"], self._transfer_schema_(record))
+
+    @staticmethod
+    def _transfer_schema_(record: dict[str, Any]) -> schemas.TransferSchema:
+        return schemas.TransferSchema(
+            trx_id=record["trx_id"],
+            ref_id=record["ref_id"],
+            trx_date=record["trx_date"],
+            debit_account_num=record["debit_account_num"],
+            credit_account_num=record["credit_account_num"],
+            currency=record["currency"],
+            amount=float(record["amount"]),
+            memo=record["memo"],
+            created_at=datetime.fromisoformat(record["created_at"]),
+        )
+
+    async def _requeue_unpersisted_(self, session: AsyncSession, records: list[dict[str, Any]]) -> None:
+        # records written to the database just before a crash may not be in the checkpoint yet
+        persisted = set()
+        for i in range(0, len(records), 1000):
+            trx_ids = [r["trx_id"] for r in records[i : i + 1000]]
+            stmt = select(models.Transfer.trx_id).filter(models.Transfer.trx_id.in_(trx_ids))
+            persisted.update((await session.scalars(stmt)).all())
+
+        for record in records:
+            if record["trx_id"] not in persisted:
+                self._pending.append(record)
+                self._unpersisted[record["ref_id"]] = record
+
+    async def persist_once(self) -> int:
+        """write up to persist_batch_size journaled transfers to the database, returns the number processed"""
+        batch = self._pending[: self._persist_batch_size]
+        if not batch:
+            return 0
+
+        async with self._sessionmaker() as session:
+            try:
+                await self._write_(session, batch)
+                await session.commit()
+                unwritten = []
+            except IntegrityError as e:
+                # should not happen unless the database was modified behind the ledger's back,
+                # the records are written one at a time so only the offending ones are left out
+                await session.rollback()
+                logger.warning(f"ledger could not persist a batch of {len(batch)} transfers, retrying one by one: {e}")
+                unwritten = await self._write_one_by_one_(batch)
+
+        del self._pending[: len(batch)]
+        unwritten_seqs = {record["seq"] for record in unwritten}
+        for record in batch:
+            if record["seq"] not in unwritten_seqs:
+                self._unpersisted.pop(record["ref_id"], None)
+        if unwritten:
+            lowest = min(record["seq"] for record in unwritten)
+            self._unwritten_seq = lowest if self._unwritten_seq is None else min(self._unwritten_seq, lowest)
+
+        # the journal keeps every record from the first one that could not be written,
+        # they are retried on the next start
+        persisted_seq = batch[-1]["seq"]
+        if self._unwritten_seq is not None:
+            persisted_seq = min(persisted_seq, self._unwritten_seq - 1)
+        self._persisted_seq = max(self._persisted_seq, persisted_seq)
+        with open(self.checkpoint_path, "w") as f:
+            f.write(str(self._persisted_seq))
+        if self._journal is not None:
+            self._journal.remove_persisted(self._persisted_seq)
+
+        return len(batch)
+
+    async def _write_one_by_one_(self, records: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """write each record in its own transaction, returns the records that could not be written"""
+        unwritten = []
+        for record in records:
+            async with self._sessionmaker() as session:
+                try:
+                    await self._write_(session, [record])
+                    await session.commit()
+                except IntegrityError as e:
+                    await session.rollback()
+                    logger.error(
+                        f"ledger could not persist transfer {record['trx_id']} with ref_id {record['ref_id']}, "
+                        f"it is kept in the journal: {e}"
+                    )
+                    unwritten.append(record)
+        return unwritten
+
+    async def _write_(self, session: AsyncSession, records: list[dict[str, Any]]) -> None:
+        transactions = []
+        transfers = []
+        account_ids = set()
+        for record in records:
+            created_at = datetime.fromisoformat(record["created_at"])
+            transfers.append(
+                {
+                    "trx_id": record["trx_id"],
+                    "ref_id": record["ref_id"],
+                    "trx_date": record["trx_date"],
+                    "currency": record["currency"],
+                    "amount": Decimal(record["amount"]),
+                    "memo": record["memo"],
+                    "debit_account_num": record["debit_account_num"],
+                    "credit_account_num": record["credit_account_num"],
+                    "created_at": created_at,
+                }
+            )
+            for posting in record["postings"]:
+                account_ids.add(posting["account_id"])
+                transactions.append(self._transaction_row_(record, posting, created_at))
+
+        # the latest journaled balance, which can be newer than the postings in this batch
+        accounts = []
+        for account_id in account_ids:
+            _, balance, updated_at = self._journaled[account_id]
+            accounts.append({"id": account_id, "balance": balance, "avail_balance": balance, "updated_at": updated_at})
+
+        await session.execute(insert(models.Transfer), transfers)
+        await session.execute(insert(models.Transaction), transactions)
+        await session.execute(update(models.Account), accounts)
+        await self._advance_sequence_(session, max(t["id"] for t in transactions))
+
+    @staticmethod
+    def _transaction_row_(record: dict[str, Any], posting: dict[str, Any], created_at: datetime) -> dict[str, Any]:
+        return {
+            "id": posting["id"],
+            "ref_id": record["ref_id"],
+            "trx_id": record["trx_id"],
+            "trx_date": record["trx_date"],
+            "currency": record["currency"],
+            "amount": Decimal(posting["amount"]),
+            "running_balance": Decimal(posting["running_balance"]),
+            "memo": posting["memo"],
+            "account_id": posting["account_id"],
+            "created_at": created_at,
+        }
+
+    def transaction_events(self, trx_pks: set[int]) -> list[dict[str, Any]]:
+        """events of the postings with ids in trx_pks that are not persisted yet, as the outbox relay publishes them"""
+        events = []
+        # the postings of a transfer that just completed are at the end of the queue
+        for record in reversed(self._pending):
+            created_at = datetime.fromisoformat(record["created_at"])
+            for posting in record["postings"]:
+                if posting["id"] in trx_pks:
+                    trx = models.Transaction(**self._transaction_row_(record, posting, created_at))
+                    events.append(outbox.transaction_event(trx, posting["account_num"]))
+            if len(events) == len(trx_pks):
+                break
+        return sorted(events, key=lambda event: event["id"])
+
+    async def _advance_sequence_(self, session: AsyncSession, max_trx_pk: int) -> None:
+        # transaction ids are assigned by the ledger, keep the postgresql sequence ahead of them
+        # so that the database backend can be used again after the ledger is stopped
+        if session.bind.dialect.name == "postgresql":
+            await session.execute(
+                text("SELECT setval(pg_get_serial_sequence('casa_transaction', 'id'), :max_id)"),
+                {"max_id": max_trx_pk},
+            )
+
+    def snapshot(self) -> None:
+        """write the journaled balances of all accounts to the snapshot file"""
+        snapshot = {
+            "seq": self._journaled_seq,
+            "persisted_seq": self._persisted_seq,
+            "next_trx_pk": self._next_trx_pk,
+            "accounts": [
+                {
+                    "id": account.id,
+                    "account_num": account.account_num,
+                    "currency": account.currency,
+                    "balance": str(balance),
+                    "status": account.status.value,
+                    "updated_at": updated_at.isoformat(),
+                    "version": version,
+                }
+                for account in self._accounts_()
+                for version, balance, updated_at in [self._journaled[account.id]]
+            ],
+        }
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+        # the records up to the snapshot are only needed until they are persisted
+        if self._journal is not None:
+            self._journal.rotate()
+
+        logger.info(f"ledger snapshot written at seq {self._journaled_seq}")
+
+    async def _persist_loop(self) -> None:
+        while True:
+            try:
+                count = await self.persist_once()
+            except Exception as e:
+                logger.exception(f"ledger persist failed: {str(e)}")
+                count = 0
+
+            if count < self._persist_batch_size:
+                await asyncio.sleep(self._persist_interval)
+
+    async def _snapshot_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._snapshot_interval)
+            try:
+                self.snapshot()
+            except Exception as e:
+                logger.exception(f"ledger snapshot failed: {str(e)}")
+
+
+engine: Ledger | None = None
+
+
+async def start(sessionmaker: async_sessionmaker[AsyncSession], data_dir: str, **kwargs: Any) -> Ledger:
+    global engine
+    engine = Ledger(sessionmaker, data_dir, **kwargs)
+    await engine.start()
+    return engine
+
+
+async def stop() -> None:
+    global engine
+    if engine is not None:
+        await engine.stop()
+        engine = None
+
+
+# same contract as the functions in service, the session is not used
+async def get_account_details(session: AsyncSession, account_num: str) -> schemas.AccountSchema | None:
+    assert engine is not None
+    return await engine.get_account_details(account_num)
+
+
+async def transfer(
+    session: AsyncSession, transfer: schemas.TransferSchema
+) -> tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]]:
+    assert engine is not None
+    return await engine.transfer(transfer)
+
+
+async def transaction_events(
+    session: AsyncSession, events: list[tuple[Type[models.Transaction], int]]
+) -> list[dict[str, Any]]:
+    assert engine is not None
+    trx_pks = {e[1] for e in events}
+    pending = engine.transaction_events(trx_pks)
+    # postings persisted in the meantime are read from the database
+    persisted = {event["id"] for event in pending}
+    if len(persisted) == len(trx_pks):
+        return pending
+    loaded = await service.transaction_events(session, [e for e in events if e[1] not in persisted])
+    return sorted(pending + loaded, key=lambda event: event["id"])
@@ -12,6 +12,7 @@ from sqlalchemy import (
     Index,
     Integer,
     String,
+    text,
 )
 from sqlalchemy.orm import (
     DeclarativeBase,
@@ -51,6 +52,8 @@ class Account(Base):
 
 
 class Transaction(Base):
+    # on postgresql the table is partitioned by month of trx_date and its primary key
+    # is (id, trx_date), see casa/partitions.py. id is still unique, as it comes from a sequence
     __tablename__ = "casa_transaction"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
@@ -67,7 +70,17 @@ class Transaction(Base):
     account_id: Mapped[int] = mapped_column(Integer, ForeignKey("casa_account.id"))
     account: Mapped[Account] = relationship("Account", back_populates="transactions")
 
-    __table_args__ = (Index("account_date_idx", "account_id", "trx_date"),)
+    __table_args__ = (
+        # id is included so that keyset pagination on (trx_date, id) is served by the index
+        Index("account_date_idx", "account_id", "trx_date", "id"),
+        # only unpublished rows are indexed, so the outbox relay can find them cheaply
+        Index(
+            "transaction_unpublished_idx",
+            "id",
+            postgresql_where=text("NOT is_published"),
+            sqlite_where=text("NOT is_published"),
+        ),
+    )
 
 
 class Transfer(Base):
@@ -83,3 +96,56 @@ class Transfer(Base):
     debit_account_num: Mapped[str] = mapped_column(String(32))
     credit_account_num: Mapped[str] = mapped_column(String(32))
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+    __table_args__ = (Index("transfer_ref_id_idx", "ref_id", unique=True),)
+
+
+class DailyBalance(Base):
+    """balance of every account at the end of a day, written by the end of day job in eod.py"""
+
+    __tablename__ = "casa_daily_balance"
+
+    account_id: Mapped[int] = mapped_column(Integer, ForeignKey("casa_account.id"), primary_key=True)
+    balance_date: Mapped[str] = mapped_column(String(10), primary_key=True)
+    balance: Mapped[Decimal] = mapped_column(DECIMAL(14, 2))
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+
+class HoldStatusEnum(enum.Enum):
+    HELD = "HELD"
+    CAPTURED = "CAPTURED"
+    SETTLED = "SETTLED"
+    RELEASED = "RELEASED"
+    EXPIRED = "EXPIRED"
+
+
+class Hold(Base):
+    """
+    funds reserved on the debit account by taking them off its avail_balance only.
+    a captured hold is posted to balance and casa_transaction as a transfer by the settlement
+    worker in casa/holds.py, a released or expired one gives the funds back to avail_balance.
+    """
+
+    __tablename__ = "casa_hold"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    hold_id: Mapped[str] = mapped_column(String(32), unique=True)
+    ref_id: Mapped[str] = mapped_column(String(32))
+    account_id: Mapped[int] = mapped_column(Integer, ForeignKey("casa_account.id"))
+    debit_account_num: Mapped[str] = mapped_column(String(32))
+    credit_account_num: Mapped[str] = mapped_column(String(32))
+    currency: Mapped[str] = mapped_column(String(3))
+    amount: Mapped[Decimal] = mapped_column(DECIMAL(14, 2))
+    captured_amount: Mapped[Decimal | None] = mapped_column(DECIMAL(14, 2), nullable=True)
+    memo: Mapped[str] = mapped_column(String(100))
+    status: Mapped[HoldStatusEnum] = mapped_column(Enum(HoldStatusEnum), default=HoldStatusEnum.HELD)
+    expires_at: Mapped[datetime] = mapped_column(DateTime)
+    trx_id: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        Index("hold_ref_id_idx", "ref_id", unique=True),
+        # the settlement worker and the expiry sweeper look for holds by status
+        Index("hold_status_idx", "status", "expires_at"),
+    )
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from . import models
+from .events import EventSink
+
+__ALL__ = ["OutboxRelay", "relay", "start", "stop"]
+
+logger = logging.getLogger(__name__)
+
+
+def transaction_event(trx: models.Transaction, account_num: str) -> dict[str, Any]:
+    return {
+        "type": "casa.transaction",
+        "id": trx.id,
+        "trx_id": trx.trx_id,
+        "ref_id": trx.ref_id,
+        "trx_date": trx.trx_date,
+        "account_num": account_num,
+        "currency": trx.currency,
+        "amount": str(trx.amount),
+        "running_balance": str(trx.running_balance),
+        "memo": trx.memo,
+        "created_at": trx.created_at.isoformat(),
+    }
+
+
+class OutboxRelay:
+    """
+    publishes casa_transaction rows that are not yet published to a sink,
+    then marks them as published. rows are read in batches ordered by id,
+    and are marked only after the sink accepted them, so a crash can cause
+    an event to be published again but never to be lost. the rows of a batch
+    stay locked until they are marked, so concurrent relays publish different rows.
+    """
+
+    def __init__(
+        self,
+        sessionmaker: async_sessionmaker[AsyncSession],
+        sink: EventSink,
+        batch_size: int = 500,
+        poll_interval: float = 1.0,
+    ):
+        self._sessionmaker = sessionmaker
+        self._sink = sink
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._last_id = 0
+        self._task: asyncio.Task | None = None
+
+        self.published = 0
+        self.batches = 0
+        self.lag_seconds = 0.0
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._sink.close()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "published": self.published,
+            "batches": self.batches,
+            "lag_seconds": self.lag_seconds,
+        }
+
+    async def relay_once(self) -> int:
+        """publish one batch, returns the number of events published"""
+        async with self._sessionmaker() as session:
+            stmt = (
+                select(models.Transaction, models.Account.account_num)
+                .join(models.Transaction.account)
+                .filter(
+                    ~models.Transaction.is_published,
+                    models.Transaction.id > self._last_id,
+                )
+                .order_by(models.Transaction.id)
+                .limit(self._batch_size)
+                # every uvicorn worker runs a relay, rows locked by another one are left to it.
+                # only the transaction rows are locked, transfers update the account rows
+                .with_for_update(skip_locked=True, of=models.Transaction)
+            )
+            rows = (await session.execute(stmt)).all()
+            if not rows:
+                self._last_id = 0
+                self.lag_seconds = 0.0
+                return 0
+
+            await self._sink.publish([transaction_event(trx, account_num) for trx, account_num in rows])
+
+            ids = [trx.id for trx, _ in rows]
+            await session.execute(
+                update(models.Transaction)
+                .where(models.Transaction.id.in_(ids))
+                .values(is_published=True)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+
+        # when caught up, start from the beginning on the next poll to pick up
+        # rows with lower ids that were committed after they were read
+        self._last_id = ids[-1] if len(rows) == self._batch_size else 0
+
+        self.published += len(rows)
+        self.batches += 1
+        self.lag_seconds = (datetime.now() - rows[0][0].created_at).total_seconds()
+
+        return len(rows)
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            try:
+                count = await self.relay_once()
+            except Exception as e:
+                logger.exception(f"outbox relay failed: {str(e)}")
+                count = 0
+
+            if count:
+                elapsed = time.perf_counter() - start
+                logger.info(f"published {count} events in {elapsed:.3f}s, lag {self.lag_seconds:.3f}s")
+
+            if count < self._batch_size:
+                await asyncio.sleep(self._poll_interval)
+
+
+relay: OutboxRelay | None = None
+
+
+async def start(
+    sessionmaker: async_sessionmaker[AsyncSession],
+    sink: EventSink,
+    batch_size: int,
+    poll_interval: float,
+) -> OutboxRelay:
+    global relay
+    relay = OutboxRelay(sessionmaker, sink, batch_size, poll_interval)
+    await relay.start()
+    return relay
+
+
+async def stop() -> None:
+    global relay
+    if relay is not None:
+        await relay.stop()
+        relay = None
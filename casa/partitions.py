@@ -0,0 +1,250 @@
+"""
+monthly range partitions of casa_transaction on postgresql
+
+casa_transaction is partitioned by trx_date, one partition per month named casa_transaction_pYYYYMM,
+plus a default partition for dates outside of them. upcoming partitions are created ahead of time
+by a background task, expired ones are detached, archived to gzipped csv files and dropped by
+the retention job in retention.py. nothing here has any effect on other databases.
+"""
+
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import date
+from typing import Any
+
+from sqlalchemy import Connection, Engine, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+__ALL__ = ["PartitionMaintainer", "archive_partitions", "archive_transfers", "create_partitions", "start", "stop"]
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLE = "casa_transaction"
+DEFAULT_PARTITION = f"{PARTITIONED_TABLE}_default"
+_PARTITION_NAME_RE_ = re.compile(rf"^{PARTITIONED_TABLE}_p(\d{{4}})(\d{{2}})$")
+
+
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def add_months(d: date, months: int) -> date:
+    """first day of the month that is months after the month of d"""
+    index = d.year * 12 + d.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITIONED_TABLE}_p{month:%Y%m}"
+
+
+def partition_month(name: str) -> date | None:
+    match = _PARTITION_NAME_RE_.match(name)
+    return date(int(match[1]), int(match[2]), 1) if match else None
+
+
+def create_partition_sql(month: date) -> str:
+    # trx_date is a YYYY-MM-DD string, which sorts the same way as the date it represents
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {PARTITIONED_TABLE} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def list_partitions(conn: Connection) -> dict[str, date]:
+    """monthly partitions attached to casa_transaction, by name"""
+    rows = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table"
+        ),
+        {"table": PARTITIONED_TABLE},
+    )
+    return {name: month for (name,) in rows if (month := partition_month(name))}
+
+
+def list_detached(conn: Connection) -> dict[str, date]:
+    """monthly partition tables that were detached but not archived yet, e.g. by an interrupted retention run"""
+    rows = conn.execute(
+        text("SELECT tablename FROM pg_tables WHERE tablename LIKE :prefix"), {"prefix": f"{PARTITIONED_TABLE}_p%"}
+    )
+    attached = list_partitions(conn)
+    return {name: month for (name,) in rows if (month := partition_month(name)) and name not in attached}
+
+
+def create_partitions(conn: Connection, start: date, months: int) -> list[str]:
+    """create the partitions of the months months starting with the month of start, returns the new ones"""
+    if conn.dialect.name != "postgresql":
+        return []
+
+    existing = list_partitions(conn)
+    created = []
+    for i in range(months):
+        month = add_months(month_start(start), i)
+        if partition_name(month) in existing:
+            continue
+        try:
+            with conn.begin_nested():
+                conn.execute(text(create_partition_sql(month)))
+            created.append(partition_name(month))
+        except DBAPIError as e:
+            # fails when the default partition already has rows of that month,
+            # they have to be moved out of it before the partition can be created
+            logger.warning(f"cannot create partition {partition_name(month)}: {str(e.orig)}")
+    return created
+
+
+def _write_copy_(cursor: Any, copy_sql: str, path: str) -> int:
+    """
+    write the output of COPY ... TO STDOUT with a psycopg cursor to a gzipped file,
+    which is only put in place once complete. returns the number of bytes of csv written
+    """
+    written = 0
+    tmp_path = f"{path}.tmp"
+    with cursor.copy(copy_sql) as copy, gzip.open(tmp_path, "wb") as f:
+        for data in copy:
+            f.write(data)
+            written += len(data)
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return written
+
+
+def retention_cutoff(keep_months: int, today: date | None = None) -> date:
+    """first day of the oldest month kept, keep_months months up to and including the current one are kept"""
+    return add_months(month_start(today or date.today()), -keep_months + 1)
+
+
+def archive_partitions(
+    engine: Engine,
+    keep_months: int,
+    archive_dir: str,
+    today: date | None = None,
+    dry_run: bool = False,
+) -> list[dict[str, Any]]:
+    """
+    detach the partitions of casa_transaction that end before retention_cutoff,
+    write each of them to archive_dir/<partition>.csv.gz and drop it.
+    a partition is detached before it is copied, so no row can be added to it after it is archived,
+    and only dropped once its archive file is complete.
+    """
+    cutoff = retention_cutoff(keep_months, today)
+    os.makedirs(archive_dir, exist_ok=True)
+
+    with engine.connect() as conn:
+        attached = list_partitions(conn)
+        detached = list_detached(conn)
+    expired = sorted(
+        (name for name, month in {**attached, **detached}.items() if add_months(month, 1) <= cutoff),
+        key=lambda name: partition_month(name) or date.min,
+    )
+
+    results = []
+    for name in expired:
+        if dry_run:
+            results.append({"partition": name, "path": None, "bytes": 0})
+            continue
+
+        if name in attached:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {name}"))
+
+        path = os.path.join(archive_dir, f"{name}.csv.gz")
+        with engine.begin() as conn:
+            with conn.connection.dbapi_connection.cursor() as cursor:  # type: ignore
+                written = _write_copy_(cursor, f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", path)
+            conn.execute(text(f"DROP TABLE {name}"))
+
+        logger.info(f"archived partition {name} to {path}")
+        results.append({"partition": name, "path": path, "bytes": written})
+    return results
+
+
+def archive_transfers(engine: Engine, cutoff: date, archive_dir: str, dry_run: bool = False) -> dict[str, Any]:
+    """
+    casa_transfer is not partitioned, because its unique index on ref_id is what makes transfers
+    idempotent, and a unique index of a partitioned table has to include the partition key.
+    its rows before cutoff are archived to one file and deleted in the same snapshot instead.
+    note that a ref_id can be used again once its transfer has been archived.
+    """
+    where = f"trx_date < '{cutoff.isoformat()}'"
+    if dry_run:
+        with engine.connect() as conn:
+            count = conn.execute(text(f"SELECT count(*) FROM casa_transfer WHERE {where}")).scalar()
+        return {"table": "casa_transfer", "path": None, "rows": count}
+
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"casa_transfer_before_{cutoff:%Y%m%d}.csv.gz")
+    with engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn:
+        with conn.begin():
+            copy_sql = f"COPY (SELECT * FROM casa_transfer WHERE {where}) TO STDOUT WITH (FORMAT csv, HEADER)"
+            with conn.connection.dbapi_connection.cursor() as cursor:  # type: ignore
+                written = _write_copy_(cursor, copy_sql, path)
+            # same snapshot as the copy, rows committed in the meantime are neither archived nor deleted
+            count = conn.execute(text(f"DELETE FROM casa_transfer WHERE {where}")).rowcount
+
+    logger.info(f"archived {count} transfers before {cutoff} to {path}")
+    return {"table": "casa_transfer", "path": path, "rows": count, "bytes": written}
+
+
+class PartitionMaintainer:
+    """keeps the partitions of the current month and the next months_ahead months created"""
+
+    def __init__(self, sessionmaker: async_sessionmaker[AsyncSession], months_ahead: int, interval: float):
+        self._sessionmaker = sessionmaker
+        self._months_ahead = months_ahead
+        self._interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def maintain_once(self) -> list[str]:
+        async with self._sessionmaker() as session:
+            created = await session.run_sync(
+                lambda sync_session: create_partitions(sync_session.connection(), date.today(), self._months_ahead + 1)
+            )
+            await session.commit()
+        if created:
+            logger.info(f"created partitions {', '.join(created)}")
+        return created
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.maintain_once()
+            except Exception as e:
+                logger.exception(f"partition maintenance failed: {str(e)}")
+            await asyncio.sleep(self._interval)
+
+
+maintainer: PartitionMaintainer | None = None
+
+
+async def start(sessionmaker: async_sessionmaker[AsyncSession], months_ahead: int, interval: float) -> None:
+    global maintainer
+    maintainer = PartitionMaintainer(sessionmaker, months_ahead, interval)
+    await maintainer.start()
+
+
+async def stop() -> None:
+    global maintainer
+    if maintainer is not None:
+        await maintainer.stop()
+        maintainer = None
@@ -0,0 +1,187 @@
+"""
+process wide pipeline for the events of committed transfers
+
+requests put their events in a bounded queue, a single publisher task sends them to the sink
+in batches of up to batch_size events, or whatever arrived within flush_ms of the first one.
+with a loader, requests only queue references to the rows they wrote, such as (Transaction, id),
+and the publisher turns each batch into events with a single load in its own session.
+when the sink falls behind the queue fills up and requests wait for room, for up to put_timeout
+seconds, after which their events are dropped and counted. a failed batch is retried until the
+sink accepts it, the queue is flushed on shutdown. for events that must not be lost use the outbox relay.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+import metrics
+
+from .events import EventSink
+
+__ALL__ = ["EventPublisher", "publisher", "start", "stop"]
+
+logger = logging.getLogger(__name__)
+
+# builds the events of a batch of queued items
+EventLoader = Callable[[AsyncSession, list[Any]], Awaitable[list[dict[str, Any]]]]
+
+published_counter = metrics.counter("casa_events_published_total", "events accepted by the sink")
+dropped_counter = metrics.counter("casa_events_dropped_total", "events dropped because the queue stayed full")
+lag_seconds = metrics.histogram("casa_event_publish_lag_seconds", "time from queueing an event to its publication")
+
+
+class EventPublisher:
+    def __init__(
+        self,
+        sink: EventSink,
+        queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_ms: float = 50.0,
+        put_timeout: float = 1.0,
+        sessionmaker: async_sessionmaker[AsyncSession] | None = None,
+        load: EventLoader | None = None,
+    ):
+        self._sink = sink
+        self._sessionmaker = sessionmaker
+        self._load = load
+        self._batch_size = batch_size
+        self._window = flush_ms / 1000.0
+        self._put_timeout = put_timeout
+        # (time queued, event or the item it is loaded from)
+        self._queue: asyncio.Queue[tuple[float, Any]] = asyncio.Queue(maxsize=queue_size)
+        self._task: asyncio.Task | None = None
+        # seconds the oldest event of the last batch waited, 0 when the queue is empty
+        self.lag = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """publish the queued events, for up to timeout seconds, then close the sink"""
+        if self._task is None:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"stopped with {self._queue.qsize()} events not published")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self._sink.close()
+
+    async def publish(self, events: list[Any]) -> int:
+        """queue events, waiting for room when the queue is full, returns the number dropped"""
+        now = time.monotonic()
+        for i, event in enumerate(events):
+            try:
+                self._queue.put_nowait((now, event))
+            except asyncio.QueueFull:
+                try:
+                    await asyncio.wait_for(self._queue.put((now, event)), self._put_timeout)
+                except asyncio.TimeoutError:
+                    dropped = len(events) - i
+                    dropped_counter.inc(dropped)
+                    logger.warning(f"event queue full, dropped {dropped} events")
+                    return dropped
+        return 0
+
+    async def _next_batch(self) -> list[tuple[float, Any]]:
+        batch = [await self._queue.get()]
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._window
+        while len(batch) < self._batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _events_(self, batch: list[tuple[float, Any]]) -> list[dict[str, Any]]:
+        items = [item for _, item in batch]
+        if self._load is None or self._sessionmaker is None:
+            return items
+        async with self._sessionmaker() as session:
+            return await self._load(session, items)
+
+    async def _send(self, batch: list[tuple[float, Any]]) -> None:
+        """load and publish a batch, retrying with a growing delay until the sink accepts it"""
+        delay = 0.05
+        while True:
+            try:
+                await self._sink.publish(await self._events_(batch))
+                break
+            except Exception as e:
+                logger.warning(f"publishing {len(batch)} events failed, retrying in {delay:.2f}s: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+
+        now = time.monotonic()
+        for queued_at, _ in batch:
+            lag_seconds.observe(now - queued_at)
+        self.lag = now - batch[0][0] if self._queue.qsize() else 0.0
+        published_counter.inc(len(batch))
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._send(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+publisher: EventPublisher | None = None
+
+metrics.callback(
+    "casa_event_queue_depth", "events waiting to be published", lambda: publisher.depth if publisher else 0
+)
+metrics.callback(
+    "casa_event_publish_lag_current_seconds",
+    "time the oldest event of the last batch waited, 0 once the queue is empty",
+    lambda: publisher.lag if publisher else 0,
+)
+
+
+async def start(
+    sink: EventSink,
+    queue_size: int,
+    batch_size: int,
+    flush_ms: float,
+    put_timeout: float,
+    sessionmaker: async_sessionmaker[AsyncSession] | None = None,
+    load: EventLoader | None = None,
+) -> EventPublisher:
+    global publisher
+    publisher = EventPublisher(sink, queue_size, batch_size, flush_ms, put_timeout, sessionmaker, load)
+    await publisher.start()
+    return publisher
+
+
+async def stop(timeout: float = 10.0) -> None:
+    global publisher
+    if publisher is not None:
+        await publisher.stop(timeout)
+        publisher = None
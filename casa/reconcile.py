@@ -0,0 +1,256 @@
+"""
+reconciliation of the ledger
+
+two checks are run, each split into independent units of work:
+    balance:   the balance of every account equals the sum of its postings, per range of account ids
+    transfers: every transfer has exactly 2 postings with its trx_id, a debit and a credit of its amount,
+               and every posting belongs to a transfer, per trx_date
+every unit is a single aggregate query, so it reads one consistent snapshot of the rows it covers
+and the database does the work. units are run concurrently by a pool of workers, each on its own
+connection. discrepancies are streamed to the report as one json object per line, and every completed
+unit is appended to the checkpoint file after its discrepancies are written, so an interrupted run can
+be resumed. a unit interrupted after writing its discrepancies is run again and reports them twice.
+
+postings dropped by the retention job are not counted, so the balance check only holds on databases
+that keep all the postings of the accounts checked. opening deposits, loaded by seed.py, are postings
+without a transfer, they are marked by a trx_id starting with OPENING_TRX_PREFIX and only counted by
+the balance check.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import date, timedelta
+from typing import IO, Any, Iterator
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from . import models
+
+__ALL__ = ["Checkpoint", "OPENING_TRX_PREFIX", "reconcile"]
+
+logger = logging.getLogger(__name__)
+
+# trx_id prefix of postings that have no transfer, a ulid never starts with O
+OPENING_TRX_PREFIX = "O"
+
+
+class Checkpoint:
+    """keys of the completed units, appended to a file one per line"""
+
+    def __init__(self, path: str | None, resume: bool = False):
+        self.done: set[str] = set()
+        self._file: IO[str] | None = None
+        if path is None:
+            return
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                self.done = {line.strip() for line in f if line.strip()}
+        self._file = open(path, "a" if resume else "w")
+
+    def mark(self, key: str) -> None:
+        self.done.add(key)
+        if self._file is not None:
+            self._file.write(key + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+async def _balance_discrepancies_(session: AsyncSession, lo: int, hi: int) -> list[dict[str, Any]]:
+    postings = (
+        select(
+            models.Transaction.account_id,
+            func.sum(models.Transaction.amount).label("total"),
+            func.count().label("postings"),
+        )
+        .filter(models.Transaction.account_id >= lo, models.Transaction.account_id < hi)
+        .group_by(models.Transaction.account_id)
+        .subquery()
+    )
+    total = func.coalesce(postings.c.total, 0)
+    stmt = (
+        select(
+            models.Account.id,
+            models.Account.account_num,
+            models.Account.balance,
+            total.label("total"),
+            func.coalesce(postings.c.postings, 0).label("postings"),
+        )
+        .outerjoin(postings, postings.c.account_id == models.Account.id)
+        .filter(models.Account.id >= lo, models.Account.id < hi, models.Account.balance != total)
+        .order_by(models.Account.id)
+    )
+    return [
+        {
+            "check": "balance",
+            "reason": "balance_mismatch",
+            "account_id": row.id,
+            "account_num": row.account_num,
+            "balance": str(row.balance),
+            "postings_total": str(row.total),
+            "postings": row.postings,
+        }
+        for row in await session.execute(stmt)
+    ]
+
+
+def _transfer_reason_(row: Any) -> str:
+    if row.postings is None:
+        return "missing_postings"
+    if row.amount is None:
+        return "orphan_postings"
+    if row.postings != 2:
+        return "posting_count"
+    if row.net != 0:
+        return "postings_unbalanced"
+    return "posting_amount"
+
+
+async def _transfer_discrepancies_(session: AsyncSession, trx_date: str) -> list[dict[str, Any]]:
+    # postings carry the trx_date of their transfer, so both sides of a day are aggregated
+    # on their own and compared with a single join, which reads one partition of casa_transaction
+    transfers = (
+        select(models.Transfer.trx_id, models.Transfer.amount).filter(models.Transfer.trx_date == trx_date).subquery()
+    )
+    postings = (
+        select(
+            models.Transaction.trx_id,
+            func.count().label("postings"),
+            func.sum(models.Transaction.amount).label("net"),
+            func.sum(func.abs(models.Transaction.amount)).label("gross"),
+        )
+        .filter(
+            models.Transaction.trx_date == trx_date,
+            ~models.Transaction.trx_id.startswith(OPENING_TRX_PREFIX),
+        )
+        .group_by(models.Transaction.trx_id)
+        .subquery()
+    )
+    stmt = (
+        select(
+            func.coalesce(transfers.c.trx_id, postings.c.trx_id).label("trx_id"),
+            transfers.c.amount,
+            postings.c.postings,
+            postings.c.net,
+            postings.c.gross,
+        )
+        .select_from(transfers.join(postings, postings.c.trx_id == transfers.c.trx_id, full=True))
+        .filter(
+            or_(
+                transfers.c.trx_id.is_(None),
+                postings.c.trx_id.is_(None),
+                postings.c.postings != 2,
+                postings.c.net != 0,
+                postings.c.gross != transfers.c.amount * 2,
+            )
+        )
+    )
+    return [
+        {
+            "check": "transfers",
+            "reason": _transfer_reason_(row),
+            "trx_date": trx_date,
+            "trx_id": row.trx_id,
+            "amount": None if row.amount is None else str(row.amount),
+            "postings": row.postings or 0,
+            "postings_net": None if row.net is None else str(row.net),
+        }
+        for row in await session.execute(stmt)
+    ]
+
+
+async def _units_(sessionmaker: async_sessionmaker[AsyncSession], chunk_size: int) -> list[tuple[str, Any]]:
+    """keys and arguments of all the units of a run"""
+    async with sessionmaker() as session:
+        lowest, highest = (
+            await session.execute(select(func.min(models.Account.id), func.max(models.Account.id)))
+        ).one()
+        first_day, last_day = (
+            await session.execute(select(func.min(models.Transaction.trx_date), func.max(models.Transaction.trx_date)))
+        ).one()
+        first_transfer, last_transfer = (
+            await session.execute(select(func.min(models.Transfer.trx_date), func.max(models.Transfer.trx_date)))
+        ).one()
+
+    units: list[tuple[str, Any]] = [
+        (f"balance:{lo}-{lo + chunk_size}", (lo, lo + chunk_size))
+        for lo in range(lowest or 0, (highest or -1) + 1, chunk_size)
+    ]
+    days = [d for d in (first_day, last_day, first_transfer, last_transfer) if d]
+    if days:
+        units.extend((f"transfers:{day}", day) for day in _days_(min(days), max(days)))
+    return units
+
+
+def _days_(first: str, last: str) -> Iterator[str]:
+    day, end = date.fromisoformat(first), date.fromisoformat(last)
+    while day <= end:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+async def reconcile(
+    sessionmaker: async_sessionmaker[AsyncSession],
+    report: IO[str],
+    checkpoint: Checkpoint | None = None,
+    workers: int = 4,
+    chunk_size: int = 100000,
+    stats: dict[str, float] | None = None,
+) -> int:
+    """
+    run the balance and transfers checks with workers concurrent queries, writing discrepancies to report.
+    units already in checkpoint are skipped. returns the number of discrepancies found.
+    """
+    start = time.perf_counter()
+    checkpoint = checkpoint or Checkpoint(None)
+    units = await _units_(sessionmaker, chunk_size)
+    queue: asyncio.Queue[tuple[str, Any]] = asyncio.Queue()
+    for unit in units:
+        if unit[0] not in checkpoint.done:
+            queue.put_nowait(unit)
+    pending = queue.qsize()
+    found = 0
+
+    async def worker() -> None:
+        nonlocal found
+        while not queue.empty():
+            key, args = queue.get_nowait()
+            async with sessionmaker() as session:
+                if key.startswith("balance:"):
+                    discrepancies = await _balance_discrepancies_(session, *args)
+                else:
+                    discrepancies = await _transfer_discrepancies_(session, args)
+            # written in one go without awaiting in between, so lines of different units do not interleave
+            for discrepancy in discrepancies:
+                report.write(json.dumps(discrepancy) + "\n")
+            report.flush()
+            checkpoint.mark(key)
+            found += len(discrepancies)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(max(1, workers))]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"reconciled {pending} of {len(units)} units in {elapsed:.3f}s, {found} discrepancies")
+    if stats is not None:
+        stats.update(
+            {
+                "units": len(units),
+                "skipped": len(units) - pending,
+                "discrepancies": found,
+                "seconds": elapsed,
+            }
+        )
+    return found
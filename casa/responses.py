@@ -0,0 +1,42 @@
+import enum
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+__ALL__ = ["FastJSONResponse", "dumps"]
+
+
+def _default_(obj: Any) -> Any:
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """encode plain python data as json, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default_)
+    return json.dumps(content, default=_default_, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    json response for content that is already plain python data, e.g. a dict built from a row.
+    returning it from an endpoint skips the response_model validation and jsonable_encoder,
+    the endpoint is responsible for producing the same fields as the response_model.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
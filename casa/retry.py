@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable, ParamSpec, TypeVar
+
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import metrics
+
+from . import config
+
+__ALL__ = ["RetryBudget", "TransientError", "retry_reason", "run_with_retry"]
+
+logger = logging.getLogger(__name__)
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+# postgresql error codes that mean the transaction can safely be run again
+RETRYABLE_SQLSTATES = {
+    "40P01": "deadlock",
+    "40001": "serialization_failure",
+}
+
+retries_counter = metrics.counter("casa_db_retries_total", "transactions retried after a transient database error")
+deadlocks_counter = metrics.counter("casa_db_deadlocks_total", "deadlocks detected by the database")
+retry_exhausted_counter = metrics.counter(
+    "casa_db_retry_exhausted_total", "transient database errors returned to the caller without a retry"
+)
+
+
+class TransientError(Exception):
+    """a transient database error that was not retried, the request may succeed if sent again"""
+
+    pass
+
+
+class RetryBudget:
+    """
+    limits retries to a fraction of the requests, so that retries cannot multiply
+    the load on a database that is already overloaded. every request deposits ratio
+    tokens, every retry withdraws one, the balance is capped at max_tokens.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+budget = RetryBudget(config.DB_RETRY_BUDGET_RATIO, config.DB_RETRY_BUDGET_MAX)
+
+
+def retry_reason(e: DBAPIError) -> str | None:
+    """returns why the error is retryable, or None if it is not"""
+    # psycopg and the asyncpg adapter both expose the sqlstate of the original error
+    sqlstate = getattr(e.orig, "sqlstate", None) or getattr(e.orig, "pgcode", None)
+    if sqlstate in RETRYABLE_SQLSTATES:
+        return RETRYABLE_SQLSTATES[sqlstate]
+    if "database is locked" in str(e.orig):
+        return "locked"
+    return None
+
+
+def _backoff_(attempt: int) -> float:
+    # full jitter, spreads out the retries of transactions that collided with each other
+    ceiling = min(config.DB_RETRY_MAX_MS, config.DB_RETRY_BASE_MS * 2**attempt)
+    return random.uniform(0, ceiling) / 1000.0
+
+
+async def run_with_retry(
+    session: AsyncSession,
+    fn: Callable[P, Awaitable[T]],
+    *args: P.args,
+    **kwargs: P.kwargs,
+) -> T:
+    """
+    run fn, which must perform a complete database transaction with session,
+    rolling back and running it again when it fails with a deadlock or serialization failure
+    """
+    budget.deposit()
+    attempt = 0
+    while True:
+        try:
+            return await fn(*args, **kwargs)
+        except DBAPIError as e:
+            reason = retry_reason(e)
+            if reason is None:
+                raise
+
+            await session.rollback()
+            if reason == "deadlock":
+                deadlocks_counter.inc()
+
+            if attempt >= config.DB_RETRY_LIMIT or not budget.withdraw():
+                retry_exhausted_counter.inc(reason=reason)
+                raise TransientError(f"transaction failed after {attempt + 1} attempts: {reason}") from e
+
+            retries_counter.inc(reason=reason)
+            logger.info(f"retrying transaction after {reason}, attempt {attempt + 1}")
+            await asyncio.sleep(_backoff_(attempt))
+            attempt += 1
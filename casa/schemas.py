@@ -1,12 +1,21 @@
-from datetime import datetime
-from typing import Annotated, Optional, TypeAlias, TypeVar
+from datetime import date, datetime
+from typing import Annotated, Literal, Optional, TypeAlias, TypeVar
 
-from annotated_types import Gt
-from pydantic import BaseModel, constr
+from annotated_types import Gt, Len
+from pydantic import AfterValidator, BaseModel, StringConstraints, constr
 
 positive: TypeAlias = Annotated[float, Gt(0)]
 curreny: TypeAlias = Annotated[str, constr(min_length=3, max_length=3)]
 
+
+def _calendar_date_(value: str) -> str:
+    date.fromisoformat(value)
+    return value
+
+
+# YYYY-MM-DD of an existing day, trx_date is compared and ranged as a string everywhere
+iso_date: TypeAlias = Annotated[str, StringConstraints(pattern=r"^\d{4}-\d{2}-\d{2}$"), AfterValidator(_calendar_date_)]
+
 BaseModelT = TypeVar("BaseModelT", bound=BaseModel)
 
 
@@ -25,7 +34,7 @@ class AccountSchema(BaseModel):
 class TransferSchema(BaseModel):
     trx_id: Optional[str] = None
     ref_id: str
-    trx_date: str
+    trx_date: iso_date
     debit_account_num: str
     credit_account_num: str
     currency: curreny
@@ -35,3 +44,88 @@ class TransferSchema(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class TransactionSchema(BaseModel):
+    trx_id: str
+    ref_id: str
+    trx_date: str
+    currency: curreny
+    amount: float
+    running_balance: float
+    memo: str
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class TransactionPage(BaseModel):
+    items: list[TransactionSchema]
+    # opaque cursor to pass back for the next page, None on the last page
+    next_cursor: Optional[str] = None
+
+
+class BalanceSchema(BaseModel):
+    account_num: str
+    currency: curreny
+    as_of: str
+    balance: float
+    # date of the end of day snapshot the balance was derived from, None if there was none
+    snapshot_date: Optional[str] = None
+
+
+class BatchTransferRequest(BaseModel):
+    # atomic: all transfers are committed or none are
+    # best_effort: valid transfers are committed, invalid ones are rejected individually
+    mode: Literal["atomic", "best_effort"] = "best_effort"
+    transfers: Annotated[list[TransferSchema], Len(min_length=1, max_length=1000)]
+
+
+class BatchTransferItemResult(BaseModel):
+    ref_id: str
+    status: Literal["ok", "rejected"]
+    transfer: Optional[TransferSchema] = None
+    error: Optional[str] = None
+
+
+class BatchTransferResponse(BaseModel):
+    mode: Literal["atomic", "best_effort"]
+    committed: int
+    rejected: int
+    results: list[BatchTransferItemResult]
+
+
+class HoldRequest(BaseModel):
+    ref_id: str
+    debit_account_num: str
+    credit_account_num: str
+    currency: curreny
+    amount: positive
+    memo: str
+    # seconds until the hold expires if it is not captured, HOLD_TTL by default
+    expires_in: Optional[Annotated[int, Gt(0)]] = None
+
+
+class CaptureRequest(BaseModel):
+    # the whole hold is captured when not given, the rest of a partial capture is released
+    amount: Optional[positive] = None
+
+
+class HoldSchema(BaseModel):
+    hold_id: str
+    ref_id: str
+    debit_account_num: str
+    credit_account_num: str
+    currency: curreny
+    amount: float
+    captured_amount: Optional[float] = None
+    memo: str
+    status: str
+    expires_at: datetime
+    # trx_id of the transfer the hold was settled with
+    trx_id: Optional[str] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
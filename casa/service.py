@@ -1,41 +1,231 @@
+import base64
+import json
 import logging
 from datetime import datetime
 from decimal import Decimal
-from typing import Any, Type
+from typing import Any, Iterable, Sequence, Type
 
 import ulid
-from sqlalchemy import select
+from sqlalchemy import func, insert, select, tuple_, update
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from . import models, schemas
+import metrics
 
-__ALL__ = ["ValidationError", "get_account_details", "transfer"]
+from . import config, models, outbox, pipeline, schemas
+from .cache import LRUCache
+from .retry import TransientError, run_with_retry  # noqa: F401
+
+__ALL__ = ["TransientError", "ValidationError", "get_account_details", "transfer", "transfer_batch"]
 
 
 logger = logging.getLogger(__name__)
 
 
 class ValidationError(Exception):
-    pass
+    def __init__(self, message: str, reason: str = "invalid"):
+        super().__init__(message)
+        # short, fixed string that can be used as a metric label
+        self.reason = reason
+
+
+# recently completed transfers by ref_id, used to answer retries cheaply
+completed_transfers: LRUCache[str, schemas.TransferSchema] = LRUCache(config.IDEMPOTENCY_CACHE_SIZE)
+
+# active accounts by account_num, for balance enquiries, see account_payload
+account_cache: LRUCache[str, dict[str, Any]] = LRUCache(config.ACCOUNT_CACHE_SIZE, config.ACCOUNT_CACHE_TTL)
+
+metrics.callback("casa_account_cache_hits_total", "account cache hits", lambda: account_cache.hits, type_="counter")
+metrics.callback(
+    "casa_account_cache_misses_total", "account cache misses", lambda: account_cache.misses, type_="counter"
+)
+metrics.callback(
+    "casa_account_cache_evictions_total", "account cache evictions", lambda: account_cache.evictions, type_="counter"
+)
+metrics.callback("casa_account_cache_hit_ratio", "account cache hit ratio", lambda: account_cache.hit_ratio)
+metrics.callback("casa_account_cache_size", "number of cached accounts", lambda: len(account_cache))
+
+stage_seconds = metrics.histogram("casa_stage_seconds", "time spent in each stage of serving a request")
+validation_failures_counter = metrics.counter("casa_validation_failures_total", "requests rejected by validation")
+
+
+# columns read by balance enquiries, in the field order of AccountSchema
+ACCOUNT_COLUMNS = (
+    models.Account.account_num,
+    models.Account.currency,
+    models.Account.balance,
+    models.Account.avail_balance,
+    models.Account.status,
+    models.Account.updated_at,
+)
 
 
 def model2schema(model_obj: Any, schema_cls: Type[schemas.BaseModelT]) -> schemas.BaseModelT:
-    return schema_cls.model_validate(model_obj)
+    with stage_seconds.time(stage="model2schema"):
+        return schema_cls.model_validate(model_obj)
+
+
+def account_payload(row: Sequence[Any]) -> dict[str, Any]:
+    """
+    build the fields of AccountSchema from a row of ACCOUNT_COLUMNS without validating them,
+    the values come straight from typed columns. used by the fast response path in place of model2schema
+    """
+    account_num, currency, balance, avail_balance, status, updated_at = row
+    return {
+        "account_num": account_num,
+        "currency": currency,
+        "balance": float(balance),
+        "avail_balance": float(avail_balance),
+        "status": status.value,
+        "updated_at": updated_at,
+    }
 
 
 async def get_account_details(session: AsyncSession, account_num: str) -> schemas.AccountSchema | None:
-    stmt = select(models.Account).filter(
+    account, _ = await lookup_account(session, account_num)
+    return account
+
+
+async def lookup_account(session: AsyncSession, account_num: str) -> tuple[schemas.AccountSchema | None, bool]:
+    """
+    read through the account cache, returns the account if found
+    and whether it was served from the cache
+    """
+    payload, cache_hit = await lookup_account_payload(session, account_num)
+    if payload is None:
+        return None, cache_hit
+    return schemas.AccountSchema.model_construct(**payload), cache_hit
+
+
+async def lookup_account_payload(session: AsyncSession, account_num: str) -> tuple[dict[str, Any] | None, bool]:
+    """same as lookup_account, with the account as a dict from account_payload"""
+    payload = account_cache.get(account_num)
+    if payload:
+        return payload, True
+
+    payload = await _get_account_(session, account_num)
+    if payload:
+        account_cache.put(account_num, payload)
+    return payload, False
+
+
+def _invalidate_accounts_(account_nums: Iterable[str]) -> None:
+    for account_num in account_nums:
+        account_cache.pop(account_num)
+
+
+async def _get_account_(session: AsyncSession, account_num: str) -> dict[str, Any] | None:
+    stmt = select(*ACCOUNT_COLUMNS).filter(
         models.Account.account_num == account_num,
         models.Account.status == models.StatusEnum.ACTIVE,
     )
-    result = await session.execute(stmt)
-    account = result.scalars().first()
+    row = (await session.execute(stmt)).first()
+    return account_payload(row) if row else None
 
-    if account:
-        return model2schema(account, schemas.AccountSchema)
 
-    return None
+def _encode_cursor_(trx_date: str, trx_pk: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([trx_date, trx_pk]).encode()).decode()
+
+
+def _decode_cursor_(cursor: str) -> tuple[str, int]:
+    try:
+        trx_date, trx_pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(trx_date), int(trx_pk)
+    except (ValueError, TypeError):
+        raise ValidationError("Invalid cursor", reason="invalid_cursor")
+
+
+async def get_transactions(
+    session: AsyncSession,
+    account_num: str,
+    from_date: str | None = None,
+    to_date: str | None = None,
+    limit: int = 50,
+    cursor: str | None = None,
+) -> schemas.TransactionPage | None:
+    """
+    returns a page of transactions of an active account, newest first,
+    or None if the account is not found.
+    pages are located with the (trx_date, id) of the last row of the previous page
+    instead of an offset, so every page costs one index range scan of limit rows.
+    """
+    account_id = await session.scalar(
+        select(models.Account.id).filter(
+            models.Account.account_num == account_num,
+            models.Account.status == models.StatusEnum.ACTIVE,
+        )
+    )
+    if account_id is None:
+        return None
+
+    stmt = select(models.Transaction).filter(models.Transaction.account_id == account_id)
+    if from_date:
+        stmt = stmt.filter(models.Transaction.trx_date >= from_date)
+    if to_date:
+        stmt = stmt.filter(models.Transaction.trx_date <= to_date)
+    if cursor:
+        stmt = stmt.filter(tuple_(models.Transaction.trx_date, models.Transaction.id) < _decode_cursor_(cursor))
+
+    stmt = stmt.order_by(models.Transaction.trx_date.desc(), models.Transaction.id.desc()).limit(limit + 1)
+    rows = (await session.execute(stmt)).scalars().all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor_(rows[-1].trx_date, rows[-1].id)
+
+    return schemas.TransactionPage(
+        items=[model2schema(trx, schemas.TransactionSchema) for trx in rows],
+        next_cursor=next_cursor,
+    )
+
+
+async def get_balance_as_of(session: AsyncSession, account_num: str, as_of: str) -> schemas.BalanceSchema | None:
+    """
+    returns the balance of an active account at the end of as_of, or None if the account is not found.
+    the balance is read from the latest end of day snapshot up to as_of, plus the postings dated
+    after the snapshot up to as_of. without a snapshot, the postings after as_of are taken off
+    the current balance instead.
+    """
+    account = (
+        await session.execute(
+            select(models.Account.id, models.Account.currency, models.Account.balance).filter(
+                models.Account.account_num == account_num,
+                models.Account.status == models.StatusEnum.ACTIVE,
+            )
+        )
+    ).first()
+    if account is None:
+        return None
+
+    snapshot = (
+        await session.execute(
+            select(models.DailyBalance.balance_date, models.DailyBalance.balance)
+            .filter(models.DailyBalance.account_id == account.id, models.DailyBalance.balance_date <= as_of)
+            .order_by(models.DailyBalance.balance_date.desc())
+            .limit(1)
+        )
+    ).first()
+
+    postings = select(func.coalesce(func.sum(models.Transaction.amount), 0)).filter(
+        models.Transaction.account_id == account.id
+    )
+    if snapshot:
+        postings = postings.filter(
+            models.Transaction.trx_date > snapshot.balance_date, models.Transaction.trx_date <= as_of
+        )
+        balance = snapshot.balance + (await session.scalar(postings))
+    else:
+        postings = postings.filter(models.Transaction.trx_date > as_of)
+        balance = account.balance - (await session.scalar(postings))
+
+    return schemas.BalanceSchema(
+        account_num=account_num,
+        currency=account.currency,
+        as_of=as_of,
+        balance=balance,
+        snapshot_date=snapshot.balance_date if snapshot else None,
+    )
 
 
 async def _lock_accounts_for_trasnfer_(
@@ -49,14 +239,18 @@ async def _lock_accounts_for_trasnfer_(
             models.Account.account_num.in_([debit_account_num, credit_account_num]),
             models.Account.status == models.StatusEnum.ACTIVE,
         )
+        # lock the rows in a canonical order, so that opposite transfers
+        # between the same accounts wait for each other instead of deadlocking
+        .order_by(models.Account.id)
         .with_for_update()
     )
-    result = await session.execute(stmt)
+    with stage_seconds.time(stage="lock_wait"):
+        result = await session.execute(stmt)
     accounts = result.scalars().all()
 
     if len(accounts) != 2:
         await session.rollback()
-        raise ValidationError("Invalid debit or credit account number")
+        raise ValidationError("Invalid debit or credit account number", reason="invalid_account")
 
     if accounts[0].account_num == debit_account_num:
         return accounts[0], accounts[1]
@@ -64,6 +258,94 @@ async def _lock_accounts_for_trasnfer_(
         return accounts[1], accounts[0]
 
 
+def _post_transfer_(
+    session: AsyncSession,
+    transfer: schemas.TransferSchema,
+    debit_account: models.Account,
+    credit_account: models.Account,
+    trx_id: str,
+    now_dt: datetime,
+) -> tuple[models.Transfer, list[models.Transaction]]:
+    """
+    apply a transfer to 2 locked accounts and add the resulting objects to the session.
+    funds are checked before anything is modified, so a ValidationError leaves
+    the accounts untouched. the caller is responsible for committing.
+    """
+    transfer_amount = Decimal(transfer.amount)
+
+    if debit_account.avail_balance < transfer_amount:
+        raise ValidationError("Insufficient funds in debit account", reason="insufficient_funds")
+
+    # avail_balance is moved by the same amount rather than set to balance, it excludes the active holds
+    debit_account_balance = debit_account.balance - transfer_amount
+    debit_account.avail_balance -= transfer_amount
+    debit_account.balance = debit_account_balance
+
+    debit_transction = models.Transaction(
+        ref_id=transfer.ref_id,
+        trx_date=transfer.trx_date,
+        currency=transfer.currency,
+        amount=-transfer.amount,
+        memo=transfer.memo,
+        account=debit_account,
+        created_at=now_dt,
+        running_balance=debit_account_balance,
+        trx_id=trx_id,
+    )
+
+    credit_account_balance = credit_account.balance + transfer_amount
+    credit_account.avail_balance += transfer_amount
+    credit_account.balance = credit_account_balance
+
+    credit_transction = models.Transaction(
+        ref_id=transfer.ref_id,
+        trx_date=transfer.trx_date,
+        currency=transfer.currency,
+        amount=transfer.amount,
+        memo=f"from {transfer.debit_account_num}: {transfer.memo}",
+        account=credit_account,
+        created_at=now_dt,
+        running_balance=credit_account_balance,
+        trx_id=trx_id,
+    )
+
+    transfer_obj = models.Transfer(
+        trx_id=trx_id,
+        ref_id=transfer.ref_id,
+        trx_date=transfer.trx_date,
+        currency=transfer.currency,
+        amount=transfer.amount,
+        memo=transfer.memo,
+        debit_account_num=transfer.debit_account_num,
+        credit_account_num=transfer.credit_account_num,
+        created_at=now_dt,
+    )
+
+    session.add_all([debit_account, credit_account, debit_transction, credit_transction, transfer_obj])
+
+    return transfer_obj, [debit_transction, credit_transction]
+
+
+def _transfer_result_(
+    transfer_obj: models.Transfer,
+    transactions: list[models.Transaction],
+) -> tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]]:
+    events = [(models.Transaction, trx.id) for trx in transactions]
+    # every field was validated as part of the request or set by _post_transfer_, no need to validate again
+    result = schemas.TransferSchema.model_construct(
+        trx_id=transfer_obj.trx_id,
+        ref_id=transfer_obj.ref_id,
+        trx_date=transfer_obj.trx_date,
+        debit_account_num=transfer_obj.debit_account_num,
+        credit_account_num=transfer_obj.credit_account_num,
+        currency=transfer_obj.currency,
+        amount=float(transfer_obj.amount),
+        memo=transfer_obj.memo,
+        created_at=transfer_obj.created_at,
+    )
+    return result, events
+
+
 async def transfer(
     session: AsyncSession, transfer: schemas.TransferSchema
 ) -> tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]]:
@@ -71,11 +353,62 @@ async def transfer(
     perform a transfer and returns:
     1. transfer object
     2. list of Transfer objects and their id (to be used to event publishing later)
+
+    a transfer with a ref_id that has already been processed is not performed again,
+    the original transfer is returned with an empty list of events instead.
     """
+    replay = completed_transfers.get(transfer.ref_id)
+    if replay:
+        return _check_replay_(transfer, replay), []
+
+    with stage_seconds.time(stage="connection_acquire"):
+        await session.connection()
+
     try:
-        now_dt = datetime.now()
-        transfer_amount = Decimal(transfer.amount)
+        if config.TRANSFER_ENGINE == "core":
+            result = await run_with_retry(session, _transfer_core_, session, transfer)
+        else:
+            result = await run_with_retry(session, _transfer_orm_, session, transfer)
+    except IntegrityError:
+        # most likely a concurrent or earlier request with the same ref_id
+        replay = await _find_transfer_by_ref_id_(session, transfer.ref_id)
+        if replay is None:
+            raise
+        completed_transfers.put(transfer.ref_id, replay)
+        return _check_replay_(transfer, replay), []
+
+    _invalidate_accounts_([transfer.debit_account_num, transfer.credit_account_num])
+    completed_transfers.put(transfer.ref_id, result[0])
+    return result
+
+
+async def _find_transfer_by_ref_id_(session: AsyncSession, ref_id: str) -> schemas.TransferSchema | None:
+    stmt = select(models.Transfer).filter(models.Transfer.ref_id == ref_id)
+    transfer_obj = (await session.execute(stmt)).scalars().first()
+    if transfer_obj:
+        return model2schema(transfer_obj, schemas.TransferSchema)
+    return None
+
+
+def _check_replay_(transfer: schemas.TransferSchema, replay: schemas.TransferSchema) -> schemas.TransferSchema:
+    """make sure a retried request is the same transfer as the one it replays"""
+    if (
+        transfer.debit_account_num != replay.debit_account_num
+        or transfer.credit_account_num != replay.credit_account_num
+        or transfer.currency != replay.currency
+        or transfer.amount != replay.amount
+    ):
+        raise ValidationError(
+            f"ref_id {transfer.ref_id} has already been used by a different transfer", reason="ref_id_reused"
+        )
+    return replay
+
 
+async def _transfer_orm_(
+    session: AsyncSession, transfer: schemas.TransferSchema
+) -> tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]]:
+    try:
+        now_dt = datetime.now()
         trx_id = str(ulid.new())
 
         debit_account, credit_account = await _lock_accounts_for_trasnfer_(
@@ -83,71 +416,327 @@ async def transfer(
             transfer.debit_account_num,
             transfer.credit_account_num,
         )
-        if debit_account.avail_balance < transfer.amount:
-            raise ValidationError("Insufficient funds in debit account")
-
-        debit_account_balance = debit_account.balance - transfer_amount
-        debit_account.avail_balance = debit_account_balance
-        debit_account.balance = debit_account_balance
-
-        debit_transction = models.Transaction(
-            ref_id=transfer.ref_id,
-            trx_date=transfer.trx_date,
-            currency=transfer.currency,
-            amount=-transfer.amount,
-            memo=transfer.memo,
-            account=debit_account,
-            created_at=now_dt,
-            running_balance=debit_account_balance,
-            trx_id=trx_id,
+        transfer_obj, transactions = _post_transfer_(
+            session,
+            transfer,
+            debit_account,
+            credit_account,
+            trx_id,
+            now_dt,
         )
+        with stage_seconds.time(stage="flush"):
+            await session.flush()
+        with stage_seconds.time(stage="commit"):
+            await session.commit()
+
+        return _transfer_result_(transfer_obj, transactions)
+
+    except (IntegrityError, ValidationError):
+        await session.rollback()
+        raise
+
+
+async def _transfer_core_(
+    session: AsyncSession, transfer: schemas.TransferSchema
+) -> tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]]:
+    """
+    perform a transfer using conditional UPDATE ... RETURNING statements.
+    the debit only succeeds when the account is active and has sufficient funds,
+    so there is no need to read and lock the accounts before updating them.
+    """
+    try:
+        if transfer.debit_account_num == transfer.credit_account_num:
+            raise ValidationError("Invalid debit or credit account number", reason="invalid_account")
+
+        now_dt = datetime.now()
+        transfer_amount = Decimal(transfer.amount)
+        trx_id = str(ulid.new())
 
-        credit_account_balance = credit_account.balance + transfer_amount
-        credit_account.avail_balance = credit_account_balance
-        credit_account.balance = credit_account_balance
-
-        credit_transction = models.Transaction(
-            ref_id=transfer.ref_id,
-            trx_date=transfer.trx_date,
-            currency=transfer.currency,
-            amount=transfer.amount,
-            memo=f"from {transfer.debit_account_num}: {transfer.memo}",
-            account=credit_account,
-            created_at=now_dt,
-            running_balance=credit_account_balance,
-            trx_id=trx_id,
+        debit_stmt = (
+            update(models.Account)
+            .where(
+                models.Account.account_num == transfer.debit_account_num,
+                models.Account.status == models.StatusEnum.ACTIVE,
+                models.Account.avail_balance >= transfer_amount,
+            )
+            .values(
+                balance=models.Account.balance - transfer_amount,
+                avail_balance=models.Account.avail_balance - transfer_amount,
+                updated_at=now_dt,
+            )
+            .returning(models.Account.id, models.Account.balance)
+            .execution_options(synchronize_session=False)
         )
+        credit_stmt = (
+            update(models.Account)
+            .where(
+                models.Account.account_num == transfer.credit_account_num,
+                models.Account.status == models.StatusEnum.ACTIVE,
+            )
+            .values(
+                balance=models.Account.balance + transfer_amount,
+                avail_balance=models.Account.avail_balance + transfer_amount,
+                updated_at=now_dt,
+            )
+            .returning(models.Account.id, models.Account.balance)
+            .execution_options(synchronize_session=False)
+        )
+
+        # the account ids are not known before the updates, so the 2 rows are locked
+        # in account_num order to keep opposite transfers between the same accounts from deadlocking
+        # the row locks are taken by the updates, so this is where lock waits show up
+        with stage_seconds.time(stage="lock_wait"):
+            if transfer.debit_account_num < transfer.credit_account_num:
+                debit_row = (await session.execute(debit_stmt)).first()
+                credit_row = (await session.execute(credit_stmt)).first() if debit_row else None
+            else:
+                credit_row = (await session.execute(credit_stmt)).first()
+                debit_row = (await session.execute(debit_stmt)).first() if credit_row else None
+
+        if debit_row is None or credit_row is None:
+            await session.rollback()
+            # only pay for the extra queries on the failure path to report the right reason
+            if await _get_account_(session, transfer.debit_account_num) and await _get_account_(
+                session, transfer.credit_account_num
+            ):
+                raise ValidationError("Insufficient funds in debit account", reason="insufficient_funds")
+            raise ValidationError("Invalid debit or credit account number", reason="invalid_account")
+
+        transactions = [
+            {
+                "ref_id": transfer.ref_id,
+                "trx_date": transfer.trx_date,
+                "currency": transfer.currency,
+                "amount": -transfer_amount,
+                "memo": transfer.memo,
+                "account_id": debit_row.id,
+                "created_at": now_dt,
+                "running_balance": debit_row.balance,
+                "trx_id": trx_id,
+            },
+            {
+                "ref_id": transfer.ref_id,
+                "trx_date": transfer.trx_date,
+                "currency": transfer.currency,
+                "amount": transfer_amount,
+                "memo": f"from {transfer.debit_account_num}: {transfer.memo}",
+                "account_id": credit_row.id,
+                "created_at": now_dt,
+                "running_balance": credit_row.balance,
+                "trx_id": trx_id,
+            },
+        ]
+        # the inserts are executed directly, they take the place of the orm flush
+        with stage_seconds.time(stage="flush"):
+            trx_ids = await session.scalars(
+                insert(models.Transaction).returning(models.Transaction.id, sort_by_parameter_order=True),
+                transactions,
+            )
+            events = [(models.Transaction, trx_pk) for trx_pk in trx_ids.all()]
+
+            await session.execute(
+                insert(models.Transfer).values(
+                    trx_id=trx_id,
+                    ref_id=transfer.ref_id,
+                    trx_date=transfer.trx_date,
+                    currency=transfer.currency,
+                    amount=transfer_amount,
+                    memo=transfer.memo,
+                    debit_account_num=transfer.debit_account_num,
+                    credit_account_num=transfer.credit_account_num,
+                    created_at=now_dt,
+                )
+            )
+        with stage_seconds.time(stage="commit"):
+            await session.commit()
+
+        return transfer.model_copy(update={"trx_id": trx_id, "created_at": now_dt}), events
+
+    except (IntegrityError, ValidationError):
+        await session.rollback()
+        raise
 
-        transfer_obj = models.Transfer(
-            trx_id=trx_id,
-            ref_id=transfer.ref_id,
-            trx_date=transfer.trx_date,
-            currency=transfer.currency,
-            amount=transfer.amount,
-            memo=transfer.memo,
-            debit_account_num=transfer.debit_account_num,
-            credit_account_num=transfer.credit_account_num,
-            created_at=now_dt,
+
+async def _lock_accounts_(session: AsyncSession, account_nums: Iterable[str]) -> dict[str, models.Account]:
+    """
+    lock all active accounts in account_nums with a single query,
+    returns a dict of account_num -> Account for the accounts found
+    """
+    stmt = (
+        select(models.Account)
+        .filter(
+            models.Account.account_num.in_(sorted(set(account_nums))),
+            models.Account.status == models.StatusEnum.ACTIVE,
         )
+        # same lock order as _lock_accounts_for_trasnfer_
+        .order_by(models.Account.id)
+        .with_for_update()
+    )
+    with stage_seconds.time(stage="lock_wait"):
+        result = await session.execute(stmt)
+    return {account.account_num: account for account in result.scalars().all()}
+
+
+async def _find_replays_(session: AsyncSession, ref_ids: Iterable[str]) -> dict[str, schemas.TransferSchema]:
+    """
+    find the transfers that have already been completed for the given ref_ids,
+    first in the in-process cache, then with a single query for the rest
+    """
+    replays = {}
+    missing = []
+    for ref_id in set(ref_ids):
+        cached = completed_transfers.get(ref_id)
+        if cached:
+            replays[ref_id] = cached
+        else:
+            missing.append(ref_id)
+
+    if missing:
+        stmt = select(models.Transfer).filter(models.Transfer.ref_id.in_(missing))
+        for transfer_obj in (await session.execute(stmt)).scalars():
+            replays[transfer_obj.ref_id] = model2schema(transfer_obj, schemas.TransferSchema)
+
+    return replays
 
-        session.add_all([debit_account, credit_account, debit_transction, credit_transction, transfer_obj])
-        await session.commit()
 
-        events = [
-            (models.Transaction, debit_transction.id),
-            (models.Transaction, credit_transction.id),
+# each transfer in a batch is resolved to one of
+#   tuple of the posted Transfer and Transaction objects
+#   TransferSchema of a transfer completed earlier
+#   index of an earlier transfer in the batch with the same ref_id
+#   ValidationError
+_BatchItem = tuple[models.Transfer, list[models.Transaction]] | schemas.TransferSchema | int | ValidationError
+
+
+def _post_batch_item_(
+    session: AsyncSession,
+    transfers: list[schemas.TransferSchema],
+    i: int,
+    accounts: dict[str, models.Account],
+    replays: dict[str, schemas.TransferSchema],
+    seen: dict[str, int],
+    now_dt: datetime,
+) -> _BatchItem:
+    transfer = transfers[i]
+    try:
+        if transfer.ref_id in replays:
+            return _check_replay_(transfer, replays[transfer.ref_id])
+
+        if transfer.ref_id in seen:
+            _check_replay_(transfer, transfers[seen[transfer.ref_id]])
+            return seen[transfer.ref_id]
+        seen[transfer.ref_id] = i
+
+        debit_account = accounts.get(transfer.debit_account_num)
+        credit_account = accounts.get(transfer.credit_account_num)
+        if debit_account is None or credit_account is None or debit_account is credit_account:
+            raise ValidationError("Invalid debit or credit account number", reason="invalid_account")
+
+        return _post_transfer_(session, transfer, debit_account, credit_account, str(ulid.new()), now_dt)
+    except ValidationError as e:
+        return e
+
+
+def _batch_results_(
+    posted: list[_BatchItem],
+) -> list[tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]] | ValidationError]:
+    results: list[tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]] | ValidationError] = []
+    for item in posted:
+        if isinstance(item, int):
+            original = results[item]
+            results.append(original if isinstance(original, ValidationError) else (original[0], []))
+        elif isinstance(item, schemas.TransferSchema):
+            results.append((item, []))
+        elif isinstance(item, ValidationError):
+            results.append(item)
+        else:
+            result = _transfer_result_(*item)
+            completed_transfers.put(result[0].ref_id, result[0])
+            results.append(result)
+    return results
+
+
+async def transfer_batch(
+    session: AsyncSession,
+    transfers: list[schemas.TransferSchema],
+    atomic: bool = False,
+) -> list[tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]] | ValidationError]:
+    """
+    perform a list of transfers in a single database transaction.
+    all involved accounts are locked once, then the transfers are applied
+    in list order. returns a list with one entry per transfer, either
+    the same result as transfer() or the ValidationError that rejected it.
+
+    when atomic is True and any transfer is rejected, nothing is committed
+    and every transfer in the list is returned as a ValidationError.
+    """
+    with stage_seconds.time(stage="connection_acquire"):
+        await session.connection()
+
+    return await run_with_retry(session, _transfer_batch_, session, transfers, atomic)
+
+
+async def _transfer_batch_(
+    session: AsyncSession,
+    transfers: list[schemas.TransferSchema],
+    atomic: bool = False,
+) -> list[tuple[schemas.TransferSchema, list[tuple[Type[models.Transaction], int]]] | ValidationError]:
+    try:
+        now_dt = datetime.now()
+        # a duplicate ref_id would fail the commit of the whole batch,
+        # so replays are detected up front instead of relying on the unique index
+        replays = await _find_replays_(session, [t.ref_id for t in transfers])
+        accounts = await _lock_accounts_(
+            session,
+            [num for t in transfers if t.ref_id not in replays for num in (t.debit_account_num, t.credit_account_num)],
+        )
+
+        seen: dict[str, int] = {}
+        posted = [
+            _post_batch_item_(session, transfers, i, accounts, replays, seen, now_dt) for i in range(len(transfers))
         ]
-        schema = model2schema(transfer_obj, schemas.TransferSchema)
 
-        return schema, events
+        if atomic and any(isinstance(item, ValidationError) for item in posted):
+            await session.rollback()
+            aborted = ValidationError("Not applied, another transfer in the batch failed", reason="batch_aborted")
+            return [item if isinstance(item, ValidationError) else aborted for item in posted]
+
+        with stage_seconds.time(stage="flush"):
+            await session.flush()
+        with stage_seconds.time(stage="commit"):
+            await session.commit()
+        _invalidate_accounts_(accounts)
+
+        return _batch_results_(posted)
 
     except (IntegrityError, ValidationError):
         await session.rollback()
         raise
 
 
-def publish_events(events: list[tuple[Type[models.BaseT], int]]) -> int:
-    for e in events:
-        msg = f"publishing event for {e[0].__name__}({e[1]})"
-        logger.debug(msg)
+async def transaction_events(
+    session: AsyncSession, events: list[tuple[Type[models.BaseT], int]]
+) -> list[dict[str, Any]]:
+    """load the committed postings of events, as the events the outbox relay publishes for them"""
+    stmt = (
+        select(models.Transaction, models.Account.account_num)
+        .join(models.Transaction.account)
+        .filter(models.Transaction.id.in_([e[1] for e in events]))
+        .order_by(models.Transaction.id)
+    )
+    return [outbox.transaction_event(trx, account_num) for trx, account_num in await session.execute(stmt)]
+
+
+async def publish_events(events: list[tuple[Type[models.BaseT], int]]) -> int:
+    """
+    queue the events for the event pipeline when it is running, or log them otherwise.
+    the pipeline loads the postings in batches, outside of the request, see transaction_events.
+    waits while the queue of the pipeline is full, returns the number of events dropped
+    """
+    with stage_seconds.time(stage="publish"):
+        if pipeline.publisher:
+            return await pipeline.publisher.publish(events)
+
+        for e in events:
+            msg = f"publishing event for {e[0].__name__}({e[1]})"
+            logger.debug(msg)
     return 0
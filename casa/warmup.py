@@ -0,0 +1,199 @@
+"""
+warm-up of a new worker process before it reports ready
+
+the first requests of a worker otherwise pay for opening database connections, for sqlalchemy
+compiling the hot statements into its compiled cache and for the first use of the pydantic schemas.
+warm_up runs all of it once against account numbers that do not exist, so nothing is written.
+the inserts of a transfer are only compiled by the first real transfer.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import date, datetime
+from typing import Any
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import QueuePool
+
+import metrics
+
+from . import config, responses, schemas, service
+
+__ALL__ = ["FirstRequestTimer", "is_ready", "mark_ready", "state", "warm_up"]
+
+logger = logging.getLogger(__name__)
+
+# no account has this number, account numbers are digits
+WARMUP_ACCOUNT_NUM = "warmup"
+
+# monotonic times of the warm-up and the first requests, None until they happen
+state: dict[str, float | None] = {
+    "started": time.monotonic(),
+    "ready": None,
+    "warmup_seconds": None,
+    "first_request_seconds": None,
+    "first_fast_request_seconds": None,
+}
+
+metrics.callback("casa_warmup_seconds", "time spent warming up the worker", lambda: state["warmup_seconds"] or 0)
+metrics.callback(
+    "casa_first_request_seconds",
+    "latency of the first request served by the worker",
+    lambda: state["first_request_seconds"] or 0,
+)
+metrics.callback(
+    "casa_first_fast_request_seconds",
+    "time from the start of the worker to the end of its first request faster than WARMUP_FAST_REQUEST_MS",
+    lambda: state["first_fast_request_seconds"] or 0,
+)
+
+
+def is_ready() -> bool:
+    return state["ready"] is not None
+
+
+def mark_ready(ready: bool = True) -> None:
+    state["ready"] = time.monotonic() if ready else None
+
+
+async def _open_connections_(engine: AsyncEngine, count: int) -> None:
+    """open count connections at the same time, they go back to the pool when closed"""
+    if isinstance(engine.pool, QueuePool):
+        # more would wait for a connection to be returned, e.g. with a single sqlite writer
+        count = min(count, engine.pool.size())
+    connections = await asyncio.gather(*(engine.connect() for _ in range(count)))
+    try:
+        await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in connections))
+    finally:
+        await asyncio.gather(*(conn.close() for conn in connections))
+
+
+async def _run_reads_(sessionmaker: async_sessionmaker[AsyncSession]) -> None:
+    async with sessionmaker() as session:
+        await service._get_account_(session, WARMUP_ACCOUNT_NUM)
+        await service.get_transactions(session, WARMUP_ACCOUNT_NUM)
+        await service.get_balance_as_of(session, WARMUP_ACCOUNT_NUM, date.today().isoformat())
+        await session.rollback()
+
+
+async def _run_statements_(sessionmaker: async_sessionmaker[AsyncSession]) -> None:
+    await _run_reads_(sessionmaker)
+    async with sessionmaker() as session:
+        await service._find_transfer_by_ref_id_(session, WARMUP_ACCOUNT_NUM)
+        await service._find_replays_(session, [WARMUP_ACCOUNT_NUM])
+        await session.rollback()
+
+    transfer = _sample_transfer_()
+    transfer_fn = service._transfer_core_ if config.TRANSFER_ENGINE == "core" else service._transfer_orm_
+    async with sessionmaker() as session:
+        try:
+            await transfer_fn(session, transfer)
+        except service.ValidationError:
+            # expected, the accounts do not exist. the transaction has been rolled back
+            pass
+
+
+def _sample_transfer_() -> schemas.TransferSchema:
+    return schemas.TransferSchema(
+        ref_id=WARMUP_ACCOUNT_NUM,
+        trx_date=date.today().isoformat(),
+        debit_account_num=WARMUP_ACCOUNT_NUM,
+        credit_account_num=f"{WARMUP_ACCOUNT_NUM}2",
+        currency="USD",
+        amount=1.0,
+        memo="warm-up",
+    )
+
+
+def _exercise_schemas_() -> None:
+    now_dt = datetime.now()
+    transfer = _sample_transfer_()
+    transfer_json = transfer.model_dump_json()
+    schemas.TransferSchema.model_validate_json(transfer_json)
+    batch = schemas.BatchTransferRequest.model_validate({"transfers": [transfer.model_dump()]})
+    responses.dumps(transfer.model_dump())
+
+    account: dict[str, Any] = {
+        "account_num": WARMUP_ACCOUNT_NUM,
+        "currency": "USD",
+        "balance": 0.0,
+        "avail_balance": 0.0,
+        "status": "ACTIVE",
+        "updated_at": now_dt,
+    }
+    responses.dumps(schemas.AccountSchema.model_validate(account).model_dump())
+    schemas.TransactionPage(
+        items=[
+            schemas.TransactionSchema(
+                trx_id=WARMUP_ACCOUNT_NUM,
+                ref_id=WARMUP_ACCOUNT_NUM,
+                trx_date=transfer.trx_date,
+                currency="USD",
+                amount=1.0,
+                running_balance=1.0,
+                memo="warm-up",
+                created_at=now_dt,
+            )
+        ]
+    ).model_dump_json()
+    schemas.BatchTransferResponse(
+        mode=batch.mode,
+        committed=0,
+        rejected=1,
+        results=[schemas.BatchTransferItemResult(ref_id=transfer.ref_id, status="rejected", error="warm-up")],
+    ).model_dump_json()
+
+
+async def warm_up(
+    engine: AsyncEngine,
+    sessionmaker: async_sessionmaker[AsyncSession],
+    connections: int,
+    read_engine: AsyncEngine | None = None,
+    read_sessionmaker: async_sessionmaker[AsyncSession] | None = None,
+) -> float:
+    """
+    open connections connections, run the hot statements and exercise the schemas, returns the time it took.
+    the enquiries served by the read engine, when there is one, are warmed up on it as well
+    """
+    start = time.perf_counter()
+    await _open_connections_(engine, connections)
+    await _run_statements_(sessionmaker)
+    if read_engine is not None and read_sessionmaker is not None:
+        # sqlalchemy keeps a compiled cache per engine
+        await _open_connections_(read_engine, connections)
+        await _run_reads_(read_sessionmaker)
+    _exercise_schemas_()
+
+    elapsed = time.perf_counter() - start
+    state["warmup_seconds"] = elapsed
+    logger.info(f"warmed up {connections} connections in {elapsed:.3f}s")
+    return elapsed
+
+
+class FirstRequestTimer:
+    """
+    asgi middleware that records the latency of the first api request and when the first api request
+    faster than fast_seconds completed, then only passes requests through. probes such as /ready
+    and /metrics are not timed, they would be the first fast request of almost every worker
+    """
+
+    def __init__(self, app: Any, fast_seconds: float):
+        self.app = app
+        self.fast_seconds = fast_seconds
+        self.done = False
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if self.done or scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        start = time.monotonic()
+        await self.app(scope, receive, send)
+        end = time.monotonic()
+        if state["first_request_seconds"] is None:
+            state["first_request_seconds"] = end - start
+        if end - start <= self.fast_seconds:
+            state["first_fast_request_seconds"] = end - (state["started"] or end)
+            self.done = True
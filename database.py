@@ -1,22 +1,74 @@
+import asyncio
+import logging
 import os
+import time
 
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import QueuePool
 
-__all__ = ["SessionLocal", "engine"]
+import metrics
+
+__all__ = ["ReadRouter", "SessionLocal", "create_sqlite_engines", "engine", "read_engine", "read_router"]
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 db_url = os.environ.get("DATABASE_URL", "sqlite+aiosqlite:///memory:")
 
-engine = create_async_engine(
-    db_url,
-    pool_size=20,
-    max_overflow=5,
-    pool_timeout=30,
-    pool_recycle=1800,
-    echo=False,
-)
+# sqlite only allows one writer at a time and ignores SELECT ... FOR UPDATE, so concurrent writers
+# on a pool of connections fail with "database is locked". in single writer mode the database is
+# put in WAL mode, all writes go through an engine with a single connection, fed by the group
+# committer for transfers, and reads are served by a separate pool of read only connections
+sqlite_single_writer = os.environ.get("SQLITE_SINGLE_WRITER", "").upper() in ["1", "Y", "YES", "TRUE"]
+sqlite_single_writer = sqlite_single_writer and db_url.startswith("sqlite")
+sqlite_readers = int(os.environ.get("SQLITE_READERS", 8))
+
+SQLITE_PRAGMAS = [
+    "journal_mode=WAL",
+    # commits are not synced one by one, a power loss can lose the last ones but not corrupt the database
+    "synchronous=NORMAL",
+    "busy_timeout=5000",
+    "cache_size=-65536",
+    "temp_store=MEMORY",
+    "mmap_size=268435456",
+]
+
+
+def _set_sqlite_pragmas_(dbapi_connection, pragmas: list[str]) -> None:
+    cursor = dbapi_connection.cursor()
+    for pragma in pragmas:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+
+def create_sqlite_engines(url: str, readers: int) -> tuple[AsyncEngine, AsyncEngine]:
+    """the writer engine with a single connection and the engine of readers read only connections"""
+    writer = create_async_engine(url, pool_size=1, max_overflow=0, pool_timeout=30, echo=False)
+    reader = create_async_engine(url, pool_size=readers, max_overflow=0, pool_timeout=30, echo=False)
+    event.listen(writer.sync_engine, "connect", lambda conn, _: _set_sqlite_pragmas_(conn, SQLITE_PRAGMAS))
+    event.listen(
+        reader.sync_engine,
+        "connect",
+        lambda conn, _: _set_sqlite_pragmas_(conn, SQLITE_PRAGMAS + ["query_only=ON"]),
+    )
+    return writer, reader
+
+
+sqlite_read_engine: AsyncEngine | None = None
+if sqlite_single_writer:
+    engine, sqlite_read_engine = create_sqlite_engines(db_url, sqlite_readers)
+else:
+    engine = create_async_engine(
+        db_url,
+        pool_size=20,
+        max_overflow=5,
+        pool_timeout=30,
+        pool_recycle=1800,
+        echo=False,
+    )
 SessionLocal = async_sessionmaker(
     expire_on_commit=False,
     class_=AsyncSession,
@@ -24,3 +76,153 @@ SessionLocal = async_sessionmaker(
     autocommit=False,
     autoflush=False,
 )
+
+
+def register_pool_metrics(engine: AsyncEngine, prefix: str = "casa_db_pool") -> None:
+    """expose the usage of the connection pool of engine, the values are read when metrics are rendered"""
+    pool = engine.pool
+    checkouts = metrics.counter(f"{prefix}_checkouts_total", "connections checked out of the pool")
+    event.listen(engine.sync_engine, "checkout", lambda *args: checkouts.inc())
+
+    if not isinstance(pool, QueuePool):
+        return
+    metrics.callback(f"{prefix}_size", "configured size of the connection pool", pool.size)
+    metrics.callback(f"{prefix}_checked_out", "connections in use", pool.checkedout)
+    metrics.callback(f"{prefix}_checked_in", "idle connections in the pool", pool.checkedin)
+    metrics.callback(f"{prefix}_overflow", "connections opened beyond the pool size", pool.overflow)
+
+
+register_pool_metrics(engine)
+
+
+# optional replica for read only queries, with its own pool so reads do not take connections from transfers
+read_db_url = os.environ.get("DATABASE_READ_URL")
+# reads go to the primary when the replica is further behind than this many seconds
+read_max_lag = float(os.environ.get("DATABASE_READ_MAX_LAG", 5.0))
+# a lag check taking longer than this many seconds counts as the replica being unavailable
+read_probe_timeout = float(os.environ.get("DATABASE_READ_PROBE_TIMEOUT", 0.5))
+
+read_engine = (
+    create_async_engine(
+        read_db_url,
+        pool_size=20,
+        max_overflow=5,
+        pool_timeout=30,
+        pool_recycle=1800,
+        echo=False,
+    )
+    if read_db_url
+    else None
+)
+if sqlite_single_writer:
+    # the readers see every committed write, they stand in for a replica without lag
+    read_engine = sqlite_read_engine
+ReadSessionLocal = (
+    async_sessionmaker(
+        expire_on_commit=False,
+        class_=AsyncSession,
+        bind=read_engine,
+        autocommit=False,
+        autoflush=False,
+    )
+    if read_engine
+    else None
+)
+if read_engine:
+    register_pool_metrics(read_engine, prefix="casa_db_read_pool")
+
+
+# replication lag in seconds, 0 when the replica has replayed everything it received
+PG_REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN pg_last_wal_receive_lsn() IS NULL OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+
+class ReadRouter:
+    """
+    picks the sessionmaker for read only queries. the replica is used while it is reachable
+    and its replication lag is within max_lag seconds, otherwise reads fall back to the primary.
+    once started, the lag is checked every check_interval seconds by a background task, so a slow
+    replica never holds up a request. until then it is checked by the first read after check_interval,
+    for at most probe_timeout seconds.
+    """
+
+    def __init__(
+        self,
+        primary: async_sessionmaker[AsyncSession],
+        replica: async_sessionmaker[AsyncSession] | None,
+        max_lag: float = 5.0,
+        check_interval: float = 1.0,
+        probe_timeout: float = 0.5,
+    ):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.probe_timeout = probe_timeout
+        self.lag: float | None = None
+        self._checked_at = float("-inf")
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self.replica is not None and self._task is None:
+            await self.check()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def replica_lag(self) -> float:
+        assert self.replica is not None
+        async with self.replica() as session:
+            if session.get_bind().dialect.name != "postgresql":
+                # nothing to measure, e.g. a sqlite file copied or synced from the primary
+                await session.execute(text("SELECT 1"))
+                return 0.0
+            return float(await session.scalar(text(PG_REPLICA_LAG_SQL)) or 0.0)
+
+    async def check(self) -> None:
+        """measure the replication lag, lag is None when the replica is unavailable"""
+        self._checked_at = time.monotonic()
+        try:
+            self.lag = await asyncio.wait_for(self.replica_lag(), self.probe_timeout)
+        except Exception as e:
+            logger.warning(f"read replica unavailable, reading from primary: {str(e) or type(e).__name__}")
+            self.lag = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check()
+
+    async def sessionmaker(self) -> async_sessionmaker[AsyncSession]:
+        if self.replica is None:
+            return self.primary
+
+        if self._task is None and time.monotonic() - self._checked_at >= self.check_interval:
+            await self.check()
+
+        if self.lag is None or self.lag > self.max_lag:
+            reads_counter.inc(target="primary")
+            return self.primary
+        reads_counter.inc(target="replica")
+        return self.replica
+
+
+reads_counter = metrics.counter("casa_db_reads_total", "read only sessions by the database serving them")
+read_router = ReadRouter(SessionLocal, ReadSessionLocal, read_max_lag, probe_timeout=read_probe_timeout)
+if read_engine:
+    metrics.callback(
+        "casa_db_read_replica_lag_seconds",
+        "last measured replication lag, -1 when the replica is unavailable",
+        lambda: -1 if read_router.lag is None else read_router.lag,
+    )
@@ -0,0 +1,40 @@
+import argparse
+import asyncio
+import sys
+from datetime import date, timedelta
+
+from casa.eod import snapshot_balances
+from database import SessionLocal
+
+
+def parse_command_line_options(args):
+    parser = argparse.ArgumentParser(description="Write the end of day balance snapshot of every account")
+    parser.add_argument(
+        "--date",
+        dest="balance_date",
+        default=(date.today() - timedelta(days=1)).isoformat(),
+        help="date of the snapshot, YYYY-MM-DD, yesterday by default",
+    )
+    parser.add_argument(
+        "--chunk",
+        dest="chunk",
+        type=int,
+        default=10000,
+        help="number of accounts written per transaction",
+    )
+    return parser.parse_args(args)
+
+
+async def run(args) -> dict[str, float]:
+    stats: dict[str, float] = {}
+    await snapshot_balances(SessionLocal, args.balance_date, chunk_size=args.chunk, stats=stats)
+    return stats
+
+
+if __name__ == "__main__":
+    args = parse_command_line_options(sys.argv[1:])
+    stats = asyncio.run(run(args))
+    print(
+        f"Wrote {stats['rows']:.0f} balance snapshots for {args.balance_date} in {stats['seconds']:.2f}s",
+        file=sys.stderr,
+    )
@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import sys
+
+from casa.export import FORMATS, export_transactions
+from database import SessionLocal
+
+
+def parse_command_line_options(args):
+    parser = argparse.ArgumentParser(description="Export transactions of an account or a date range")
+    parser.add_argument(
+        "--account",
+        dest="account_num",
+        default=None,
+    )
+    parser.add_argument(
+        "--from",
+        dest="from_date",
+        default=None,
+    )
+    parser.add_argument(
+        "--to",
+        dest="to_date",
+        default=None,
+    )
+    parser.add_argument(
+        "--format",
+        dest="fmt",
+        default="ndjson",
+        choices=list(FORMATS),
+    )
+    parser.add_argument(
+        "--output",
+        dest="output",
+        default="-",
+        help="output file, - for stdout",
+    )
+    parser.add_argument(
+        "--batch",
+        dest="batch",
+        default=10000,
+    )
+
+    options = parser.parse_args(args)
+    if not (options.account_num or options.from_date or options.to_date):
+        parser.error("--account or a date range is required")
+    return options
+
+
+async def export(args) -> dict[str, float]:
+    stats: dict[str, float] = {}
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    try:
+        async for chunk in export_transactions(
+            SessionLocal,
+            args.fmt,
+            args.account_num,
+            args.from_date,
+            args.to_date,
+            batch_size=int(args.batch),
+            stats=stats,
+        ):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return stats
+
+
+if __name__ == "__main__":
+    args = parse_command_line_options(sys.argv[1:])
+    stats = asyncio.run(export(args))
+    print(
+        f"Exported {stats['rows']:.0f} transactions in {stats['seconds']:.2f}s, {stats['rows_per_second']:.0f} rows/s",
+        file=sys.stderr,
+    )
@@ -5,8 +5,13 @@ from contextlib import asynccontextmanager
 
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 
+import metrics
+import profiling
+from casa import config, events, group_commit, holds, ledger, outbox, partitions, pipeline, service, warmup
 from casa.api import router as casa_router
+from database import ReadSessionLocal, SessionLocal, engine, read_engine, read_router, sqlite_single_writer
 
 # Load the logging configuration
 LOGGING_CONFIG = {}
@@ -22,11 +27,100 @@ async def lifespan(app: FastAPI):
     # we tell mypy to ignore it for now
     console_formatter = uvicorn.logging.ColourizedFormatter(LOGGING_CONFIG["formatters"]["standard"]["format"])
     logger.handlers[0].setFormatter(console_formatter)
+
+    # started first and stopped last, so that the events of everything else are flushed
+    if config.EVENT_PIPELINE_ENABLED:
+        await pipeline.start(
+            events.create_sink(config.EVENT_SINK),
+            config.EVENT_QUEUE_SIZE,
+            config.EVENT_BATCH_SIZE,
+            config.EVENT_FLUSH_MS,
+            config.EVENT_PUT_TIMEOUT,
+            # the sqlite readers see every committed write and leave the single writer connection to transfers
+            ReadSessionLocal if sqlite_single_writer else SessionLocal,
+            # the ledger persists its postings in the background, they may not be in the database yet
+            ledger.transaction_events if config.CASA_BACKEND == "memory" else service.transaction_events,
+        )
+
+    if config.CASA_BACKEND == "memory":
+        await ledger.start(
+            SessionLocal,
+            config.LEDGER_DIR,
+            shards=config.LEDGER_SHARDS,
+            persist_batch_size=config.LEDGER_PERSIST_BATCH_SIZE,
+            persist_interval=config.LEDGER_PERSIST_INTERVAL,
+            snapshot_interval=config.LEDGER_SNAPSHOT_INTERVAL,
+            fsync=config.LEDGER_FSYNC,
+            idempotency_cache_size=config.IDEMPOTENCY_CACHE_SIZE,
+        )
+
+    # with a single sqlite writer, transfers are queued for it and committed in batches
+    if config.GROUP_COMMIT_ENABLED or sqlite_single_writer:
+        await group_commit.start(SessionLocal, config.GROUP_COMMIT_WINDOW_MS, config.GROUP_COMMIT_MAX_SIZE)
+
+    if config.OUTBOX_RELAY_ENABLED:
+        await outbox.start(
+            SessionLocal,
+            events.create_sink(config.OUTBOX_SINK),
+            config.OUTBOX_BATCH_SIZE,
+            config.OUTBOX_POLL_INTERVAL,
+        )
+
+    if config.PARTITION_MAINTENANCE_ENABLED:
+        await partitions.start(SessionLocal, config.PARTITION_MONTHS_AHEAD, config.PARTITION_CHECK_INTERVAL)
+
+    if config.HOLD_SETTLEMENT_ENABLED:
+        await holds.start(SessionLocal, config.HOLD_SETTLE_BATCH_SIZE, config.HOLD_SETTLE_INTERVAL)
+
+    # measures the lag of the read replica in the background, requests only read the last result
+    await read_router.start()
+
+    if config.WARMUP_ENABLED:
+        await warmup.warm_up(engine, SessionLocal, config.WARMUP_CONNECTIONS, read_engine, ReadSessionLocal)
+    warmup.mark_ready()
+
     yield
 
+    warmup.mark_ready(False)
+    await holds.stop()
+    await partitions.stop()
+    await outbox.stop()
+    await group_commit.stop()
+    await ledger.stop()
+    await read_router.stop()
+    await pipeline.stop(config.EVENT_FLUSH_TIMEOUT)
+
 
 app = FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None)
 app.include_router(casa_router)
+# stops timing once the first fast request has been seen, a single attribute check per request after that
+app.add_middleware(warmup.FirstRequestTimer, fast_seconds=config.WARMUP_FAST_REQUEST_MS / 1000)
+
+# the middleware is only added when enabled, so it costs nothing otherwise
+if config.PROFILING_ENABLED:
+    profiling.install(
+        app,
+        profiling.RequestProfiler(
+            config.PROFILING_DIR,
+            sample_n=config.PROFILING_SAMPLE_N,
+            header=config.PROFILING_HEADER,
+            keep=config.PROFILING_KEEP,
+        ),
+        admin_token=config.PROFILING_ADMIN_TOKEN,
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ready", include_in_schema=False)
+async def get_ready():
+    # succeeds once the lifespan startup, including the warm-up, has completed
+    if warmup.is_ready():
+        return {"status": "ready", "warmup_seconds": warmup.state["warmup_seconds"]}
+    return JSONResponse({"status": "starting"}, status_code=503)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,169 @@
+"""
+minimal in-process metrics registry, rendered in prometheus text exposition format
+"""
+
+import bisect
+import time
+from typing import Callable, Iterable
+
+__all__ = ["Counter", "Gauge", "Histogram", "counter", "gauge", "histogram", "callback", "render"]
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _labels_key(labels: dict[str, str]) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+def _format_sample(name: str, labels: Labels, value: float) -> str:
+    if labels:
+        label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+        return f"{name}{{{label_str}}} {value}"
+    return f"{name} {value}"
+
+
+class Metric:
+    type_ = "untyped"
+
+    def __init__(self, name: str, help_: str):
+        self.name = name
+        self.help = help_
+
+    def samples(self) -> Iterable[tuple[str, Labels, float]]:
+        return []
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_}"]
+        lines.extend(_format_sample(name, labels, value) for name, labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_ = "counter"
+
+    def __init__(self, name: str, help_: str):
+        super().__init__(name, help_)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _labels_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(_labels_key(labels), 0)
+
+    def samples(self) -> Iterable[tuple[str, Labels, float]]:
+        return [(self.name, labels, value) for labels, value in self._values.items()]
+
+
+class Gauge(Counter):
+    type_ = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[_labels_key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+# seconds, from well below a local database round trip to well above a pool timeout
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_start")
+
+    def __init__(self, histogram: "Histogram", labels: dict[str, str]):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+
+
+class Histogram(Metric):
+    type_ = "histogram"
+
+    def __init__(self, name: str, help_: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self._values: dict[Labels, list[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _labels_key(labels)
+        values = self._values.get(key)
+        if values is None:
+            values = self._values[key] = [0] * (len(self.buckets) + 2)
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def time(self, **labels: str) -> _Timer:
+        """context manager that observes the time spent in its block"""
+        return _Timer(self, labels)
+
+    def count(self, **labels: str) -> float:
+        values = self._values.get(_labels_key(labels))
+        return sum(values[:-1]) if values else 0
+
+    def samples(self) -> Iterable[tuple[str, Labels, float]]:
+        result = []
+        bounds = [str(b) for b in self.buckets] + ["+Inf"]
+        for labels, values in self._values.items():
+            cumulative: float = 0
+            for bound, count in zip(bounds, values):
+                cumulative += count
+                result.append((f"{self.name}_bucket", labels + (("le", bound),), cumulative))
+            result.append((f"{self.name}_sum", labels, values[-1]))
+            result.append((f"{self.name}_count", labels, cumulative))
+        return result
+
+
+class CallbackMetric(Metric):
+    """a metric whose value is read from a function when rendered"""
+
+    def __init__(self, name: str, help_: str, type_: str, fn: Callable[[], float]):
+        super().__init__(name, help_)
+        self.type_ = type_
+        self._fn = fn
+
+    def samples(self) -> Iterable[tuple[str, Labels, float]]:
+        return [(self.name, (), self._fn())]
+
+
+_registry: dict[str, Metric] = {}
+
+
+def _register(metric: Metric) -> Metric:
+    return _registry.setdefault(metric.name, metric)
+
+
+def counter(name: str, help_: str) -> Counter:
+    metric = _register(Counter(name, help_))
+    assert isinstance(metric, Counter)
+    return metric
+
+
+def gauge(name: str, help_: str) -> Gauge:
+    metric = _register(Gauge(name, help_))
+    assert isinstance(metric, Gauge)
+    return metric
+
+
+def histogram(name: str, help_: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+    metric = _register(Histogram(name, help_, buckets))
+    assert isinstance(metric, Histogram)
+    return metric
+
+
+def callback(name: str, help_: str, fn: Callable[[], float], type_: str = "gauge") -> None:
+    # replace any earlier registration, so the latest owner of the value is reported
+    _registry[name] = CallbackMetric(name, help_, type_, fn)
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in _registry.values()) + "\n"
@@ -0,0 +1,94 @@
+"""partition casa_transaction by month
+
+casa_transaction is rebuilt as a table partitioned by range of trx_date on postgresql,
+with one partition per month from the oldest transaction to 3 months ahead and a default
+partition. the existing rows are copied, which takes a while on a large table.
+the primary key becomes (id, trx_date), because it has to include the partition key.
+casa_transfer is left as it is, see casa.partitions.archive_transfers.
+other databases are not changed.
+
+Revision ID: 4763951663a5
+Revises: 3c27ce4e5957
+Create Date: 2026-10-17 11:51:03.910536
+
+"""
+
+from datetime import date
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import context, op
+
+from casa.partitions import DEFAULT_PARTITION, add_months, create_partition_sql, month_start
+
+# revision identifiers, used by Alembic.
+revision: str = "4763951663a5"
+down_revision: Union[str, None] = "3c27ce4e5957"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+INDEXES = ["account_date_idx", "transaction_unpublished_idx", "ix_casa_transaction_trx_date"]
+
+
+def _rename_table_(old: str, new: str) -> None:
+    op.execute(f"ALTER TABLE {old} RENAME TO {new}")
+    op.execute(f"ALTER TABLE {new} RENAME CONSTRAINT {old}_pkey TO {new}_pkey")
+    op.execute(f"ALTER TABLE {new} RENAME CONSTRAINT {old}_account_id_fkey TO {new}_account_id_fkey")
+    for index in INDEXES:
+        op.execute(f"ALTER INDEX {index} RENAME TO {index}_{new}")
+
+
+def _create_table_(partitioned: bool, source: str) -> None:
+    """create casa_transaction with the columns, keys and indexes of the source table, then move the rows over"""
+    partition_by = " PARTITION BY RANGE (trx_date)" if partitioned else ""
+    op.execute(f"CREATE TABLE casa_transaction (LIKE {source} INCLUDING DEFAULTS){partition_by}")
+    op.execute(f"ALTER TABLE casa_transaction ADD PRIMARY KEY {'(id, trx_date)' if partitioned else '(id)'}")
+    op.create_foreign_key(
+        "casa_transaction_account_id_fkey", "casa_transaction", "casa_account", ["account_id"], ["id"]
+    )
+    op.create_index("account_date_idx", "casa_transaction", ["account_id", "trx_date", "id"], unique=False)
+    op.create_index("ix_casa_transaction_trx_date", "casa_transaction", ["trx_date"], unique=False)
+    op.create_index(
+        "transaction_unpublished_idx",
+        "casa_transaction",
+        ["id"],
+        unique=False,
+        postgresql_where=sa.text("NOT is_published"),
+    )
+
+    if partitioned:
+        op.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF casa_transaction DEFAULT")
+        # offline (--sql) migrations cannot query, they start with the current month
+        oldest = None
+        if not context.is_offline_mode():
+            oldest = op.get_bind().execute(sa.text(f"SELECT min(trx_date) FROM {source}")).scalar()
+        try:
+            start = month_start(date.fromisoformat(oldest)) if oldest else month_start(date.today())
+        except ValueError:
+            start = month_start(date.today())
+        month = start
+        while month <= add_months(date.today(), MONTHS_AHEAD):
+            op.execute(create_partition_sql(month))
+            month = add_months(month, 1)
+
+    op.execute(f"INSERT INTO casa_transaction SELECT * FROM {source}")
+    # the sequence would be dropped with the source table otherwise
+    op.execute("ALTER SEQUENCE casa_transaction_id_seq OWNED BY casa_transaction.id")
+    op.execute(f"DROP TABLE {source}")
+
+
+def upgrade() -> None:
+    if op.get_context().dialect.name != "postgresql":
+        return
+
+    _rename_table_("casa_transaction", "casa_transaction_unpartitioned")
+    _create_table_(True, "casa_transaction_unpartitioned")
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name != "postgresql":
+        return
+
+    _rename_table_("casa_transaction", "casa_transaction_partitioned")
+    _create_table_(False, "casa_transaction_partitioned")
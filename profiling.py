@@ -0,0 +1,150 @@
+"""
+on-demand request profiling with cProfile
+
+a request is profiled when it carries the profiling header, or when it is the Nth request
+since the last sampled one. profiles are written to a directory as .prof files, which can be
+opened with pstats or snakeviz, together with an index.ndjson describing each request.
+"""
+
+import asyncio
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import secrets
+import time
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+
+__all__ = ["RequestProfiler", "install"]
+
+INDEX_FILE = "index.ndjson"
+
+
+class RequestProfiler:
+    def __init__(self, directory: str, sample_n: int = 0, header: str = "X-Profile", keep: int = 200):
+        self.directory = directory
+        self.sample_n = sample_n
+        self.header = header
+        self.keep = keep
+        self._requests = itertools.count(1)
+        self._active = False
+        os.makedirs(directory, exist_ok=True)
+
+    def trigger(self, request: Request) -> str | None:
+        """returns why the request should be profiled, or None"""
+        if self.header in request.headers:
+            return "header"
+        if self.sample_n > 0 and next(self._requests) % self.sample_n == 0:
+            return "sample"
+        return None
+
+    async def dispatch(self, request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+        trigger = self.trigger(request)
+        # only one profiler can be active in a process. cProfile sees every coroutine that runs
+        # on the event loop while the request is in flight, so a profile under load includes
+        # some work done for other requests too
+        if trigger is None or self._active:
+            return await call_next(request)
+
+        self._active = True
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            response = await call_next(request)
+        finally:
+            profile.disable()
+            self._active = False
+
+        profile_id = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        entry = {
+            "id": profile_id,
+            "method": request.method,
+            "path": request.url.path,
+            "status": response.status_code,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+            "trigger": trigger,
+        }
+        await asyncio.to_thread(self._save, profile, entry)
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+
+    def _save(self, profile: cProfile.Profile, entry: dict) -> None:
+        profile.dump_stats(os.path.join(self.directory, f"{entry['id']}.prof"))
+        with open(os.path.join(self.directory, INDEX_FILE), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+        profiles = self.profiles()
+        expired = profiles[: max(0, len(profiles) - self.keep)]
+        for name in expired:
+            os.remove(os.path.join(self.directory, name))
+        if expired:
+            # keep the index in step with the profiles on disk
+            kept = self.requests()
+            with open(os.path.join(self.directory, INDEX_FILE), "w") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in kept)
+
+    def profiles(self) -> list[str]:
+        """file names of the captured profiles, oldest first"""
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(".prof"))
+
+    def requests(self) -> list[dict]:
+        """index entries of the captured profiles that are still kept"""
+        kept = {name[: -len(".prof")] for name in self.profiles()}
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), "r") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+        return [entry for entry in entries if entry["id"] in kept]
+
+    def top(self, limit: int = 20, sort: str = "tottime") -> dict:
+        """
+        aggregate all captured profiles and return the functions with the most time,
+        along with the slowest profiled requests
+        """
+        profiles = self.profiles()
+        if not profiles:
+            return {"profiles": 0, "sort": sort, "functions": [], "slowest": []}
+
+        stats = pstats.Stats(*[os.path.join(self.directory, name) for name in profiles])
+        rows = [
+            {
+                "function": f"{file}:{line}({name})",
+                "calls": calls,
+                "tottime": round(tottime, 6),
+                "cumtime": round(cumtime, 6),
+            }
+            for (file, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items()  # type: ignore
+        ]
+        rows.sort(key=lambda row: row[sort], reverse=True)
+        slowest = sorted(self.requests(), key=lambda entry: entry["duration_ms"], reverse=True)
+        return {"profiles": len(profiles), "sort": sort, "functions": rows[:limit], "slowest": slowest[:limit]}
+
+
+def install(app: FastAPI, profiler: RequestProfiler, admin_token: str | None = None) -> None:
+    """
+    add the profiling middleware to app, and the admin route listing the top offenders when admin_token is set.
+    the route exposes source paths and request timings, it requires the token in the X-Admin-Token header
+    """
+
+    @app.middleware("http")
+    async def profile_requests(request: Request, call_next):
+        return await profiler.dispatch(request, call_next)
+
+    if not admin_token:
+        return
+
+    @app.get("/admin/profiles", include_in_schema=False)
+    async def top_profiled_functions(
+        limit: int = Query(20, ge=1, le=500),
+        sort: str = Query("tottime", pattern="^(tottime|cumtime|calls)$"),
+        x_admin_token: str = Header(""),
+    ):
+        if not secrets.compare_digest(x_admin_token.encode(), admin_token.encode()):
+            raise HTTPException(status_code=403, detail="invalid admin token")
+        return await asyncio.to_thread(profiler.top, limit, sort)
@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import sys
+
+from casa.reconcile import Checkpoint, reconcile
+from database import ReadSessionLocal, SessionLocal
+
+
+def parse_command_line_options(args):
+    parser = argparse.ArgumentParser(
+        description="Check that account balances match their postings and every transfer has 2 matching postings"
+    )
+    parser.add_argument(
+        "--report",
+        dest="report",
+        default="-",
+        help="file the discrepancies are written to, one json object per line, - for stdout",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        dest="checkpoint",
+        default=None,
+        help="file the completed units are recorded in",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="skip the units in the checkpoint file and append to the report",
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        default=4,
+        help="number of queries run concurrently",
+    )
+    parser.add_argument(
+        "--chunk",
+        dest="chunk",
+        type=int,
+        default=100000,
+        help="number of account ids per unit of the balance check",
+    )
+
+    options = parser.parse_args(args)
+    if options.resume and not options.checkpoint:
+        parser.error("--resume requires --checkpoint")
+    return options
+
+
+async def run(args) -> dict[str, float]:
+    stats: dict[str, float] = {}
+    # the checks only read, so they run on the replica when there is one
+    sessionmaker = ReadSessionLocal or SessionLocal
+    checkpoint = Checkpoint(args.checkpoint, resume=args.resume)
+    report = sys.stdout if args.report == "-" else open(args.report, "a" if args.resume else "w")
+    try:
+        await reconcile(sessionmaker, report, checkpoint, workers=args.workers, chunk_size=args.chunk, stats=stats)
+    finally:
+        checkpoint.close()
+        if report is not sys.stdout:
+            report.close()
+    return stats
+
+
+if __name__ == "__main__":
+    args = parse_command_line_options(sys.argv[1:])
+    stats = asyncio.run(run(args))
+    print(
+        f"Checked {stats['units'] - stats['skipped']:.0f} of {stats['units']:.0f} units in {stats['seconds']:.2f}s, "
+        f"found {stats['discrepancies']:.0f} discrepancies",
+        file=sys.stderr,
+    )
+    sys.exit(1 if stats["discrepancies"] else 0)
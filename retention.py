@@ -0,0 +1,64 @@
+import argparse
+import json
+import sys
+from datetime import date
+
+from casa import config, partitions
+from seed import get_engine
+
+
+def parse_command_line_options(args):
+    parser = argparse.ArgumentParser(
+        description="Create upcoming partitions of casa_transaction, archive and drop the expired ones"
+    )
+    parser.add_argument(
+        "--keep-months",
+        dest="keep_months",
+        type=int,
+        default=config.RETENTION_MONTHS,
+        help="number of months kept, including the current one",
+    )
+    parser.add_argument(
+        "--archive-dir",
+        dest="archive_dir",
+        default=config.ARCHIVE_DIR,
+    )
+    parser.add_argument(
+        "--months-ahead",
+        dest="months_ahead",
+        type=int,
+        default=config.PARTITION_MONTHS_AHEAD,
+    )
+    parser.add_argument(
+        "--transfers",
+        action="store_true",
+        default=False,
+        help="also archive and delete casa_transfer rows older than the kept months",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=False,
+    )
+    return parser.parse_args(args)
+
+
+def run(args) -> dict:
+    engine = get_engine()
+    if engine.dialect.name != "postgresql":
+        sys.exit("Partitioning is only supported on PostgreSQL")
+
+    report: dict = {"created": [], "archived": []}
+    if not args.dry_run:
+        with engine.begin() as conn:
+            report["created"] = partitions.create_partitions(conn, date.today(), args.months_ahead + 1)
+
+    report["archived"] = partitions.archive_partitions(engine, args.keep_months, args.archive_dir, dry_run=args.dry_run)
+    if args.transfers:
+        cutoff = partitions.retention_cutoff(args.keep_months)
+        report["transfers"] = partitions.archive_transfers(engine, cutoff, args.archive_dir, dry_run=args.dry_run)
+    return report
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(parse_command_line_options(sys.argv[1:])), indent=4))
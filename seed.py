@@ -1,18 +1,56 @@
 import argparse
+import bisect
 import csv
+import itertools
+import math
 import os
 import random
 import sys
-from datetime import datetime
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterator
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import Engine, create_engine, insert, text
 from sqlalchemy.orm import sessionmaker
 
 from casa.models import Account, StatusEnum
+from casa.reconcile import OPENING_TRX_PREFIX
 
 __BALANCE_BUCKETS__ = [100.0, 500.0, 1000.0, 50000.0, 10000000.0]
 
+__HISTORY_COLUMNS__ = {
+    "casa_account": ["id", "account_num", "currency", "balance", "avail_balance", "status", "updated_at"],
+    "casa_transaction": [
+        "account_id",
+        "trx_date",
+        "currency",
+        "amount",
+        "running_balance",
+        "ref_id",
+        "trx_id",
+        "memo",
+        "is_published",
+        "created_at",
+    ],
+    "casa_transfer": [
+        "trx_id",
+        "trx_date",
+        "ref_id",
+        "currency",
+        "amount",
+        "memo",
+        "debit_account_num",
+        "credit_account_num",
+        "created_at",
+    ],
+}
+
+__COPY_ACCOUNTS_SQL__ = (
+    "COPY casa_account (account_num, currency, balance, avail_balance, status, updated_at) FROM STDIN"
+)
+
 
 load_dotenv()
 
@@ -28,7 +66,7 @@ def parse_command_line_options(args):
         "--mode",
         dest="mode",
         default="load",
-        help="load or gen",
+        help="load, gen or history",
     )
     parser.add_argument(
         "--source",
@@ -50,12 +88,55 @@ def parse_command_line_options(args):
         dest="start",
         default=1,
     )
+    parser.add_argument(
+        "--loader",
+        dest="loader",
+        default="fast",
+        choices=["fast", "orm"],
+        help="fast uses COPY on PostgreSQL and executemany elsewhere, orm uses bulk_save_objects",
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        default=1,
+        help="number of processes loading (PostgreSQL only) or generating history in parallel",
+    )
+    parser.add_argument(
+        "--seed",
+        dest="seed",
+        default=1,
+        help="seed of the account number permutation, runs with the same seed and different --start do not overlap",
+    )
+    parser.add_argument(
+        "--rows-per-account",
+        dest="rows_per_account",
+        default=20,
+        help="average number of transactions per account in history mode",
+    )
+    parser.add_argument(
+        "--skew",
+        dest="skew",
+        default=1.0,
+        help="zipf exponent of the activity per account in history mode, 0 for uniform",
+    )
+    parser.add_argument(
+        "--days",
+        dest="days",
+        default=90,
+        help="number of days of history",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        dest="chunk_size",
+        default=100000,
+        help="number of accounts per output file in history mode",
+    )
 
     options = parser.parse_args(args)
     return options
 
 
-def generate_csv(file_path: str, count: int, start: int = 1):
+def generate_csv(file_path: str, count: int, start: int = 1, seed: int = 1):
     with open(file_path, "w") as csv_f:
         writer = csv.DictWriter(
             csv_f,
@@ -63,7 +144,7 @@ def generate_csv(file_path: str, count: int, start: int = 1):
         )
         writer.writeheader()
 
-        for i in _gen_random_account_num_(count, 9):
+        for i in _gen_random_account_num_(count, 9, start, seed):
             writer.writerow(
                 {
                     "account_num": f"A{i:09}",
@@ -108,26 +189,329 @@ def _read_csv_(file_path: str, batch_size: int):
             yield batch
 
 
+def _split_file_(file_path: str, parts: int) -> list[tuple[int, int]]:
+    """split a csv file into byte ranges that start and end on line boundaries, skipping the header"""
+    size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        f.readline()
+        offsets = [f.tell()]
+        for i in range(1, parts):
+            f.seek(max(offsets[-1], size * i // parts))
+            f.readline()
+            offsets.append(min(f.tell(), size))
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if start < end]
+
+
+def _read_range_(file_path: str, start: int, end: int):
+    with open(file_path, "rb") as f:
+        header = next(csv.reader([f.readline().decode()]))
+        f.seek(start)
+
+        def lines():
+            pos = start
+            while pos < end:
+                line = f.readline()
+                if not line:
+                    break
+                pos += len(line)
+                yield line.decode()
+
+        for values in csv.reader(lines()):
+            yield dict(zip(header, values))
+
+
+def _copy_accounts_(db_url: str, file_path: str, start: int, end: int) -> int:
+    """stream a range of the csv file into casa_account with COPY FROM STDIN"""
+    engine = create_engine(db_url)
+    now_dt = datetime.now()
+    count = 0
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            with cursor.copy(__COPY_ACCOUNTS_SQL__) as copy:
+                for row in _read_range_(file_path, start, end):
+                    balance = row["balance"]
+                    copy.write_row((row["account_num"], row["currency"], balance, balance, "ACTIVE", now_dt))
+                    count += 1
+        conn.commit()
+    finally:
+        conn.close()
+        engine.dispose()
+    return count
+
+
+def copy_load(engine: Engine, file_path: str, workers: int) -> int:
+    """
+    load accounts with COPY, splitting the file across a process pool when workers > 1.
+    account_status_idx is dropped during the load and built once at the end, which is much
+    cheaper than maintaining it row by row. each worker commits on its own, so a failed load
+    can leave some of the rows behind. the index is still rebuilt after a failure when it can be,
+    the rows left behind may be duplicates that make it fail, then the load error is raised.
+    """
+    db_url = engine.url.render_as_string(hide_password=False)
+    ranges = _split_file_(file_path, workers)
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS account_status_idx"))
+    try:
+        if len(ranges) > 1:
+            with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+                futures = [pool.submit(_copy_accounts_, db_url, file_path, start, end) for start, end in ranges]
+                count = sum(future.result() for future in futures)
+        else:
+            count = sum(_copy_accounts_(db_url, file_path, start, end) for start, end in ranges)
+    except Exception:
+        try:
+            _create_account_status_idx_(engine)
+        except Exception as e:
+            print(f"Could not rebuild account_status_idx after the failed load: {str(e)}")
+        raise
+
+    _create_account_status_idx_(engine)
+    return count
+
+
+def _create_account_status_idx_(engine: Engine) -> None:
+    print("Building account_status_idx")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE UNIQUE INDEX account_status_idx ON casa_account (account_num, status)"))
+
+
+def executemany_load(engine: Engine, file_path: str, batch_size: int) -> int:
+    """load accounts with executemany, all batches in a single transaction"""
+    now_dt = datetime.now()
+    stmt = insert(Account.__table__)
+    count = 0
+    with engine.begin() as conn:
+        for batch in _read_csv_(file_path, batch_size):
+            conn.execute(
+                stmt,
+                [
+                    {
+                        "account_num": row["account_num"],
+                        "currency": row["currency"],
+                        "balance": row["balance"],
+                        "avail_balance": row["balance"],
+                        "status": StatusEnum.ACTIVE.name,
+                        "updated_at": now_dt,
+                    }
+                    for row in batch
+                ],
+            )
+            count += len(batch)
+    return count
+
+
 def _truncate_tables_(session):
+    if session.get_bind().dialect.name == "sqlite":
+        for table in ["casa_transaction", "casa_account", "casa_transfer"]:
+            session.execute(text(f"delete from {table}"))
+        session.commit()
+        return
+
     session.execute(text("truncate casa_transaction cascade"))
     session.execute(text("truncate casa_account cascade"))
     session.execute(text("truncate casa_transfer"))
+    session.commit()
 
 
-def _gen_random_account_num_(count: int, digits: int) -> list[int]:
-    unique_numbers: set[int] = set()
-
-    lower_bound = 10 ** (digits - 1)
-    upper_bound = 10**digits - 1
-
-    while len(unique_numbers) < count:
-        number = random.randint(lower_bound, upper_bound)
-        unique_numbers.add(number)
-
-    return list(unique_numbers)
-
+def _account_num_permutation_(digits: int, seed: int) -> Callable[[int], int]:
+    """
+    returns an affine permutation i -> lower + (a * i + b) mod size over all numbers with the given
+    number of digits. a is coprime with size, so distinct indexes map to distinct numbers and
+    no bookkeeping is needed to keep them unique.
+    """
+    lower = 10 ** (digits - 1)
+    size = 10**digits - lower
+    rng = random.Random(seed)
+    a = rng.randrange(size // 3, size)
+    while math.gcd(a, size) != 1:
+        a += 1
+    b = rng.randrange(size)
+    return lambda i: lower + (a * i + b) % size
+
+
+def _gen_random_account_num_(count: int, digits: int, start: int = 1, seed: int = 1) -> Iterator[int]:
+    permutation = _account_num_permutation_(digits, seed)
+    for i in range(start - 1, start - 1 + count):
+        yield permutation(i)
+
+
+def _cents_(value: int) -> str:
+    sign = "-" if value < 0 else ""
+    value = abs(value)
+    return f"{sign}{value // 100}.{value % 100:02d}"
+
+
+def _gen_history_chunk_(
+    out_dir: str,
+    chunk: int,
+    lo: int,
+    hi: int,
+    seed: int,
+    rows_per_account: float,
+    skew: float,
+    days: int,
+) -> dict[str, int]:
+    """
+    generate accounts with global indexes [lo, hi) and their history, written to one file per table.
+    every account gets an opening deposit, followed by transfers between accounts of the same chunk
+    applied in date order, so running balances are consistent and end at the account balance.
+    account ids are index + 1, so the accounts must be loaded into an empty casa_account,
+    transactions and transfers leave id to the database.
+    """
+    rng = random.Random(f"{seed}-{chunk}")
+    permutation = _account_num_permutation_(9, seed)
+    n = hi - lo
+    nums = [f"A{permutation(i):09}" for i in range(lo, hi)]
+    balances = [int(rng.choice(__BALANCE_BUCKETS__) * 100) for _ in range(n)]
+    # zipf activity, account order is already random because of the permutation
+    cum_weights = list(itertools.accumulate(1.0 / (k**skew) for k in range(1, n + 1)))
+    first_day = date.today() - timedelta(days=days - 1)
+    counts = {"casa_account": n, "casa_transaction": n, "casa_transfer": 0}
+
+    files = {table: open(os.path.join(out_dir, f"{table}.{chunk:05}.csv"), "w", newline="") for table in counts}
+    try:
+        writers = {table: csv.writer(f) for table, f in files.items()}
+        for writer, columns in zip(writers.values(), __HISTORY_COLUMNS__.values()):
+            writer.writerow(columns)
+
+        def pick() -> int:
+            return bisect.bisect(cum_weights, rng.random() * cum_weights[-1])
+
+        opened_at = f"{first_day.isoformat()} 00:00:00"
+        for i in range(n):
+            # not a transfer, reconcile recognizes it by the prefix
+            ref_id = f"{OPENING_TRX_PREFIX}{lo + i:010}"
+            amount = _cents_(balances[i])
+            writers["casa_transaction"].writerow(
+                [
+                    lo + i + 1,
+                    first_day.isoformat(),
+                    "USD",
+                    amount,
+                    amount,
+                    ref_id,
+                    ref_id,
+                    "opening deposit",
+                    True,
+                    opened_at,
+                ]
+            )
 
-def get_sessionmaker():
+        total = int(n * rows_per_account / 2) if n > 1 else 0
+        seq = 0
+        for day in range(days):
+            trx_date = (first_day + timedelta(days=day)).isoformat()
+            per_day = total // days + (1 if day < total % days else 0)
+            for j in range(per_day):
+                debit, credit = pick(), pick()
+                if debit == credit or balances[debit] == 0:
+                    continue
+
+                seq += 1
+                trx_id, ref_id = f"H{lo:010}{seq:09}", f"R{lo:010}{seq:09}"
+                amount = rng.randint(1, max(1, balances[debit] // 5))
+                balances[debit] -= amount
+                balances[credit] += amount
+                second = j * 86400 // per_day
+                created_at = f"{trx_date} {second // 3600:02}:{second // 60 % 60:02}:{second % 60:02}"
+                writers["casa_transfer"].writerow(
+                    [
+                        trx_id,
+                        trx_date,
+                        ref_id,
+                        "USD",
+                        _cents_(amount),
+                        "transfer",
+                        nums[debit],
+                        nums[credit],
+                        created_at,
+                    ]
+                )
+                writers["casa_transaction"].writerows(
+                    [
+                        [
+                            lo + debit + 1,
+                            trx_date,
+                            "USD",
+                            _cents_(-amount),
+                            _cents_(balances[debit]),
+                            ref_id,
+                            trx_id,
+                            "transfer",
+                            True,
+                            created_at,
+                        ],
+                        [
+                            lo + credit + 1,
+                            trx_date,
+                            "USD",
+                            _cents_(amount),
+                            _cents_(balances[credit]),
+                            ref_id,
+                            trx_id,
+                            f"from {nums[debit]}: transfer",
+                            True,
+                            created_at,
+                        ],
+                    ]
+                )
+
+        counts["casa_transfer"] = seq
+        counts["casa_transaction"] += seq * 2
+        updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for i in range(n):
+            balance = _cents_(balances[i])
+            writers["casa_account"].writerow([lo + i + 1, nums[i], "USD", balance, balance, "ACTIVE", updated_at])
+    finally:
+        for f in files.values():
+            f.close()
+
+    return counts
+
+
+def generate_history(out_dir: str, count: int, start: int, seed: int, workers: int, chunk_size: int, **kwargs) -> dict:
+    """
+    generate count accounts with transaction and transfer history into out_dir, one set of
+    csv files per chunk of accounts, chunks are generated in parallel by a process pool.
+    the files have a header row and can be loaded with COPY ... WITH (FORMAT csv, HEADER),
+    load.sql in out_dir loads them with psql and moves the sequence of casa_account past the ids.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    lo = start - 1
+    ranges = [(lo + i, min(lo + i + chunk_size, lo + count)) for i in range(0, count, chunk_size)]
+    chunks = list(range(lo // chunk_size, lo // chunk_size + len(ranges)))
+
+    totals: dict[str, int] = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_gen_history_chunk_, out_dir, chunk, chunk_lo, chunk_hi, seed, **kwargs)
+            for chunk, (chunk_lo, chunk_hi) in zip(chunks, ranges)
+        ]
+        for future in futures:
+            for table, rows in future.result().items():
+                totals[table] = totals.get(table, 0) + rows
+
+    _write_history_load_script_(out_dir, chunks)
+    return totals
+
+
+def _write_history_load_script_(out_dir: str, chunks: list[int]) -> None:
+    with open(os.path.join(out_dir, "load.sql"), "w") as f:
+        f.write("-- generated by seed.py --mode history, run with psql -f load.sql from this directory\n")
+        f.write("-- the account ids are set in the files, casa_account must be empty before the load\n")
+        for table, columns in __HISTORY_COLUMNS__.items():
+            for chunk in chunks:
+                f.write(
+                    f"\\copy {table} ({', '.join(columns)}) FROM '{table}.{chunk:05}.csv' WITH (FORMAT csv, HEADER)\n"
+                )
+        # the ids were not taken from the sequence, without this the next account inserted gets id 1
+        f.write("SELECT setval(pg_get_serial_sequence('casa_account', 'id'), (SELECT max(id) FROM casa_account));\n")
+
+
+def get_engine() -> Engine:
     db_url = os.environ.get("ALEMBIC_DATABASE_URL")
     if not db_url:
         db_url = os.environ.get("DATABASE_URL")
@@ -135,20 +519,55 @@ def get_sessionmaker():
     if not db_url:
         sys.exit("Database URL not found in environment variables")
 
-    engine = create_engine(db_url, echo=False)
-    return sessionmaker(bind=engine, autoflush=False, future=True)
+    return create_engine(db_url, echo=False)
+
+
+def get_sessionmaker(engine: Engine | None = None):
+    return sessionmaker(bind=engine or get_engine(), autoflush=False, future=True)
+
+
+def load(args) -> int:
+    engine = get_engine()
+    if args.truncate:
+        with get_sessionmaker(engine)() as session:
+            _truncate_tables_(session)
+
+    if args.loader == "fast" and engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg":
+        return copy_load(engine, args.source, int(args.workers))
+
+    if args.loader == "fast":
+        return executemany_load(engine, args.source, int(args.batch))
+
+    count = 0
+    with get_sessionmaker(engine)() as session:
+        for batch in _read_csv_(args.source, int(args.batch)):
+            count += _bulk_create_accounts_(session, batch)
+            print(f"Created {count} accounts")
+    return count
 
 
 if __name__ == "__main__":
     args = parse_command_line_options(sys.argv[1:])
     if args.mode == "gen":
-        generate_csv(args.source, int(args.count), int(args.start))
+        generate_csv(args.source, int(args.count), int(args.start), int(args.seed))
+    elif args.mode == "history":
+        start = time.perf_counter()
+        totals = generate_history(
+            args.source,
+            int(args.count),
+            int(args.start),
+            int(args.seed),
+            int(args.workers),
+            int(args.chunk_size),
+            rows_per_account=float(args.rows_per_account),
+            skew=float(args.skew),
+            days=int(args.days),
+        )
+        elapsed = time.perf_counter() - start
+        rows = sum(totals.values())
+        print(f"Generated {totals} in {args.source} in {elapsed:.2f}s, {rows / elapsed:.0f} rows/s")
     elif args.mode == "load":
-        with get_sessionmaker()() as session:
-            if args.truncate:
-                _truncate_tables_(session)
-
-            count = 0
-            for batch in _read_csv_(args.source, int(args.batch)):
-                count += _bulk_create_accounts_(session, batch)
-                print(f"Created {count} accounts")
+        start = time.perf_counter()
+        count = load(args)
+        elapsed = time.perf_counter() - start
+        print(f"Loaded {count} accounts in {elapsed:.2f}s, {count / elapsed:.0f} rows/s")
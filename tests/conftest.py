@@ -20,7 +20,7 @@ sys.path.insert(0, os.path.abspath(f"{cwd}/.."))
 
 # the following import only works after sys.path is updated
 from casa import models  # noqa
-from casa.api import db_session  # noqa
+from casa.api import db_read_session, db_read_sessionmaker, db_session, db_sessionmaker  # noqa
 from main import app  # noqa
 
 
@@ -99,6 +99,9 @@ async def testing_db_session() -> AsyncIterator[AsyncSession]:
 
 # overrides default dependency injection for testing
 app.dependency_overrides[db_session] = testing_db_session
+app.dependency_overrides[db_sessionmaker] = lambda: AsyncTestingSessionLocal
+app.dependency_overrides[db_read_session] = testing_db_session
+app.dependency_overrides[db_read_sessionmaker] = lambda: AsyncTestingSessionLocal
 
 
 # text fixtures
@@ -137,6 +140,11 @@ async def session():
         yield session
 
 
+@pytest.fixture()
+def session_factory():
+    return AsyncTestingSessionLocal
+
+
 @pytest.fixture(scope="session")
 async def client():
     async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
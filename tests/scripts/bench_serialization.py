@@ -0,0 +1,87 @@
+"""
+compare the cost of building and encoding an account or transfer response
+through model2schema and the response_model against the fast path in casa.responses
+
+    python tests/scripts/bench_serialization.py --count 100000
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+from decimal import Decimal
+
+cwd = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(f"{cwd}/../.."))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+from casa import models, responses, schemas, service  # noqa: E402
+
+
+def parse_command_line_options(args):
+    parser = argparse.ArgumentParser(description="Benchmark response serialization")
+    parser.add_argument("--count", dest="count", type=int, default=100000)
+    return parser.parse_args(args)
+
+
+def pydantic_path(model_obj, schema_cls):
+    """what a request does without the fast path: model2schema, then FastAPI validates and encodes the result"""
+    adapter = TypeAdapter(schema_cls)
+
+    def run():
+        result = service.model2schema(model_obj, schema_cls)
+        # fastapi.routing.serialize_response validates the return value against response_model again
+        content = adapter.dump_python(adapter.validate_python(result), mode="json")
+        return json.dumps(jsonable_encoder(content), separators=(",", ":")).encode()
+
+    return run
+
+
+def main(count: int) -> None:
+    now_dt = datetime.now()
+    account = models.Account(
+        account_num="A834666497",
+        currency="USD",
+        balance=Decimal("1000.00"),
+        avail_balance=Decimal("1000.00"),
+        status=models.StatusEnum.ACTIVE,
+        updated_at=now_dt,
+    )
+    row = tuple(getattr(account, column.key) for column in service.ACCOUNT_COLUMNS)
+    transfer = models.Transfer(
+        trx_id="01J0000000000000000000000",
+        ref_id="b0c8f1e5a4d34e6f9c1d2e3f4a5b6c7d",
+        trx_date=now_dt.strftime("%Y-%m-%d"),
+        currency="USD",
+        amount=15.00,
+        memo="bench",
+        debit_account_num="A834666497",
+        credit_account_num="A786432010",
+        created_at=now_dt,
+    )
+
+    cases = {
+        "account pydantic": pydantic_path(account, schemas.AccountSchema),
+        "account fast": lambda: responses.dumps(service.account_payload(row)),
+        "transfer pydantic": pydantic_path(transfer, schemas.TransferSchema),
+        "transfer fast": lambda: responses.dumps(service._transfer_result_(transfer, [])[0].model_dump()),
+    }
+
+    encoder = "orjson" if responses.orjson is not None else "json"
+    print(f"{count} iterations, fast path encoder: {encoder}")
+    timings = {}
+    for name, fn in cases.items():
+        timings[name] = min(timeit.repeat(fn, number=count, repeat=3)) / count * 1_000_000
+        print(f"{name:<20} {timings[name]:8.2f} us/op")
+
+    for kind in ["account", "transfer"]:
+        saved = timings[f"{kind} pydantic"] - timings[f"{kind} fast"]
+        print(f"{kind} saving: {saved:.2f} us/request ({saved / timings[f'{kind} pydantic'] * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main(parse_command_line_options(sys.argv[1:]).count)
@@ -0,0 +1,82 @@
+"""
+compare the throughput and latency of the transfer engines in casa.service
+against the database in DATABASE_URL, without going through HTTP
+
+    python tests/scripts/bench_transfer.py --debit A834666497 --credit A786432010 --count 2000 --concurrency 10
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+from uuid import uuid4
+
+cwd = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(f"{cwd}/../.."))
+
+from casa import config, schemas, service  # noqa: E402
+from database import SessionLocal  # noqa: E402
+
+
+def parse_command_line_options(args):
+    parser = argparse.ArgumentParser(description="Benchmark transfer engines")
+    parser.add_argument("--debit", dest="debit", required=True)
+    parser.add_argument("--credit", dest="credit", required=True)
+    parser.add_argument("--count", dest="count", type=int, default=1000)
+    parser.add_argument("--concurrency", dest="concurrency", type=int, default=10)
+    parser.add_argument("--engines", dest="engines", default="orm,core")
+    return parser.parse_args(args)
+
+
+async def run_engine(engine: str, debit: str, credit: str, count: int, concurrency: int) -> dict:
+    config.TRANSFER_ENGINE = engine
+    latencies: list[float] = []
+    errors = 0
+    remaining = iter(range(count))
+
+    async def worker(n: int):
+        nonlocal errors
+        for i in remaining:
+            # alternate the direction so that balances do not drift
+            from_account, to_account = (debit, credit) if (i + n) % 2 == 0 else (credit, debit)
+            req = schemas.TransferSchema(
+                ref_id=uuid4().hex,
+                trx_date=datetime.now().strftime("%Y-%m-%d"),
+                debit_account_num=from_account,
+                credit_account_num=to_account,
+                currency="USD",
+                amount=0.01,
+                memo=f"bench {engine}",
+            )
+            start = time.perf_counter()
+            try:
+                async with SessionLocal() as session:
+                    await service.transfer(session, req)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(n) for n in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "engine": engine,
+        "count": count,
+        "errors": errors,
+        "tps": round(count / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+    }
+
+
+async def main(args):
+    for engine in args.engines.split(","):
+        print(await run_engine(engine, args.debit, args.credit, args.count, args.concurrency))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_command_line_options(sys.argv[1:])))
@@ -0,0 +1,224 @@
+"""
+async load generator for the casa api
+
+accounts are read from a csv file generated by seed.py. requests are a mix of transfers and
+balance enquiries, sent either open-loop at a target rate or closed-loop by N concurrent clients.
+a json report with throughput, error mix and latency percentiles is printed at the end.
+
+    # 200 transfers/enquiries per second for 60 seconds, 80% enquiries, zipf distributed accounts
+    python tests/scripts/loadgen.py --accounts accounts.csv --rps 200 --duration 60 --read-ratio 0.8 --dist zipf
+
+    # 50 concurrent clients hammering 2 hot accounts
+    python tests/scripts/loadgen.py --accounts accounts.csv --clients 50 --duration 30 --dist hot-pair
+"""
+
+import argparse
+import asyncio
+import bisect
+import csv
+import itertools
+import json
+import math
+import random
+import sys
+import time
+from collections import Counter
+
+import httpx
+from req1 import payload
+
+
+def parse_command_line_options(args):
+    parser = argparse.ArgumentParser(description="Load generator for the casa api")
+    parser.add_argument("--url", dest="url", default="http://localhost:8000")
+    parser.add_argument("--accounts", dest="accounts", required=True, help="csv file generated by seed.py")
+    parser.add_argument("--dist", dest="dist", default="uniform", choices=["uniform", "zipf", "hot-pair"])
+    parser.add_argument("--zipf-s", dest="zipf_s", type=float, default=1.1, help="zipf exponent")
+    parser.add_argument("--hot-ratio", dest="hot_ratio", type=float, default=0.5, help="share of hot-pair requests")
+    parser.add_argument("--read-ratio", dest="read_ratio", type=float, default=0.0, help="share of enquiries")
+    parser.add_argument("--amount", dest="amount", type=float, default=0.01)
+    parser.add_argument("--duration", dest="duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--rps", dest="rps", type=float, default=0.0, help="open-loop target rate")
+    parser.add_argument("--clients", dest="clients", type=int, default=10, help="closed-loop concurrency")
+    parser.add_argument("--max-inflight", dest="max_inflight", type=int, default=1000)
+    parser.add_argument("--timeout", dest="timeout", type=float, default=30.0)
+    parser.add_argument("--seed", dest="seed", type=int, default=None)
+    parser.add_argument("--output", dest="output", default="-")
+    return parser.parse_args(args)
+
+
+def read_accounts(file_path: str) -> list[str]:
+    with open(file_path, "r") as csv_f:
+        return [row["account_num"] for row in csv.DictReader(csv_f)]
+
+
+class AccountPicker:
+    """picks a pair of distinct accounts according to a distribution"""
+
+    def __init__(self, accounts: list[str], dist: str, zipf_s: float, hot_ratio: float):
+        if len(accounts) < 2:
+            raise ValueError("at least 2 accounts are needed")
+
+        self.accounts = accounts
+        self.dist = dist
+        self.hot_ratio = hot_ratio
+        self.cum_weights: list[float] = []
+        if dist == "zipf":
+            # rank 1 is the first account in the file, which seed.py writes in random order
+            self.cum_weights = list(itertools.accumulate(1.0 / (k**zipf_s) for k in range(1, len(accounts) + 1)))
+
+    def one(self) -> str:
+        if self.dist == "zipf":
+            x = random.random() * self.cum_weights[-1]
+            return self.accounts[bisect.bisect(self.cum_weights, x)]
+        return random.choice(self.accounts)
+
+    def pair(self) -> tuple[str, str]:
+        if self.dist == "hot-pair" and random.random() < self.hot_ratio:
+            hot = self.accounts[:2]
+            random.shuffle(hot)
+            return hot[0], hot[1]
+
+        first = self.one()
+        second = self.one()
+        while second == first:
+            second = self.one()
+        return first, second
+
+
+class LatencyHistogram:
+    """
+    log-linear histogram in the spirit of HdrHistogram: values are recorded in microseconds
+    and rounded to 3 significant digits, so memory stays bounded and percentiles are within 0.1%
+    """
+
+    def __init__(self):
+        self.counts: Counter[int] = Counter()
+        self.total = 0
+        self.max_us = 0
+
+    def record(self, seconds: float) -> None:
+        value = max(1, int(seconds * 1_000_000))
+        magnitude = 10 ** max(0, int(math.log10(value)) - 2)
+        self.counts[value // magnitude * magnitude] += 1
+        self.total += 1
+        self.max_us = max(self.max_us, value)
+
+    def percentiles(self, points: list[float]) -> dict[str, float]:
+        result = {}
+        buckets = sorted(self.counts.items())
+        for p in points:
+            rank = math.ceil(self.total * p / 100)
+            seen = 0
+            for value, count in buckets:
+                seen += count
+                if seen >= rank:
+                    result[f"p{p:g}"] = value / 1000
+                    break
+        result["max"] = self.max_us / 1000
+        return result
+
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.picker = AccountPicker(read_accounts(args.accounts), args.dist, args.zipf_s, args.hot_ratio)
+        self.histograms = {"transfer": LatencyHistogram(), "enquiry": LatencyHistogram()}
+        self.outcomes: Counter[str] = Counter()
+        self.inflight = 0
+
+    async def request(self, client: httpx.AsyncClient, intended_start: float) -> None:
+        """send one request, latency is measured from intended_start to account for queueing in open-loop mode"""
+        if random.random() < self.args.read_ratio:
+            kind = "enquiry"
+            send = client.get(f"/api/casa/accounts/{self.picker.one()}")
+        else:
+            kind = "transfer"
+            debit, credit = self.picker.pair()
+            send = client.post("/api/casa/transfers", json=payload(debit, credit, self.args.amount, "loadgen"))
+
+        self.inflight += 1
+        try:
+            response = await send
+            outcome = f"{kind}:{response.status_code}"
+        except httpx.HTTPError as e:
+            outcome = f"{kind}:{type(e).__name__}"
+        finally:
+            self.inflight -= 1
+
+        self.histograms[kind].record(time.perf_counter() - intended_start)
+        self.outcomes[outcome] += 1
+
+    async def open_loop(self, client: httpx.AsyncClient, deadline: float) -> None:
+        interval = 1.0 / self.args.rps
+        tasks = set()
+        next_start = time.perf_counter()
+        while next_start < deadline:
+            delay = next_start - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if self.inflight >= self.args.max_inflight:
+                self.outcomes["dropped"] += 1
+            else:
+                task = asyncio.create_task(self.request(client, next_start))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # poisson arrivals, like independent clients
+            next_start += random.expovariate(1.0 / interval)
+
+        await asyncio.gather(*tasks)
+
+    async def closed_loop(self, client: httpx.AsyncClient, deadline: float) -> None:
+        async def worker():
+            while time.perf_counter() < deadline:
+                await self.request(client, time.perf_counter())
+
+        await asyncio.gather(*[worker() for _ in range(self.args.clients)])
+
+    async def run(self) -> dict:
+        limits = httpx.Limits(max_connections=self.args.max_inflight, max_keepalive_connections=self.args.max_inflight)
+        async with httpx.AsyncClient(base_url=self.args.url, timeout=self.args.timeout, limits=limits) as client:
+            start = time.perf_counter()
+            deadline = start + self.args.duration
+            if self.args.rps > 0:
+                await self.open_loop(client, deadline)
+            else:
+                await self.closed_loop(client, deadline)
+            elapsed = time.perf_counter() - start
+
+        completed = sum(h.total for h in self.histograms.values())
+        return {
+            "config": {
+                "url": self.args.url,
+                "mode": "open" if self.args.rps > 0 else "closed",
+                "rps": self.args.rps,
+                "clients": self.args.clients,
+                "dist": self.args.dist,
+                "read_ratio": self.args.read_ratio,
+                "duration": self.args.duration,
+            },
+            "elapsed_seconds": round(elapsed, 3),
+            "requests": completed,
+            "throughput_rps": round(completed / elapsed, 1),
+            "outcomes": dict(sorted(self.outcomes.items())),
+            "latency_ms": {
+                kind: histogram.percentiles([50, 90, 99, 99.9])
+                for kind, histogram in self.histograms.items()
+                if histogram.total
+            },
+        }
+
+
+if __name__ == "__main__":
+    args = parse_command_line_options(sys.argv[1:])
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    report = asyncio.run(LoadGenerator(args).run())
+    output = json.dumps(report, indent=4)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output)
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from casa import admission
+
+
+async def test_admission_queue_and_priority():
+    controller = admission.AdmissionController(limit=1, queue_size=2, timeout=1.0)
+    await controller.acquire("enquiry")
+    assert controller.inflight == 1
+
+    order = []
+
+    async def request(route_class):
+        await controller.acquire(route_class)
+        order.append(route_class)
+
+    enquiry = asyncio.create_task(request("enquiry"))
+    shed = asyncio.create_task(request("enquiry"))
+    await asyncio.sleep(0)
+    assert controller.depth == 2
+
+    # the queue is full, an enquiry is rejected, a transfer takes the place of the last enquiry
+    with pytest.raises(admission.AdmissionRejected, match="queue_full"):
+        await controller.acquire("enquiry")
+    transfer = asyncio.create_task(request("transfer"))
+    await asyncio.sleep(0)
+    with pytest.raises(admission.AdmissionRejected, match="shed"):
+        await shed
+
+    controller.release()
+    await transfer
+    controller.release()
+    await enquiry
+    assert order == ["transfer", "enquiry"]
+    controller.release()
+    assert controller.inflight == 0 and controller.depth == 0
+
+
+async def test_admission_timeout():
+    controller = admission.AdmissionController(limit=1, queue_size=1, timeout=0.01)
+    await controller.acquire("transfer")
+    with pytest.raises(admission.AdmissionRejected, match="timeout"):
+        await controller.acquire("transfer")
+    assert controller.depth == 0
+    controller.release()
+    assert controller.inflight == 0
+
+
+async def test_admission_slot_handed_over_at_deadline(monkeypatch):
+    controller = admission.AdmissionController(limit=1, queue_size=1, timeout=0.01)
+    await controller.acquire("transfer")
+
+    async def handed_over_at_deadline(future, timeout):
+        # the slot is released in the same iteration of the loop as the deadline
+        controller.release()
+        raise asyncio.TimeoutError()
+
+    monkeypatch.setattr(admission.asyncio, "wait_for", handed_over_at_deadline)
+    await controller.acquire("transfer")
+    assert controller.inflight == 1 and controller.depth == 0
+    controller.release()
+    assert controller.inflight == 0
+
+
+async def test_admission_rejects_with_503(client, monkeypatch):
+    monkeypatch.setattr(admission, "controller", admission.AdmissionController(limit=0, queue_size=0, timeout=1.0))
+
+    response = await client.get("/api/casa/accounts/1234567890")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert admission.rejected_counter.value(route="enquiry", reason="queue_full") >= 1
+
+    monkeypatch.setattr(admission, "controller", admission.AdmissionController(limit=1, queue_size=0, timeout=1.0))
+    assert (await client.get("/api/casa/accounts/1234567890")).status_code == 200
+    assert admission.controller.inflight == 0
@@ -1,7 +1,13 @@
-from datetime import datetime
+import json
+from datetime import date, datetime, timedelta
 from uuid import uuid4
 
-from casa import models
+import pytest
+from sqlalchemy import select
+
+from casa import models, schemas
+from casa.cache import LRUCache
+from casa.eod import snapshot_balances
 
 
 async def test_get_account_details(client):
@@ -32,7 +38,8 @@ async def test_transfer_success(client, mocker):
     assert response.status_code == 201
     assert response.json()["ref_id"] != ""
 
-    mock.assert_called_once()
+    # published in the request, through the event pipeline when it is running
+    mock.assert_awaited_once()
     args, _ = mock.call_args
     assert len(args[0]) == 2
     assert issubclass(models.Transaction, args[0][0][0])
@@ -41,6 +48,7 @@ async def test_transfer_success(client, mocker):
 async def test_transfer_with_bad_account(client):
     # payload with all required fields but invalid account number
     payload = {
+        "ref_id": uuid4().hex,
         "trx_date": "2021-01-02",
         "debit_account_num": "0987654321",
         "credit_account_num": "bad_account",
@@ -52,6 +60,10 @@ async def test_transfer_with_bad_account(client):
     response = await client.post("/api/casa/transfers", json=payload)
     assert response.status_code == 422
 
+    response = await client.get("/metrics")
+    assert 'casa_validation_failures_total{endpoint="transfer",reason="invalid_account"}' in response.text
+    assert 'casa_stage_seconds_count{stage="lock_wait"}' in response.text
+
 
 async def test_transfer_invalid_request(client):
     # payload incomplete, trx_date is required field but not supplied
@@ -65,3 +77,270 @@ async def test_transfer_invalid_request(client):
 
     response = await client.post("/api/casa/transfers", json=payload)
     assert response.status_code == 422
+
+
+async def test_transfer_bad_trx_date(client):
+    payload = {
+        "ref_id": uuid4().hex,
+        "debit_account_num": "1234567890",
+        "credit_account_num": "0987654321",
+        "currency": "USD",
+        "amount": 15.00,
+        "memo": "test transfer",
+    }
+    for trx_date in ["02/01/2021", "2021-1-2", "2021-02-30"]:
+        response = await client.post("/api/casa/transfers", json={**payload, "trx_date": trx_date})
+        assert response.status_code == 422, trx_date
+
+
+def batch_payload(mode: str, amounts: list[float]) -> dict:
+    return {
+        "mode": mode,
+        "transfers": [
+            {
+                "ref_id": uuid4().hex,
+                "trx_date": datetime.now().strftime("%Y-%m-%d"),
+                "debit_account_num": "1234567890",
+                "credit_account_num": "0987654321",
+                "currency": "USD",
+                "amount": amount,
+                "memo": "batch transfer",
+            }
+            for amount in amounts
+        ],
+    }
+
+
+async def test_transfer_batch_best_effort(client, mocker):
+    mocker.patch("casa.api.service.publish_events")
+
+    response = await client.post(
+        "/api/casa/transfers/batch", json=batch_payload("best_effort", [1.00, 1000000.00, 2.00])
+    )
+    assert response.status_code == 200
+
+    body = response.json()
+    assert body["committed"] == 2
+    assert body["rejected"] == 1
+    assert [item["status"] for item in body["results"]] == ["ok", "rejected", "ok"]
+    assert body["results"][0]["transfer"]["trx_id"]
+
+
+async def test_transfer_batch_atomic(client):
+    before = (await client.get("/api/casa/accounts/1234567890")).json()
+
+    response = await client.post("/api/casa/transfers/batch", json=batch_payload("atomic", [1.00, 1000000.00]))
+    assert response.status_code == 200
+
+    body = response.json()
+    assert body["committed"] == 0
+    assert [item["status"] for item in body["results"]] == ["rejected", "rejected"]
+
+    after = (await client.get("/api/casa/accounts/1234567890")).json()
+    assert after["balance"] == before["balance"]
+
+
+async def test_transfer_core_engine(client, mocker):
+    mocker.patch("casa.service.config.TRANSFER_ENGINE", "core")
+    mock = mocker.patch("casa.api.service.publish_events")
+
+    before = (await client.get("/api/casa/accounts/0987654321")).json()
+
+    payload = {
+        "ref_id": uuid4().hex,
+        "trx_date": datetime.now().strftime("%Y-%m-%d"),
+        "debit_account_num": "0987654321",
+        "credit_account_num": "1234567890",
+        "currency": "USD",
+        "amount": 5.00,
+        "memo": "core transfer",
+    }
+    response = await client.post("/api/casa/transfers", json=payload)
+    assert response.status_code == 201
+    assert response.json()["trx_id"]
+    assert len(mock.call_args[0][0]) == 2
+
+    after = (await client.get("/api/casa/accounts/0987654321")).json()
+    assert after["balance"] == before["balance"] - 5.00
+
+    payload["ref_id"] = uuid4().hex
+    payload["amount"] = 1000000.00
+    response = await client.post("/api/casa/transfers", json=payload)
+    assert response.status_code == 422
+    assert "Insufficient funds" in response.json()["detail"]
+
+    payload["ref_id"] = uuid4().hex
+    payload["credit_account_num"] = "bad_account"
+    payload["amount"] = 1.00
+    response = await client.post("/api/casa/transfers", json=payload)
+    assert response.status_code == 422
+    assert (await client.get("/api/casa/accounts/0987654321")).json()["balance"] == after["balance"]
+
+
+async def test_transfer_replay(client, mocker):
+    payload = {
+        "ref_id": uuid4().hex,
+        "trx_date": datetime.now().strftime("%Y-%m-%d"),
+        "debit_account_num": "1234567890",
+        "credit_account_num": "0987654321",
+        "currency": "USD",
+        "amount": 3.00,
+        "memo": "retried transfer",
+    }
+    mock = mocker.patch("casa.api.service.publish_events")
+
+    response = await client.post("/api/casa/transfers", json=payload)
+    assert response.status_code == 201
+    before = (await client.get("/api/casa/accounts/1234567890")).json()
+
+    # replayed from the in-process cache
+    replay = await client.post("/api/casa/transfers", json=payload)
+    assert replay.status_code == 201
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json()["trx_id"] == response.json()["trx_id"]
+
+    # replayed from the database after the unique index rejects the insert
+    mocker.patch("casa.service.completed_transfers.get", return_value=None)
+    replay = await client.post("/api/casa/transfers", json=payload)
+    assert replay.status_code == 201
+    assert replay.json()["trx_id"] == response.json()["trx_id"]
+
+    after = (await client.get("/api/casa/accounts/1234567890")).json()
+    assert after["balance"] == before["balance"]
+    mock.assert_called_once()
+
+    payload["amount"] = 4.00
+    response = await client.post("/api/casa/transfers", json=payload)
+    assert response.status_code == 422
+
+
+async def test_get_account_details_cached(client, mocker):
+    mocker.patch("casa.service.account_cache", LRUCache(100, ttl=60))
+
+    response = await client.get("/api/casa/accounts/1234567890")
+    assert response.headers["Cache-Status"] == "core-sim; fwd=miss"
+
+    response = await client.get("/api/casa/accounts/1234567890")
+    assert response.headers["Cache-Status"] == "core-sim; hit"
+    balance = response.json()["balance"]
+
+    payload = {
+        "ref_id": uuid4().hex,
+        "trx_date": datetime.now().strftime("%Y-%m-%d"),
+        "debit_account_num": "1234567890",
+        "credit_account_num": "0987654321",
+        "currency": "USD",
+        "amount": 2.00,
+        "memo": "invalidate cache",
+    }
+    response = await client.post("/api/casa/transfers", json=payload)
+    assert response.status_code == 201
+
+    response = await client.get("/api/casa/accounts/1234567890")
+    assert response.headers["Cache-Status"] == "core-sim; fwd=miss"
+    assert response.json()["balance"] == balance - 2.00
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert "casa_account_cache_hits_total 1" in response.text
+
+
+async def test_get_transactions_pagination(client):
+    url = "/api/casa/accounts/1234567890/transactions"
+    all_items = (await client.get(url, params={"limit": 500})).json()["items"]
+    assert len(all_items) >= 3
+    keys = [(item["trx_date"], item["created_at"]) for item in all_items]
+    assert keys == sorted(keys, reverse=True)
+
+    paged_items = []
+    params = {"limit": 2}
+    while True:
+        response = await client.get(url, params=params)
+        assert response.status_code == 200
+        page = response.json()
+        paged_items.extend(page["items"])
+        if not page["next_cursor"]:
+            break
+        params["cursor"] = page["next_cursor"]
+
+    assert paged_items == all_items
+
+
+async def test_get_transactions_filters(client):
+    url = "/api/casa/accounts/1234567890/transactions"
+    response = await client.get(url, params={"from_date": "2000-01-01", "to_date": "2000-12-31"})
+    assert response.status_code == 200
+    assert response.json() == {"items": [], "next_cursor": None}
+
+    assert (await client.get(url, params={"cursor": "garbage"})).status_code == 422
+    assert (await client.get(url, params={"from_date": "yesterday"})).status_code == 422
+    assert (await client.get("/api/casa/accounts/bad_account/transactions")).status_code == 404
+
+
+async def test_export_transactions(client):
+    history = (await client.get("/api/casa/accounts/1234567890/transactions", params={"limit": 500})).json()
+
+    response = await client.get("/api/casa/transactions/export", params={"account_num": "1234567890"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == len(history["items"])
+    assert {row["account_num"] for row in rows} == {"1234567890"}
+
+    response = await client.get("/api/casa/transactions/export", params={"from_date": "2000-01-01", "format": "csv"})
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert lines[0].startswith("id,account_num,")
+    assert len(lines) > len(rows)
+
+    assert (await client.get("/api/casa/transactions/export")).status_code == 422
+    assert (await client.get("/api/casa/transactions/export", params={"account_num": "bad"})).status_code == 404
+
+
+async def test_fast_response_matches_schema(client, session):
+    response = await client.get("/api/casa/accounts/1234567890")
+    assert response.status_code == 200
+
+    account = (await session.execute(select(models.Account).filter_by(account_num="1234567890"))).scalar_one()
+    expected = schemas.AccountSchema.model_validate(account).model_dump(mode="json")
+    assert response.json() == expected
+
+
+async def test_get_balance_as_of(client, session_factory):
+    today = date.today()
+    yesterday = (today - timedelta(days=1)).isoformat()
+    url = "/api/casa/accounts/1234567890/balance"
+    current = (await client.get("/api/casa/accounts/1234567890")).json()["balance"]
+    postings_today = sum(
+        item["amount"]
+        for item in (await client.get("/api/casa/accounts/1234567890/transactions", params={"limit": 500})).json()[
+            "items"
+        ]
+        if item["trx_date"] == today.isoformat()
+    )
+
+    # no snapshot yet, computed back from the current balance
+    response = await client.get(url, params={"as_of": "2000-01-01"})
+    assert response.status_code == 200
+    assert response.json()["snapshot_date"] is None
+
+    assert await snapshot_balances(session_factory, yesterday, chunk_size=1) >= 2
+    # running the job again replaces the snapshots
+    assert await snapshot_balances(session_factory, yesterday) >= 2
+
+    response = await client.get(url, params={"as_of": yesterday})
+    assert response.status_code == 200
+    assert response.json()["snapshot_date"] == yesterday
+    assert response.json()["balance"] == pytest.approx(current - postings_today)
+
+    response = await client.get(url, params={"as_of": today.isoformat()})
+    assert response.json() == {
+        "account_num": "1234567890",
+        "currency": "USD",
+        "as_of": today.isoformat(),
+        "balance": pytest.approx(current),
+        "snapshot_date": yesterday,
+    }
+
+    assert (await client.get(url, params={"as_of": "today"})).status_code == 422
+    assert (await client.get("/api/casa/accounts/bad_account/balance", params={"as_of": yesterday})).status_code == 404
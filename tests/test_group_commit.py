@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from casa import schemas, service
+from casa.group_commit import GroupCommitter
+
+
+def transfer_req(debit_account_num: str, credit_account_num: str, amount: float) -> schemas.TransferSchema:
+    return schemas.TransferSchema(
+        ref_id=uuid4().hex,
+        trx_date=datetime.now().strftime("%Y-%m-%d"),
+        debit_account_num=debit_account_num,
+        credit_account_num=credit_account_num,
+        currency="USD",
+        amount=amount,
+        memo="group commit",
+    )
+
+
+async def test_group_commit_resolves_each_request(session_factory):
+    committer = GroupCommitter(session_factory, window_ms=50, max_size=10)
+    await committer.start()
+
+    requests = [
+        transfer_req("1234567890", "0987654321", 1.00),
+        transfer_req("0987654321", "1234567890", 2.00),
+        transfer_req("1234567890", "bad_account", 1.00),
+        transfer_req("0987654321", "1234567890", 1000000.00),
+    ]
+    results = await asyncio.gather(*[committer.submit(req) for req in requests], return_exceptions=True)
+    await committer.stop()
+
+    for req, result in zip(requests[:2], results[:2]):
+        assert not isinstance(result, Exception)
+        transfer, events = result
+        assert transfer.ref_id == req.ref_id
+        assert transfer.trx_id
+        assert len(events) == 2
+
+    assert isinstance(results[2], service.ValidationError)
+    assert isinstance(results[3], service.ValidationError)
+    assert "Insufficient funds" in str(results[3])
+
+
+async def test_group_commit_not_started(session_factory):
+    committer = GroupCommitter(session_factory, window_ms=1, max_size=1)
+    with pytest.raises(RuntimeError):
+        await committer.submit(transfer_req("1234567890", "0987654321", 1.00))
+
+
+async def test_group_commit_one_by_one_after_integrity_error(session_factory, mocker):
+    committed = transfer_req("1234567890", "0987654321", 1.00)
+    async with session_factory() as session:
+        await service.transfer(session, committed)
+
+    # another worker committed a ref_id of the batch after the batch looked for replays
+    mocker.patch.object(
+        service, "transfer_batch", side_effect=IntegrityError("INSERT INTO casa_transfer", {}, Exception("unique"))
+    )
+    committer = GroupCommitter(session_factory, window_ms=50, max_size=10)
+    await committer.start()
+
+    requests = [transfer_req("0987654321", "1234567890", 1.00), committed, transfer_req("1234567890", "bad", 1.00)]
+    results = await asyncio.gather(*[committer.submit(req) for req in requests], return_exceptions=True)
+    await committer.stop()
+
+    assert len(results[0][1]) == 2
+    assert results[1][0].ref_id == committed.ref_id and results[1][1] == []
+    assert isinstance(results[2], service.ValidationError)
+
+
+async def test_group_commit_replay_from_cache(session_factory, mocker):
+    committer = GroupCommitter(session_factory, window_ms=1, max_size=10)
+    await committer.start()
+    req = transfer_req("1234567890", "0987654321", 1.00)
+    result, _ = await committer.submit(req)
+
+    transfer_batch = mocker.spy(service, "transfer_batch")
+    replay, events = await committer.submit(req)
+    await committer.stop()
+
+    assert replay.trx_id == result.trx_id
+    assert events == []
+    transfer_batch.assert_not_called()
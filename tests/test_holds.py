@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import func, select
+
+from casa import holds, models
+
+
+def hold_req(amount: float, **kwargs) -> dict:
+    return {
+        "ref_id": uuid4().hex,
+        "debit_account_num": "1234567890",
+        "credit_account_num": "0987654321",
+        "currency": "USD",
+        "amount": amount,
+        "memo": "card payment",
+        **kwargs,
+    }
+
+
+async def balances(client, account_num: str) -> tuple[float, float]:
+    account = (await client.get(f"/api/casa/accounts/{account_num}")).json()
+    return account["balance"], account["avail_balance"]
+
+
+async def test_hold_capture_and_settle(client, session_factory):
+    debit_before = await balances(client, "1234567890")
+    credit_before = await balances(client, "0987654321")
+
+    req = hold_req(100.00)
+    response = await client.post("/api/casa/holds", json=req)
+    assert response.status_code == 201
+    hold = response.json()
+    assert hold["status"] == "HELD"
+    # only avail_balance is reserved
+    assert await balances(client, "1234567890") == (debit_before[0], debit_before[1] - 100)
+
+    response = await client.post("/api/casa/holds", json=req)
+    assert response.status_code == 201
+    assert response.headers["Idempotent-Replayed"] == "true"
+    assert response.json()["hold_id"] == hold["hold_id"]
+
+    # a partial capture gives the rest back right away
+    response = await client.post(f"/api/casa/holds/{hold['hold_id']}/capture", json={"amount": 60.00})
+    assert response.status_code == 200
+    assert response.json()["status"] == "CAPTURED"
+    assert response.json()["captured_amount"] == 60.00
+    assert await balances(client, "1234567890") == (debit_before[0], debit_before[1] - 60)
+    assert (await client.post(f"/api/casa/holds/{hold['hold_id']}/release")).status_code == 422
+
+    async with session_factory() as session:
+        assert await holds.settle_captured(session, 100) == 1
+    async with session_factory() as session:
+        assert await holds.settle_captured(session, 100) == 0
+
+    assert await balances(client, "1234567890") == (debit_before[0] - 60, debit_before[1] - 60)
+    assert await balances(client, "0987654321") == (credit_before[0] + 60, credit_before[1] + 60)
+
+    settled = (await client.get(f"/api/casa/holds/{hold['hold_id']}")).json()
+    assert settled["status"] == "SETTLED"
+    async with session_factory() as session:
+        postings = await session.scalar(select(func.count()).filter(models.Transaction.trx_id == settled["trx_id"]))
+        assert postings == 2
+
+
+async def test_hold_release_and_expiry(client, session_factory):
+    debit_before = await balances(client, "1234567890")
+
+    hold = (await client.post("/api/casa/holds", json=hold_req(10.00))).json()
+    response = await client.post(f"/api/casa/holds/{hold['hold_id']}/release")
+    assert response.status_code == 200
+    assert response.json()["status"] == "RELEASED"
+    assert (await client.post(f"/api/casa/holds/{hold['hold_id']}/release")).status_code == 200
+    assert (await client.post(f"/api/casa/holds/{hold['hold_id']}/capture")).status_code == 422
+    assert await balances(client, "1234567890") == debit_before
+
+    hold = (await client.post("/api/casa/holds", json=hold_req(20.00, expires_in=60))).json()
+    async with session_factory() as session:
+        assert await holds.expire_holds(session, 100, datetime.now() + timedelta(seconds=120)) == 1
+    assert (await client.get(f"/api/casa/holds/{hold['hold_id']}")).json()["status"] == "EXPIRED"
+    assert await balances(client, "1234567890") == debit_before
+
+
+async def test_hold_invalid_requests(client):
+    response = await client.post("/api/casa/holds", json=hold_req(1000000.00))
+    assert response.status_code == 422
+    response = await client.post("/api/casa/holds", json=hold_req(1.00, credit_account_num="bad_account"))
+    assert response.status_code == 422
+    assert (await client.post("/api/casa/holds/missing/capture")).status_code == 404
+    assert (await client.get("/api/casa/holds/missing")).status_code == 404
+
+
+async def test_hold_settlement_refused_by_memory_backend(session_factory, monkeypatch):
+    monkeypatch.setattr(holds.config, "CASA_BACKEND", "memory")
+    with pytest.raises(RuntimeError, match="memory backend"):
+        await holds.start(session_factory, 10, 60)
+    assert holds.settler is None
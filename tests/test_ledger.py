@@ -0,0 +1,180 @@
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import delete, select
+
+from casa import models, schemas, service
+from casa.ledger import Journal, Ledger
+
+
+def transfer_req(debit_account_num: str, credit_account_num: str, amount: float) -> schemas.TransferSchema:
+    return schemas.TransferSchema(
+        ref_id=uuid4().hex,
+        trx_date=datetime.now().strftime("%Y-%m-%d"),
+        debit_account_num=debit_account_num,
+        credit_account_num=credit_account_num,
+        currency="USD",
+        amount=amount,
+        memo="ledger",
+    )
+
+
+async def crash(ledger: Ledger):
+    # stop the tasks without persisting or taking a snapshot
+    for task in ledger._tasks:
+        task.cancel()
+    await asyncio.gather(*ledger._tasks, return_exceptions=True)
+    await ledger._journal.stop()
+    for shard in ledger._shards:
+        await shard.stop()
+
+
+async def test_ledger_transfer_and_persist(session_factory, session, tmp_path):
+    ledger = Ledger(session_factory, str(tmp_path), shards=2, persist_interval=60)
+    await ledger.start()
+
+    before = await ledger.get_account_details("1234567890")
+    req = transfer_req("1234567890", "0987654321", 5.00)
+    result, events = await ledger.transfer(req)
+    assert result.trx_id
+    assert len(events) == 2
+
+    after = await ledger.get_account_details("1234567890")
+    assert after.balance == before.balance - 5.00
+
+    # not persisted yet, the events are built from the journal record like the outbox relay builds them
+    published = ledger.transaction_events({trx_pk for _, trx_pk in events})
+    assert [event["type"] for event in published] == ["casa.transaction", "casa.transaction"]
+    assert [event["account_num"] for event in published] == ["1234567890", "0987654321"]
+    assert published[0]["amount"] == "-5.00"
+
+    replay, replay_events = await ledger.transfer(req)
+    assert replay.trx_id == result.trx_id
+    assert replay_events == []
+    with pytest.raises(service.ValidationError, match="already been used"):
+        await ledger.transfer(req.model_copy(update={"amount": 6.00}))
+
+    with pytest.raises(service.ValidationError, match="Insufficient funds"):
+        await ledger.transfer(transfer_req("1234567890", "0987654321", 100000000.00))
+    with pytest.raises(service.ValidationError, match="Invalid"):
+        await ledger.transfer(transfer_req("1234567890", "bad_account", 1.00))
+
+    await ledger.stop()
+
+    account = await session.scalar(select(models.Account).filter(models.Account.account_num == "1234567890"))
+    assert float(account.balance) == after.balance
+    trx = await session.get(models.Transaction, events[0][1])
+    assert trx.trx_id == result.trx_id
+
+
+async def test_ledger_recovers_from_journal(session_factory, tmp_path):
+    ledger = Ledger(session_factory, str(tmp_path), shards=4, persist_interval=60)
+    await ledger.start()
+    before = await ledger.get_account_details("0987654321")
+    await ledger.transfer(transfer_req("1234567890", "0987654321", 2.00))
+    await ledger.transfer(transfer_req("1234567890", "0987654321", 3.00))
+    await crash(ledger)
+
+    recovered = Ledger(session_factory, str(tmp_path), shards=4, persist_interval=60)
+    await recovered.start()
+    assert (await recovered.get_account_details("0987654321")).balance == before.balance + 5.00
+    assert len(recovered._pending) == 2
+    await recovered.stop()
+
+    restarted = Ledger(session_factory, str(tmp_path), shards=4, persist_interval=60)
+    await restarted.start()
+    assert (await restarted.get_account_details("0987654321")).balance == before.balance + 5.00
+    assert restarted._pending == []
+    await restarted.stop()
+
+
+async def test_ledger_reverses_transfer_not_journaled(session_factory, tmp_path):
+    ledger = Ledger(session_factory, str(tmp_path), shards=2, persist_interval=60)
+    await ledger.start()
+    debit_before = await ledger.get_account_details("1234567890")
+    credit_before = await ledger.get_account_details("0987654321")
+
+    async def disk_full(record):
+        raise OSError("No space left on device")
+
+    append = ledger._journal.append
+    ledger._journal.append = disk_full
+    with pytest.raises(OSError):
+        await ledger.transfer(transfer_req("1234567890", "0987654321", 5.00))
+    ledger._journal.append = append
+
+    assert (await ledger.get_account_details("1234567890")).balance == debit_before.balance
+    assert (await ledger.get_account_details("0987654321")).balance == credit_before.balance
+    assert ledger._pending == []
+    await ledger.stop()
+
+
+async def test_ledger_rounds_amounts_to_cents(session_factory, tmp_path):
+    ledger = Ledger(session_factory, str(tmp_path), shards=2, persist_interval=60)
+    await ledger.start()
+    account = ledger._shard_("1234567890").accounts["1234567890"]
+    before = account.balance
+
+    # float 0.10 is slightly more than 0.10, repeated debits would leave the balance off by fractions of a cent
+    for _ in range(3):
+        await ledger.transfer(transfer_req("1234567890", "0987654321", 0.10))
+    assert account.balance == before - Decimal("0.30")
+    assert ledger._pending[-1]["amount"] == "0.10"
+    await ledger.stop()
+
+
+async def test_ledger_replays_transfers_in_database(session_factory, tmp_path):
+    ledger = Ledger(session_factory, str(tmp_path / "first"), shards=2, persist_interval=60)
+    await ledger.start()
+    req = transfer_req("1234567890", "0987654321", 1.00)
+    result, _ = await ledger.transfer(req)
+    await ledger.stop()
+
+    # a new ledger without the journal or the cache of the first one
+    ledger = Ledger(session_factory, str(tmp_path / "second"), shards=2, persist_interval=60)
+    await ledger.start()
+    before = await ledger.get_account_details("1234567890")
+    replay, events = await ledger.transfer(req)
+    assert replay.trx_id == result.trx_id
+    assert events == []
+    assert (await ledger.get_account_details("1234567890")).balance == before.balance
+    await ledger.stop()
+
+
+async def test_ledger_persists_batch_around_duplicate(session_factory, session, tmp_path):
+    ledger = Ledger(session_factory, str(tmp_path), shards=2, persist_interval=60)
+    await ledger.start()
+    duplicate = transfer_req("1234567890", "0987654321", 1.00)
+    await ledger.transfer(duplicate)
+    valid, _ = await ledger.transfer(transfer_req("0987654321", "1234567890", 2.00))
+
+    # the ref_id is written to the database behind the ledger's back
+    other = models.Transfer(
+        trx_id=uuid4().hex,
+        ref_id=duplicate.ref_id,
+        trx_date=duplicate.trx_date,
+        currency="USD",
+        amount=1.00,
+        memo="other writer",
+        debit_account_num="1234567890",
+        credit_account_num="0987654321",
+    )
+    session.add(other)
+    await session.commit()
+
+    try:
+        duplicate_seq = ledger._pending[0]["seq"]
+        assert await ledger.persist_once() == 2
+        assert await session.scalar(select(models.Transfer).filter_by(trx_id=valid.trx_id)) is not None
+        # the record that was not written stays in the journal and is still a replay
+        assert ledger._persisted_seq < duplicate_seq
+        assert duplicate.ref_id in ledger._unpersisted
+        assert Journal.segments(str(tmp_path))
+        await ledger.stop()
+        assert Journal.segments(str(tmp_path))
+    finally:
+        await session.execute(delete(models.Transfer).filter_by(trx_id=other.trx_id))
+        await session.commit()
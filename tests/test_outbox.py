@@ -0,0 +1,32 @@
+from sqlalchemy import func, select
+
+from casa import models
+from casa.events import MemorySink, create_sink
+from casa.outbox import OutboxRelay
+
+
+async def test_relay_publishes_and_marks_transactions(session_factory, session):
+    sink = MemorySink()
+    relay = OutboxRelay(session_factory, sink, batch_size=2)
+
+    while await relay.relay_once():
+        pass
+
+    assert relay.published == len(sink.events) > 0
+    assert len({event["id"] for event in sink.events}) == len(sink.events)
+    assert sink.events[0]["account_num"]
+
+    unpublished = await session.scalar(
+        select(func.count()).select_from(models.Transaction).filter(~models.Transaction.is_published)
+    )
+    assert unpublished == 0
+    assert await relay.relay_once() == 0
+
+
+async def test_file_sink(tmp_path):
+    assert isinstance(create_sink("memory:"), MemorySink)
+
+    sink = create_sink(f"file:{tmp_path}/events.ndjson")
+    await sink.publish([{"id": 1}, {"id": 2}])
+    await sink.close()
+    assert open(f"{tmp_path}/events.ndjson").read() == '{"id": 1}\n{"id": 2}\n'
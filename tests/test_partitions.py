@@ -0,0 +1,23 @@
+from datetime import date
+
+from casa import partitions
+
+
+def test_month_arithmetic():
+    assert partitions.add_months(date(2024, 11, 15), 1) == date(2024, 12, 1)
+    assert partitions.add_months(date(2024, 11, 15), 2) == date(2025, 1, 1)
+    assert partitions.add_months(date(2024, 1, 31), -1) == date(2023, 12, 1)
+    assert partitions.retention_cutoff(12, date(2024, 3, 10)) == date(2023, 4, 1)
+
+
+def test_partition_names():
+    name = partitions.partition_name(date(2024, 2, 1))
+    assert name == "casa_transaction_p202402"
+    assert partitions.partition_month(name) == date(2024, 2, 1)
+    assert partitions.partition_month("casa_transaction_default") is None
+    assert "FROM ('2024-02-01') TO ('2024-03-01')" in partitions.create_partition_sql(date(2024, 2, 1))
+
+
+async def test_create_partitions_noop_without_postgresql(session):
+    created = await session.run_sync(lambda s: partitions.create_partitions(s.connection(), date.today(), 3))
+    assert created == []
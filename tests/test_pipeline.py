@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime
+from uuid import uuid4
+
+from casa import pipeline, service
+from casa.events import MemorySink
+
+
+class RecordingSink(MemorySink):
+    """a memory sink that can be paused and made to fail"""
+
+    def __init__(self, failures: int = 0):
+        super().__init__()
+        self.batches: list[int] = []
+        self.failures = failures
+        self.open = asyncio.Event()
+        self.open.set()
+
+    async def publish(self, events):
+        await self.open.wait()
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("sink unavailable")
+        self.batches.append(len(events))
+        await super().publish(events)
+
+
+async def test_publish_in_batches():
+    sink = RecordingSink(failures=1)
+    publisher = pipeline.EventPublisher(sink, queue_size=100, batch_size=3, flush_ms=20)
+    await publisher.start()
+
+    assert await publisher.publish([{"id": i} for i in range(7)]) == 0
+    await publisher.stop()
+
+    # the failed batch was retried, nothing is lost or reordered
+    assert [event["id"] for event in sink.events] == list(range(7))
+    assert max(sink.batches) == 3
+    assert publisher.depth == 0
+
+
+async def test_backpressure_when_sink_is_slow():
+    sink = RecordingSink()
+    sink.open.clear()
+    publisher = pipeline.EventPublisher(sink, queue_size=2, batch_size=1, flush_ms=1, put_timeout=0.05)
+    await publisher.start()
+
+    dropped_before = pipeline.dropped_counter.value()
+    # one event is held by the stalled sink, two fill the queue, the rest wait and are dropped
+    assert await publisher.publish([{"id": i} for i in range(5)]) == 2
+    assert pipeline.dropped_counter.value() == dropped_before + 2
+    assert publisher.depth == 2
+
+    # a waiting producer gets in once the sink catches up
+    waiting = asyncio.create_task(publisher.publish([{"id": 5}]))
+    await asyncio.sleep(0.01)
+    sink.open.set()
+    assert await waiting == 0
+    await publisher.stop()
+    assert [event["id"] for event in sink.events] == [0, 1, 2, 5]
+
+
+async def test_transfer_events_go_through_pipeline(client, session_factory, monkeypatch):
+    sink = RecordingSink()
+    # the request only queues the ids, the publisher loads the postings
+    publisher = pipeline.EventPublisher(sink, flush_ms=1, sessionmaker=session_factory, load=service.transaction_events)
+    await publisher.start()
+    monkeypatch.setattr(pipeline, "publisher", publisher)
+
+    payload = {
+        "ref_id": uuid4().hex,
+        "trx_date": datetime.now().strftime("%Y-%m-%d"),
+        "debit_account_num": "0987654321",
+        "credit_account_num": "1234567890",
+        "currency": "USD",
+        "amount": 1.00,
+        "memo": "pipeline",
+    }
+    response = await client.post("/api/casa/transfers", json=payload)
+    assert response.status_code == 201
+    await publisher.stop()
+
+    # the same events as the outbox relay publishes
+    assert [event["type"] for event in sink.events] == ["casa.transaction", "casa.transaction"]
+    assert {event["account_num"] for event in sink.events} == {"0987654321", "1234567890"}
+    assert {event["amount"] for event in sink.events} == {"-1.00", "1.00"}
+    assert all(event["trx_id"] == response.json()["trx_id"] for event in sink.events)
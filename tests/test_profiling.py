@@ -0,0 +1,59 @@
+import os
+
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+import profiling
+
+
+def profiled_app(directory: str, **kwargs) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/work")
+    async def work():
+        return {"total": sum(i * i for i in range(10000))}
+
+    profiling.install(app, profiling.RequestProfiler(directory, **kwargs), admin_token="secret")
+    return app
+
+
+async def test_profile_on_header(tmp_path):
+    async with AsyncClient(app=profiled_app(str(tmp_path)), base_url="http://test") as client:
+        response = await client.get("/work")
+        assert response.status_code == 200
+        assert "X-Profile-Id" not in response.headers
+
+        response = await client.get("/work", headers={"X-Profile": "1"})
+        assert response.status_code == 200
+        profile_id = response.headers["X-Profile-Id"]
+        assert os.path.exists(tmp_path / f"{profile_id}.prof")
+
+        response = await client.get("/admin/profiles", params={"sort": "cumtime"})
+        assert response.status_code == 403
+        response = await client.get("/admin/profiles", params={"sort": "cumtime"}, headers={"X-Admin-Token": "wrong"})
+        assert response.status_code == 403
+
+        response = await client.get("/admin/profiles", params={"sort": "cumtime"}, headers={"X-Admin-Token": "secret"})
+        assert response.status_code == 200
+        top = response.json()
+        assert top["profiles"] == 1
+        assert top["functions"]
+        assert top["slowest"][0]["path"] == "/work"
+
+
+async def test_profile_sampling_keeps_last_profiles(tmp_path):
+    async with AsyncClient(app=profiled_app(str(tmp_path), sample_n=2, keep=2), base_url="http://test") as client:
+        for _ in range(8):
+            await client.get("/work")
+
+    profiler = profiling.RequestProfiler(str(tmp_path))
+    assert len(profiler.profiles()) == 2
+    assert [entry["trigger"] for entry in profiler.requests()] == ["sample", "sample"]
+
+
+async def test_profiles_route_needs_admin_token(tmp_path):
+    app = FastAPI()
+    profiling.install(app, profiling.RequestProfiler(str(tmp_path)))
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/admin/profiles", headers={"X-Admin-Token": ""})
+        assert response.status_code == 404
@@ -0,0 +1,66 @@
+import asyncio
+import shutil
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from casa import models
+from database import ReadRouter
+
+
+def sqlite_sessionmaker(path: str) -> async_sessionmaker[AsyncSession]:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    return async_sessionmaker(expire_on_commit=False, class_=AsyncSession, bind=engine)
+
+
+async def test_read_from_replica(session_factory, tmp_path):
+    primary_url = session_factory.kw["bind"].url
+    if primary_url.get_backend_name() != "sqlite":
+        pytest.skip("the replica is simulated with a copy of a sqlite test database")
+    db_path = primary_url.database
+
+    # a copy of the test database stands in for the replica
+    shutil.copy(db_path, tmp_path / "replica.db")
+    replica = sqlite_sessionmaker(str(tmp_path / "replica.db"))
+    router = ReadRouter(session_factory, replica)
+
+    assert await router.sessionmaker() is replica
+    async with replica() as session:
+        account = (await session.execute(select(models.Account).filter_by(account_num="1234567890"))).scalar_one()
+        assert account.currency == "USD"
+
+
+async def test_fallback_to_primary(session_factory, tmp_path, mocker):
+    router = ReadRouter(session_factory, sqlite_sessionmaker(str(tmp_path / "missing" / "replica.db")))
+    assert await router.sessionmaker() is session_factory
+    assert router.lag is None
+
+    replica = sqlite_sessionmaker(str(tmp_path / "replica.db"))
+    router = ReadRouter(session_factory, replica, max_lag=5.0, check_interval=0)
+    mocker.patch.object(router, "replica_lag", return_value=10.0)
+    assert await router.sessionmaker() is session_factory
+
+    mocker.patch.object(router, "replica_lag", return_value=1.0)
+    assert await router.sessionmaker() is replica
+
+
+async def test_slow_replica_does_not_hold_up_reads(session_factory, tmp_path, mocker):
+    replica = sqlite_sessionmaker(str(tmp_path / "replica.db"))
+    router = ReadRouter(session_factory, replica, check_interval=0, probe_timeout=0.01)
+
+    async def hangs():
+        await asyncio.sleep(10)
+
+    mocker.patch.object(router, "replica_lag", side_effect=hangs)
+    assert await asyncio.wait_for(router.sessionmaker(), 1.0) is session_factory
+    assert router.lag is None
+
+    # once started, requests only read the lag measured in the background
+    mocker.patch.object(router, "replica_lag", return_value=1.0)
+    router.check_interval = 60
+    await router.start()
+    probe = mocker.patch.object(router, "replica_lag", side_effect=hangs)
+    assert await router.sessionmaker() is replica
+    probe.assert_not_called()
+    await router.stop()
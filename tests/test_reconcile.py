@@ -0,0 +1,57 @@
+import json
+
+from sqlalchemy import select
+
+from casa import models
+from casa.reconcile import OPENING_TRX_PREFIX, Checkpoint, _transfer_discrepancies_, reconcile
+
+
+async def test_reconcile(session, session_factory, tmp_path):
+    # the seeded transfer credits both accounts and the seeded balances have no opening postings
+    seeded = (await session.execute(select(models.Transfer).filter_by(ref_id="CustomerSupplied"))).scalar_one()
+    report_path, checkpoint_path = tmp_path / "report.ndjson", tmp_path / "checkpoint"
+
+    stats: dict[str, float] = {}
+    with open(report_path, "w") as report:
+        checkpoint = Checkpoint(str(checkpoint_path))
+        found = await reconcile(session_factory, report, checkpoint, workers=3, chunk_size=1, stats=stats)
+        checkpoint.close()
+
+    rows = [json.loads(line) for line in report_path.read_text().splitlines()]
+    assert found == len(rows) == stats["discrepancies"]
+    assert {"1234567890", "0987654321"} <= {row["account_num"] for row in rows if row["check"] == "balance"}
+    unbalanced = [row for row in rows if row.get("trx_id") == seeded.trx_id]
+    assert unbalanced[0]["reason"] == "postings_unbalanced"
+    assert unbalanced[0]["postings"] == 2
+    assert stats["skipped"] == 0
+    assert len(checkpoint_path.read_text().splitlines()) == stats["units"]
+
+    # resuming a completed run does nothing
+    with open(report_path, "a") as report:
+        checkpoint = Checkpoint(str(checkpoint_path), resume=True)
+        assert await reconcile(session_factory, report, checkpoint, chunk_size=1, stats=stats) == 0
+        checkpoint.close()
+    assert stats["skipped"] == stats["units"]
+    assert len(report_path.read_text().splitlines()) == len(rows)
+
+
+async def test_opening_deposits_are_not_orphans(session):
+    account = (await session.execute(select(models.Account).filter_by(account_num="1234567890"))).scalar_one()
+    for trx_id in [f"{OPENING_TRX_PREFIX}0000000001", "NOTRANSFER"]:
+        session.add(
+            models.Transaction(
+                account_id=account.id,
+                trx_date="2000-01-01",
+                currency="USD",
+                amount=10.00,
+                running_balance=10.00,
+                ref_id=trx_id,
+                trx_id=trx_id,
+                memo="opening deposit",
+            )
+        )
+    await session.flush()
+
+    found = await _transfer_discrepancies_(session, "2000-01-01")
+    assert [(row["trx_id"], row["reason"]) for row in found] == [("NOTRANSFER", "orphan_postings")]
+    await session.rollback()
@@ -0,0 +1,57 @@
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from casa import retry
+
+
+class FakeDBError(Exception):
+    def __init__(self, sqlstate: str):
+        super().__init__(f"sqlstate {sqlstate}")
+        self.sqlstate = sqlstate
+
+
+def failing(errors: list[Exception]):
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return len(calls)
+
+    return fn
+
+
+async def test_retry_on_deadlock(mocker):
+    session = mocker.AsyncMock()
+    deadlocks = retry.deadlocks_counter.value()
+    retries = retry.retries_counter.value(reason="deadlock")
+
+    fn = failing([DBAPIError("UPDATE", {}, FakeDBError("40P01"))])
+    assert await retry.run_with_retry(session, fn) == 2
+
+    session.rollback.assert_awaited_once()
+    assert retry.deadlocks_counter.value() == deadlocks + 1
+    assert retry.retries_counter.value(reason="deadlock") == retries + 1
+
+
+async def test_retry_limit_and_budget(mocker):
+    session = mocker.AsyncMock()
+    mocker.patch("casa.retry.config.DB_RETRY_LIMIT", 1)
+
+    fn = failing([DBAPIError("UPDATE", {}, FakeDBError("40001")) for _ in range(2)])
+    with pytest.raises(retry.TransientError):
+        await retry.run_with_retry(session, fn)
+
+    mocker.patch("casa.retry.budget", retry.RetryBudget(ratio=0.1, max_tokens=0))
+    fn = failing([DBAPIError("UPDATE", {}, FakeDBError("40001"))])
+    with pytest.raises(retry.TransientError):
+        await retry.run_with_retry(session, fn)
+
+
+async def test_no_retry_on_other_errors(mocker):
+    session = mocker.AsyncMock()
+    fn = failing([DBAPIError("INSERT", {}, FakeDBError("23505"))])
+    with pytest.raises(DBAPIError):
+        await retry.run_with_retry(session, fn)
+    session.rollback.assert_not_awaited()
@@ -0,0 +1,55 @@
+import asyncio
+import shutil
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from casa import models
+from casa.group_commit import GroupCommitter
+from database import create_sqlite_engines
+from tests.test_group_commit import transfer_req
+
+
+async def test_single_writer(session_factory, tmp_path):
+    primary_url = session_factory.kw["bind"].url
+    if primary_url.get_backend_name() != "sqlite":
+        pytest.skip("single writer mode is only for sqlite")
+
+    shutil.copy(primary_url.database, tmp_path / "casa.db")
+    writer, reader = create_sqlite_engines(f"sqlite+aiosqlite:///{tmp_path / 'casa.db'}", readers=4)
+    write_session = async_sessionmaker(expire_on_commit=False, class_=AsyncSession, bind=writer)
+    read_session = async_sessionmaker(expire_on_commit=False, class_=AsyncSession, bind=reader)
+
+    async with read_session() as session:
+        assert (await session.scalar(text("PRAGMA journal_mode"))) == "wal"
+        assert (await session.scalar(text("PRAGMA query_only"))) == 1
+        with pytest.raises(OperationalError):
+            await session.execute(text("DELETE FROM casa_transfer"))
+        total = await session.scalar(select(func.sum(models.Account.balance)))
+
+    committer = GroupCommitter(write_session, window_ms=5, max_size=50)
+    await committer.start()
+    requests = [
+        transfer_req(*(("1234567890", "0987654321") if i % 2 else ("0987654321", "1234567890")), 1.00)
+        for i in range(40)
+    ]
+
+    async def read_while_writing():
+        async with read_session() as session:
+            return await session.scalar(select(func.sum(models.Account.balance)))
+
+    results = await asyncio.gather(
+        *[committer.submit(req) for req in requests], *[read_while_writing() for _ in range(10)]
+    )
+    await committer.stop()
+
+    assert all(not isinstance(result, Exception) for result in results)
+    async with read_session() as session:
+        assert await session.scalar(select(func.sum(models.Account.balance))) == total
+        refs = [req.ref_id for req in requests]
+        assert await session.scalar(select(func.count()).filter(models.Transfer.ref_id.in_(refs))) == 40
+
+    await writer.dispose()
+    await reader.dispose()
@@ -0,0 +1,41 @@
+from casa import warmup
+
+
+async def test_ready_after_warm_up(client, session_factory, monkeypatch):
+    # the test client does not run the lifespan, so the worker never became ready
+    monkeypatch.setitem(warmup.state, "ready", None)
+    assert (await client.get("/ready")).status_code == 503
+
+    # the test engine stands in for the read engine too
+    engine = session_factory.kw["bind"]
+    elapsed = await warmup.warm_up(engine, session_factory, 2, engine, session_factory)
+    assert elapsed > 0
+    assert warmup.state["warmup_seconds"] == elapsed
+
+    warmup.mark_ready()
+    response = await client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+
+    # the first api request has been timed by the middleware
+    assert (await client.get("/api/casa/accounts/1234567890")).status_code == 200
+    assert warmup.state["first_request_seconds"] is not None
+    assert "casa_warmup_seconds" in (await client.get("/metrics")).text
+
+
+async def test_first_request_timer_ignores_probes(monkeypatch):
+    monkeypatch.setitem(warmup.state, "first_request_seconds", None)
+    monkeypatch.setitem(warmup.state, "first_fast_request_seconds", None)
+
+    async def app(scope, receive, send):
+        pass
+
+    timer = warmup.FirstRequestTimer(app, fast_seconds=1.0)
+    for path in ["/ready", "/metrics"]:
+        await timer({"type": "http", "path": path}, None, None)
+    assert warmup.state["first_fast_request_seconds"] is None
+
+    await timer({"type": "http", "path": "/api/casa/accounts/1234567890"}, None, None)
+    assert warmup.state["first_request_seconds"] is not None
+    assert warmup.state["first_fast_request_seconds"] is not None
+    assert timer.done